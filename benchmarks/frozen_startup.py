@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Benchmark of startup time and memory of marshalled and deep-frozen modules
+
+Usage:
+    python benchmarks/frozen_startup.py [--imports json,asyncio,email.parser] [--runs 20]
+
+The pure python modules loaded by the imports are frozen in both formats and linked into two launchers with cmake,
+each launcher is run several times to import them. Peak RSS is only reported on POSIX,
+private memory (not shared with other processes) only on Linux.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import json
+import subprocess
+import statistics
+
+from tfreezer import freeze_module, deepfreeze_module
+
+CMAKE_LISTS = """\
+cmake_minimum_required(VERSION 3.15)
+project(frozen_startup C)
+find_package(Python3 COMPONENTS Development REQUIRED)
+file(GLOB MARSHAL_SOURCES ${CMAKE_SOURCE_DIR}/marshal/*.c)
+file(GLOB DEEPFREEZE_SOURCES ${CMAKE_SOURCE_DIR}/deepfreeze/*.c)
+add_executable(marshal_launcher ${MARSHAL_SOURCES})
+add_executable(deepfreeze_launcher ${DEEPFREEZE_SOURCES})
+target_link_libraries(marshal_launcher PRIVATE Python3::Python)
+target_link_libraries(deepfreeze_launcher PRIVATE Python3::Python)
+"""
+
+LAUNCHER_MAIN = """\
+#include "Python.h"
+{declarations}
+
+static struct _frozen frozen_modules[] = {{
+{module_infos}
+    {{0, 0, 0}}  /* sentinel */
+}};
+
+int main(int argc, char **argv)
+{{
+    PyImport_FrozenModules = frozen_modules;
+    Py_InitializeEx(0);
+    int result = PyRun_SimpleString(argv[1]);
+    Py_Finalize();
+    return result;
+}}
+"""
+
+# Imports the modules and prints the time spent in milliseconds, and private memory in KB on Linux
+IMPORT_SCRIPT = """\
+import sys, time
+t0 = time.perf_counter()
+{imports}
+elapsed = (time.perf_counter() - t0) * 1000
+private = 0
+try:
+    with open("/proc/self/smaps_rollup") as fp:
+        for line in fp:
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                private += int(line.split()[1])
+except OSError:
+    pass
+sys.stdout.write(f"{{elapsed}} {{private}}")
+"""
+
+
+def get_source_modules(imports: list[str]) -> dict[str, tuple[str, bool]]:
+    """
+    Get pure python modules loaded by the imports in a clean interpreter, modules frozen by CPython are skipped
+    Returns:
+        {module name: (source path, is package)}
+    """
+    script = (
+        f"import sys, json\nimport {', '.join(imports)}\n"
+        "print(json.dumps({name: (module.__file__, hasattr(module, '__path__')) for name, module in sys.modules.items() "
+        "if getattr(module, '__file__', None) and module.__file__.endswith('.py') and module.__spec__.origin != 'frozen'}))"
+    )
+    modules = json.loads(subprocess.check_output([sys.executable, "-c", script]))
+    return {name: (path, is_package) for name, (path, is_package) in modules.items()}
+
+
+def write_launchers(source_dir: str, modules: dict[str, tuple[str, bool]]) -> None:
+    for frozen_format in ("marshal", "deepfreeze"):
+        os.makedirs(os.path.join(source_dir, frozen_format))
+    marshal_declarations, marshal_infos, deepfreeze_declarations, deepfreeze_infos = [], [], [], []
+    for name, (path, is_package) in modules.items():
+        text = freeze_module.read_text(path)
+        header = os.path.join(source_dir, "marshal", f"{name}.h")
+        freeze_module.write_frozen(header, path, name, freeze_module.compile_and_marshal(name, text))
+        varname = freeze_module.get_varname(name, "_Py_M__")
+        marshal_declarations.append(f'#include "{name}.h"')
+        marshal_infos.append(f'    {{"{name}", {varname}, (int)sizeof({varname}), {int(is_package)}}},')
+        deepfreeze_module.deep_freeze(name, text, os.path.join(source_dir, "deepfreeze", f"{name}.c"))
+        getter = deepfreeze_module.get_getter_name(name)
+        deepfreeze_declarations.append(f"PyObject *{getter}(void);")
+        deepfreeze_infos.append(f'    {{"{name}", NULL, 0, {int(is_package)}, {getter}}},')
+    for frozen_format, declarations, module_infos in (
+        ("marshal", marshal_declarations, marshal_infos),
+        ("deepfreeze", deepfreeze_declarations, deepfreeze_infos),
+    ):
+        with open(os.path.join(source_dir, frozen_format, "main.c"), "w", encoding="utf-8") as fp:
+            fp.write(LAUNCHER_MAIN.format(declarations="\n".join(declarations), module_infos="\n".join(module_infos)))
+    with open(os.path.join(source_dir, "CMakeLists.txt"), "w", encoding="utf-8") as fp:
+        fp.write(CMAKE_LISTS)
+
+
+def find_launcher(build_dir: str, name: str) -> str:
+    for root, _, files in os.walk(build_dir):
+        for file_name in files:
+            if file_name in (name, f"{name}.exe"):
+                return os.path.join(root, file_name)
+    raise FileNotFoundError(name)
+
+
+def run_launcher(launcher: str, script: str) -> tuple[float, float, int, int]:
+    """
+    Returns:
+        (wall time in ms, import time in ms, peak RSS in KB, private memory in KB), memory is 0 if not supported
+    """
+    env = os.environ.copy()
+    env["PYTHONPATH"] = ""  # modules must come from the launcher
+    t0 = time.perf_counter()
+    process = subprocess.Popen([launcher, script], stdout=subprocess.PIPE, env=env)  # pylint: disable=consider-using-with
+    stdout = process.stdout.read()
+    process.stdout.close()
+    peak_rss = 0
+    if hasattr(os, "wait4"):
+        # Resource usage of this child only
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        peak_rss = rusage.ru_maxrss
+    else:
+        process.wait()
+    wall_time = (time.perf_counter() - t0) * 1000
+    if process.returncode:
+        raise RuntimeError(f"{launcher} exited with code {process.returncode}")
+    import_time, private_memory = stdout.split()
+    return wall_time, float(import_time), peak_rss, int(private_memory)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--imports", type=str, default="json,asyncio,email.parser,http.client,argparse,dataclasses,typing,logging")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    if not deepfreeze_module.is_supported():
+        print(f"deepfreeze doesn't support python {sys.version_info[0]}.{sys.version_info[1]}")
+        return
+
+    imports = args.imports.split(",")
+    modules = get_source_modules(imports)
+    script = IMPORT_SCRIPT.format(imports="\n".join(f"import {name}" for name in imports))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "src")
+        build_dir = os.path.join(temp_dir, "build")
+        write_launchers(source_dir, modules)
+        configure_args = ["cmake", "-S", source_dir, "-B", build_dir, f"-DPython3_ROOT_DIR={sys.base_prefix}", "-DCMAKE_BUILD_TYPE=Release"]
+        subprocess.check_call(configure_args, stdout=subprocess.DEVNULL)
+        subprocess.check_call(["cmake", "--build", build_dir, "--config", "Release", "--parallel"], stdout=subprocess.DEVNULL)
+        print(f"modules: {len(modules)}, runs: {args.runs}")
+        launchers = {frozen_format: find_launcher(build_dir, f"{frozen_format}_launcher") for frozen_format in ("marshal", "deepfreeze")}
+        results: dict[str, list[tuple[float, float, int, int]]] = {frozen_format: [] for frozen_format in launchers}
+        for launcher in launchers.values():
+            run_launcher(launcher, script)  # warm up the file system cache
+        for _ in range(args.runs):
+            # Interleaved so that both formats suffer the same noise
+            for frozen_format, launcher in launchers.items():
+                results[frozen_format].append(run_launcher(launcher, script))
+        for frozen_format, launcher in launchers.items():
+            wall_times, import_times, peak_rss, private_memory = zip(*results[frozen_format])
+            line = (
+                f"{frozen_format:<10} process: {statistics.median(wall_times):7.2f} ms (min {min(wall_times):7.2f})  "
+                f"imports: {statistics.median(import_times):7.2f} ms (min {min(import_times):7.2f})  "
+                f"binary: {os.path.getsize(launcher) / 1024:.0f} KB"
+            )
+            if max(peak_rss):
+                line += f"  peak RSS: {statistics.median(peak_rss) / 1024:.1f} MB"
+            if max(private_memory):
+                line += f"  private: {statistics.median(private_memory) / 1024:.1f} MB"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Benchmark of the time from process start to the execution of the entry module for startup profiles
+
+Usage:
+    python benchmarks/startup_profile.py [--imports json] [--runs 20]
+
+An entry module importing the given modules is analyzed with every startup profile, the modules found are frozen
+and linked into a launcher per profile with cmake, the launchers initialize CPython like cppsrc/main.cpp.
+The entry module reports when it starts and how many modules are loaded at that point.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+from tfreezer import config, freeze_module, generate_frozen_modules
+
+CMAKE_LISTS = """\
+cmake_minimum_required(VERSION 3.15)
+project(startup_profile C)
+find_package(Python3 COMPONENTS Development REQUIRED)
+"""
+
+CMAKE_LAUNCHER = """\
+add_executable({profile}_launcher ${{CMAKE_SOURCE_DIR}}/{profile}/main.c)
+target_include_directories({profile}_launcher PRIVATE ${{CMAKE_SOURCE_DIR}}/{profile})
+target_link_libraries({profile}_launcher PRIVATE Python3::Python)
+"""
+
+LAUNCHER_MAIN = """\
+#include "Python.h"
+{declarations}
+
+static struct _frozen frozen_modules[] = {{
+{module_infos}
+    {{0, 0, 0}}  /* sentinel */
+}};
+
+int main(int argc, char **argv)
+{{
+    PyStatus status;
+    PyConfig config;
+    PyObject *module;
+
+    PyImport_FrozenModules = frozen_modules;
+    PyConfig_InitPythonConfig(&config);
+    /* The same as cppsrc/main.cpp */
+    config.module_search_paths_set = 1;
+    config.write_bytecode = 0;
+    config.parse_argv = 0;
+    config.site_import = {site_import};
+    status = PyConfig_SetBytesArgv(&config, argc, argv);
+    if (!PyStatus_Exception(status)) {{
+        status = Py_InitializeFromConfig(&config);
+    }}
+    PyConfig_Clear(&config);
+    if (PyStatus_Exception(status)) {{
+        Py_ExitStatusException(status);
+    }}
+    module = PyImport_ImportModule("tf_bootstrap");
+    if (module != NULL) {{
+        Py_DECREF(module);
+        module = PyImport_ImportModule("__tfreezer_main__");
+    }}
+    if (module == NULL) {{
+        PyErr_Print();
+        return 1;
+    }}
+    Py_DECREF(module);
+    return Py_FinalizeEx() < 0 ? 120 : 0;
+}}
+"""
+
+# Reports the wall clock time when the entry module starts and the number of modules loaded before it
+ENTRY_SCRIPT = """\
+import sys
+import time
+entered = time.time()
+loaded = len(sys.modules)
+{imports}
+sys.stdout.write(f"{{entered}} {{loaded}}")
+"""
+
+
+def write_launcher(source_dir: str, profile: str, entry_path: str) -> int:
+    """
+    Analyze and freeze modules of the entry module with a startup profile
+    Returns:
+        number of frozen modules
+    """
+    analysis_info = generate_frozen_modules.ModuleAnalysisInfo(entry_path, [], [], [], startup_profile=profile)
+    modules = generate_frozen_modules.analyze_module(analysis_info, generate_frozen_modules.ModuleType.SOURCE_MODULE)
+    profile_dir = os.path.join(source_dir, profile)
+    os.makedirs(profile_dir)
+    declarations, module_infos = [], []
+    for name, module in sorted(modules.items()):
+        if generate_frozen_modules.is_frozen_module(name):
+            continue
+        text = freeze_module.read_text(module.__file__)
+        freeze_module.write_frozen(
+            os.path.join(profile_dir, f"frozen_{name}.h"), module.__file__, name, freeze_module.compile_and_marshal(name, text)
+        )
+        varname = freeze_module.get_varname(name, "_Py_M__")
+        declarations.append(f'#include "frozen_{name}.h"')
+        module_infos.append(f'    {{"{name}", {varname}, (int)sizeof({varname}), {int(module.__path__ is not None)}}},')
+    with open(os.path.join(profile_dir, "main.c"), "w", encoding="utf-8") as fp:
+        site_import = int(profile != "minimal")
+        fp.write(LAUNCHER_MAIN.format(declarations="\n".join(declarations), module_infos="\n".join(module_infos), site_import=site_import))
+    return len(module_infos)
+
+
+def find_launcher(build_dir: str, name: str) -> str:
+    for root, _, files in os.walk(build_dir):
+        for file_name in files:
+            if file_name in (name, f"{name}.exe"):
+                return os.path.join(root, file_name)
+    raise FileNotFoundError(name)
+
+
+def run_launcher(launcher: str) -> tuple[float, float, int]:
+    """
+    Returns:
+        (time to the entry module in ms, wall time of the process in ms, modules loaded before the entry module)
+    """
+    start_time = time.time()
+    t0 = time.perf_counter()
+    stdout = subprocess.check_output([launcher], cwd=os.path.dirname(launcher))
+    wall_time = (time.perf_counter() - t0) * 1000
+    entered, loaded = stdout.split()
+    return (float(entered) - start_time) * 1000, wall_time, int(loaded)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--imports", type=str, default="json")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "src")
+        build_dir = os.path.join(temp_dir, "build")
+        os.makedirs(source_dir)
+        entry_path = os.path.join(temp_dir, "main.py")
+        with open(entry_path, "w", encoding="utf-8") as fp:
+            fp.write(ENTRY_SCRIPT.format(imports="\n".join(f"import {name}" for name in args.imports.split(",") if name)))
+        frozen_counts = {profile: write_launcher(source_dir, profile, entry_path) for profile in config.STARTUP_PROFILES}
+        with open(os.path.join(source_dir, "CMakeLists.txt"), "w", encoding="utf-8") as fp:
+            fp.write(CMAKE_LISTS + "".join(CMAKE_LAUNCHER.format(profile=profile) for profile in config.STARTUP_PROFILES))
+        configure_args = ["cmake", "-S", source_dir, "-B", build_dir, f"-DPython3_ROOT_DIR={sys.base_prefix}", "-DCMAKE_BUILD_TYPE=Release"]
+        subprocess.check_call(configure_args, stdout=subprocess.DEVNULL)
+        subprocess.check_call(["cmake", "--build", build_dir, "--config", "Release", "--parallel"], stdout=subprocess.DEVNULL)
+        print(f"imports: {args.imports}, runs: {args.runs}")
+        launchers = {profile: find_launcher(build_dir, f"{profile}_launcher") for profile in config.STARTUP_PROFILES}
+        results: dict[str, list[tuple[float, float, int]]] = {profile: [] for profile in launchers}
+        for launcher in launchers.values():
+            run_launcher(launcher)  # warm up the file system cache
+        for _ in range(args.runs):
+            # Interleaved so that both profiles suffer the same noise
+            for profile, launcher in launchers.items():
+                results[profile].append(run_launcher(launcher))
+        for profile in launchers:
+            entry_times, wall_times, loaded = zip(*results[profile])
+            print(
+                f"{profile:<8} to entry: {statistics.median(entry_times):6.2f} ms (min {min(entry_times):6.2f})  "
+                f"process: {statistics.median(wall_times):6.2f} ms (min {min(wall_times):6.2f})  "
+                f"modules at entry: {loaded[0]}  frozen modules: {frozen_counts[profile]}"
+            )
+
+
+if __name__ == "__main__":
+    main()
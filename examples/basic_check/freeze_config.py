@@ -25,3 +25,35 @@ excludes = [
     "select",
     "unicodedata",
 ]
+
+# How frozen modules are stored: "marshal" (default) or "deepfreeze",
+# deepfreeze writes code objects as static C data so that they aren't unmarshalled at import time,
+# see benchmarks/frozen_startup.py for its effect on startup time and memory
+frozen_format = "marshal"
+
+# Freeze modules in worker processes while the analysis is still finding them,
+# a cold build takes about as long as the longer of the two instead of their sum
+streaming_freeze = False
+
+# Freeze the standard library once per interpreter into a library in the shared cache directory, one of:
+# "none" (frozen with the application), "static" (only modules the application needs are linked),
+# "shared" (one library loaded by all applications, its table is merged with the one of the application at startup)
+frozen_stdlib_library = "none"
+
+# Imports guarded by conditions that are false on this interpreter aren't followed, e.g. if sys.platform == "win32":,
+# if sys.version_info < (3, 10): and if TYPE_CHECKING:, they are listed in <build directory>/pruned_imports
+prune_guarded_imports = True
+
+# "default" or "minimal", the minimal profile skips site, only modules needed to reach the entry module are frozen with it,
+# imports under `if __name__ == "__main__":` of other modules aren't followed, exit() and help() are unavailable
+startup_profile = "default"
+
+# Write an index of the deployed extension modules, the application finds them with it instead of scanning directories,
+# the working directory and sys.path entries at startup aren't searched, entries added at runtime still are
+sealed_imports = True
+
+# Content-addressed cache of frozen modules, mypyc sources and analysis results, generated files don't contain
+# machine-specific paths, so builds on other machines hit it too: "" (disabled), "local" (in the shared cache directory),
+# a directory, e.g. on a network filesystem, or the url of a cache server, e.g. python -m tfreezer.build_cache --serve <dir>
+# The environment variable TFREEZER_BUILD_CACHE overrides it
+build_cache = ""
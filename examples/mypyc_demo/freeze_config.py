@@ -29,4 +29,13 @@ excludes = [
     "unicodedata",
 ]
 
+# Exact module names or fnmatch patterns, e.g. "subpackage.*" compiles all submodules of subpackage.
+# Modules that mypyc can't compile fall back to normal freezing.
 mypyc_modules = ["fib", "fib2", "subpackage.fib3"]
+
+# "single": all modules in one group (default), "package": one group per top-level package, "module": one group per module
+mypyc_grouping = "single"
+
+# Modules compiled with Cython (requires tfreezer[cython]), .py modules or .pyx modules found in sys.path.
+# Imports of .pyx modules are not analyzed, add them to hidden_imports.
+cython_modules = []
@@ -35,3 +35,10 @@ qt_modules = [
     "PyQt5.sip",
     "PyQt5.QtWidgets",
 ]
+
+qt_plugins = [
+    "platforms/qwindows",
+    "platforms/qxcb",
+    "platforms/qcocoa",
+    "styles",
+]
@@ -23,3 +23,10 @@ excludes = [
     "_wmi",
     "pyexpat",
 ]
+
+# Link extensions into the executable instead of deploying them as shared objects.
+# CPython modules are built from the Modules/ directory of cpython_source_dir, which must match the running python.
+# Dicts specify the build info of other extensions, or extend the build info of CPython modules, e.g. OpenSSL of _ssl:
+# {"name": "_ssl", "include_dirs": ["<openssl>/include"], "library_dirs": ["<openssl>/lib"], "libraries": ["libssl", "libcrypto"]}
+static_extensions = []
+cpython_source_dir = ""
@@ -6,9 +6,11 @@ import typing as _t
 import sys
 import os
 import argparse
+import functools
+import shutil
 import multiprocessing
 
-from tfreezer import paths, log, config, utils
+from tfreezer import paths, log, config, utils, build_manifest, orchestrator, build_cache
 
 
 class _ArgumentNamespace(argparse.Namespace):
@@ -32,7 +34,7 @@ def get_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument("--appversion", type=str, default="1.0.0")
     parser.add_argument("--appname", type=str, default="")
     parser.add_argument("--appicon", type=str, default="")
-    parser.add_argument("--variant", type=str, choices=["debug", "release"], default="release")
+    parser.add_argument("--variant", type=str, choices=["debug", "release", "dev"], default="release")
     parser.add_argument("--distpath", type=str, default="")
     parser.add_argument("--workpath", type=str, default="")
     parser.add_argument("--entry-module", type=str, default="")
@@ -71,20 +73,25 @@ def _setup_paths(args: _ArgumentNamespace) -> None:
     paths.dump_paths()
 
 
-def _cmake_configure(args: _ArgumentNamespace) -> None:
+def _check_cmake() -> None:
     if not paths.CMAKE_EXE:
         log.logger.error("CMake is not installed in your computer.")
         sys.exit(1)
     if not paths.APP_ROOT:
         log.logger.error("approot is not set. Please set it through --approot.")
         sys.exit(1)
-    debug = args.variant == "debug"
+
+
+async def _cmake_configure(args: _ArgumentNamespace, remove_cache: bool = True) -> int:
+    # The dev variant loads modules of the application from their sources, edits don't need to be frozen again
+    debug = args.variant in ("debug", "dev")
     freeze_config = config.dump_freeze_config(
         entry_module=args.entry_module,
         hidden_imports=args.hidden_imports,
         excludes=args.excludes,
         mypyc_modules=args.mypyc_modules,
         config_file=args.config_file,
+        dev_overlay=args.variant == "dev",
     )
     config.dump_python_path()
     app_name = args.appname
@@ -106,6 +113,8 @@ def _cmake_configure(args: _ArgumentNamespace) -> None:
         "Visual Studio 17 2022",
         f"-DNEED_CONSOLE={'ON' if debug else 'OFF'}",
         "-DFREEZE_APPLICATION=ON",
+        # Assembled by the assemble stage, see _create_build_graph
+        "-DTF_ASSEMBLE_POST_BUILD=OFF",
         f"-DPYTHON_EXECUTABLE={python_exe}",
         f"-DTF_APPROOT_DIR={app_root}",
         f"-DTF_BUILD_DIR={build_dir}",
@@ -116,22 +125,14 @@ def _cmake_configure(args: _ArgumentNamespace) -> None:
         f"-DPROJECT_ICON={args.appicon}",
     ]
     cmake_cache = os.path.join(paths.BUILD_DIR, "CMakeCache.txt")
-    if os.path.isfile(cmake_cache):
+    if remove_cache and os.path.isfile(cmake_cache):
         log.logger.debug("CMakeCache.txt exists, pending to remove it.")
         os.remove(cmake_cache)
     log.logger.info("CMake: Configure")
-    returncode = utils.call_subprocess(cmake_args, cwd=paths.APP_ROOT)
-    if returncode:
-        sys.exit(returncode)
+    return await utils.call_subprocess_async(cmake_args, cwd=paths.APP_ROOT, log_prefix="[configure] ")
 
 
-def _cmake_build(args: _ArgumentNamespace) -> None:
-    if not paths.CMAKE_EXE:
-        log.logger.error("CMake is not installed in your computer.")
-        sys.exit(1)
-    if not paths.APP_ROOT:
-        log.logger.error("approot is not set. Please set it through --approot.")
-        sys.exit(1)
+async def _cmake_build() -> int:
     cmake_args = [
         paths.CMAKE_EXE,
         "--build",
@@ -142,9 +143,118 @@ def _cmake_build(args: _ArgumentNamespace) -> None:
         f"-maxCpuCount:{multiprocessing.cpu_count()}",
     ]
     log.logger.info("CMake: Build")
-    returncode = utils.call_subprocess(cmake_args, cwd=paths.APP_ROOT)
-    if returncode:
-        sys.exit(returncode)
+    return await utils.call_subprocess_async(cmake_args, cwd=paths.APP_ROOT, log_prefix="[compile] ")
+
+
+def _get_build_file(*names: str) -> str:
+    return os.path.join(paths.BUILD_DIR, *names)
+
+
+def _get_application_args() -> list[str]:
+    """
+    Arguments of the application dumped at configure time, the same as cmake passes to the build commands
+    """
+    return [
+        _get_build_file("entry_module"),
+        f"--hidden-imports={_get_build_file('hidden_imports')}",
+        f"--excludes={_get_build_file('excludes')}",
+    ]
+
+
+def _get_generator_args(option: str) -> list[str]:
+    return [paths.PYTHON_EXE, "-m", "tfreezer.generate_frozen_modules", option, paths.BUILD_DIR]
+
+
+async def _analyze() -> int:
+    if utils.is_output_up_to_date(_get_build_file("analysis.stamp"), _get_build_file("depfiles", "analysis.d")):
+        log.logger.info("Analysis is up to date.")
+        return 0
+    analysis_args = _get_generator_args("--analyze") + _get_application_args()
+    analysis_args.append(f"--mypyc-modules={_get_build_file('mypyc_modules')}")
+    return await utils.call_subprocess_async(analysis_args, cwd=paths.APP_ROOT, log_prefix="[analysis] ")
+
+
+async def _make_mypyc() -> int:
+    mypyc_module_cache = _get_build_file("mypyc_module_cache")
+    if utils.is_output_up_to_date(_get_build_file("mypyc.stamp"), _get_build_file("depfiles", "mypyc.d"), [mypyc_module_cache]):
+        log.logger.info("mypyc sources are up to date.")
+        return 0
+    return await utils.call_subprocess_async(_get_generator_args("--make-mypyc"), cwd=paths.APP_ROOT, log_prefix="[mypyc] ")
+
+
+async def _freeze() -> int:
+    """
+    Freeze shards of frozen modules concurrently, only the shards whose modules change
+    """
+    with open(_get_build_file("frozen_headers"), "r", encoding="utf-8") as fp:
+        shard_sources = fp.read().strip().split(";")[1:]
+    commands = []
+    for shard_source in shard_sources:
+        shard_name = os.path.splitext(os.path.basename(shard_source))[0]
+        shard_modules = f"{os.path.splitext(shard_source)[0]}.modules"
+        if utils.is_output_up_to_date(shard_source, _get_build_file("depfiles", f"{shard_name}.d"), [shard_modules]):
+            continue
+        commands.append((shard_name, _get_generator_args("--make-freeze-shard") + [shard_name.rpartition("_")[-1]]))
+    log.logger.info("Freezing %d of %d shards.", len(commands), len(shard_sources))
+    return await orchestrator.run_commands(commands, cwd=paths.APP_ROOT)
+
+
+def _get_assemble_args() -> list[str]:
+    assemble_args = [paths.PYTHON_EXE, "-m", "tfreezer.assemble_application", paths.BUILD_DIR] + _get_application_args()
+    assemble_args.append(f"--datas={_get_build_file('datas')}")
+    return assemble_args
+
+
+async def _resolve_dependencies() -> int:
+    resolve_args = _get_assemble_args() + ["--resolve-dependencies"]
+    return await utils.call_subprocess_async(resolve_args, cwd=paths.APP_ROOT, log_prefix="[resolve_dependencies] ")
+
+
+async def _assemble() -> int:
+    # The executable and the python library, generated by cmake
+    with open(_get_build_file("assemble_binaries_Release"), "r", encoding="utf-8") as fp:
+        binaries = fp.read().strip()
+    assemble_args = _get_assemble_args() + [f"--binaries={binaries}", "--reuse-resolved-dependencies"]
+    returncode = await utils.call_subprocess_async(assemble_args, cwd=paths.APP_ROOT, log_prefix="[assemble] ")
+    if not returncode:
+        shutil.copy(binaries.rpartition(",")[-1], paths.DEPLOY_DIR)
+    return returncode
+
+
+def _create_build_graph(args: _ArgumentNamespace, configure: bool, remove_cache: bool) -> orchestrator.StageGraph:
+    """
+    Stages run the same commands as the cmake build, cmake finds their outputs up to date and only compiles.
+    Freezing overlaps mypyc, and dependencies of the application are resolved while compiling
+    """
+    graph = orchestrator.StageGraph()
+    setup_stages = []
+    if configure:
+        graph.add_stage("configure", functools.partial(_cmake_configure, args, remove_cache))
+        setup_stages.append("configure")
+    graph.add_stage("analysis", _analyze, setup_stages)
+    graph.add_stage("mypyc", _make_mypyc, ["analysis"])
+    graph.add_stage("freeze", _freeze, ["analysis"])
+    graph.add_stage("compile", _cmake_build, ["mypyc", "freeze"])
+    if sys.platform == "win32":
+        # The same as TF_ASSEMBLE_POST_BUILD in CMakeLists.txt
+        graph.add_stage("resolve_dependencies", _resolve_dependencies, setup_stages)
+        graph.add_stage("assemble", _assemble, ["compile", "resolve_dependencies"])
+    return graph
+
+
+def _build(args: _ArgumentNamespace, configure: bool, remove_cache: bool) -> int:
+    build_cache.clear_stats()
+    returncode = _create_build_graph(args, configure, remove_cache).run()
+    # Each build command may change its plan files, so a stable plan is reached after one retry per plan file at most
+    for _ in range(len(build_manifest.BUILD_PLAN_FILES)):
+        if not returncode or not build_manifest.pop_build_plan_changed():
+            break
+        # Sources of mypyc, Cython or frozen modules changed, cmake configures with the new plan
+        log.logger.info("The build plan changed, configure and build again.")
+        returncode = _create_build_graph(args, configure=True, remove_cache=False).run()
+    # Every build command reports its hits to the stats file
+    build_cache.report_stats()
+    return returncode
 
 
 def main() -> int:
@@ -155,13 +265,30 @@ def main() -> int:
 
         # set app paths
         _setup_paths(args)
+        _check_cmake()
 
-        _cmake_configure(args)
-        _cmake_build(args)
+        manifest = build_manifest.compute_manifest(vars(args), args.config_file)
+        changed_sections = build_manifest.get_changed_sections(manifest)
+        if not changed_sections:
+            log.logger.info("Nothing changed since the last build, %s is up to date.", paths.DEPLOY_DIR)
+            return 0
+        log.logger.info("Changed since the last build: %s", ", ".join(changed_sections))
+        build_manifest.remove_manifest()
+        cmake_cache = os.path.join(paths.BUILD_DIR, "CMakeCache.txt")
+        # The CMake cache is only stale if the toolchain changes, otherwise reconfiguring reuses it
+        configure = not os.path.isfile(cmake_cache) or any(
+            section not in build_manifest.BUILD_GRAPH_SECTIONS for section in changed_sections
+        )
+        remove_cache = any(section in changed_sections for section in build_manifest.TOOLCHAIN_SECTIONS)
+        returncode = _build(args, configure, remove_cache)
+        if returncode:
+            return returncode
+        # The analysis of this build may have found other files
+        manifest["dependencies"] = build_manifest.digest_dependencies()
+        build_manifest.dump_manifest(manifest)
         return 0
     except KeyboardInterrupt:
         log.logger.info("Keyboard Interrupt.")
-        utils.close_all_log_pipe()
         return 1
 
 
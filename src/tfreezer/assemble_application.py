@@ -10,25 +10,23 @@ import sys
 import os
 import re
 import types
+import copy
 import typing as _t
 import dataclasses
 import site
 import shutil
 import modulefinder
 import itertools
-import importlib
+import fnmatch
 from importlib import machinery
 
 
-from PyInstaller import hooks
 from PyInstaller.building import build_main
-from PyInstaller.utils import misc
-from PyInstaller.utils.hooks import qt
 
 if os.environ.get("DEBUG"):
     import debugpy
 
-from tfreezer import generate_frozen_modules, log, utils, paths, config
+from tfreezer import generate_frozen_modules, log, utils, paths, config, hook_registry, qml_index, qt_manifest
 
 
 @dataclasses.dataclass
@@ -46,6 +44,11 @@ class AssembleInfo:
     datas: list[str]  # list all needed datas
     qt_modules: list[str]  # list all used Qt module, e.g. PySide6.QtCore, PySide6.QtGui
     qt_quick_control_styles: list[str]  # list all needed QtQuick.Control stypes
+    hook_dirs: list[str] = dataclasses.field(default_factory=list)  # user hook directories
+    qt_plugins: list[str] = dataclasses.field(default_factory=list)  # allow-list of Qt plugins, e.g. platforms/qwindows, styles
+    qt_plugin_trace: str = ""  # file recorded with QT_DEBUG_PLUGINS=1 that lists the Qt plugins loaded at runtime
+    static_extensions: list[str] = dataclasses.field(default_factory=list)  # extension modules linked into the executable
+    sealed_imports: bool = True  # write the extension module index for TfSealedFinder, see bootstrap/tf_importer.py
     ignore_platform_dynload = False
     static_python = False
 
@@ -70,7 +73,7 @@ class QtQmlModuleInfo:
 
 class PyiQtHookModule(types.ModuleType):
     """
-    Type helper class for PyInstaller Qt hook modules
+    Type helper class for hook modules
     """
 
     hiddenimports: list[str]
@@ -108,34 +111,6 @@ def is_qtquick_application(assemble_info: AssembleInfo) -> bool:
     return any(module_name in assemble_info.qt_modules for module_name in names)
 
 
-def import_pyi_qt_hooks(fullname: str) -> PyiQtHookModule:
-    """
-    import PyInstaller Qt hook modules
-    Args:
-        name: fullname of Qt module
-    Returns:
-        PyiQtHookModule
-    """
-    hooks_dir = os.path.dirname(hooks.__file__)
-    module_path = os.path.join(hooks_dir, f"hook-{fullname}.py")
-    real_fullname = f"PyInstaller.hooks.{fullname}"
-    return utils.load_signle_module(real_fullname, module_path)
-
-
-def import_tfreezer_hook(fullname: str) -> PyiQtHookModule:
-    """
-    import tfreezer hooks
-    Args:
-        name: fullname of the module
-    Returns:
-        PyiQtHookModule
-    """
-    tfreezer_dir = os.path.dirname(__file__)
-    module_path = os.path.join(tfreezer_dir, "hooks", f"hook-{fullname}.py")
-    real_fullname = f"tfreezer.hooks.{fullname}"
-    return utils.load_signle_module(real_fullname, module_path)
-
-
 def get_used_qml_module_names(dir_path: str) -> list[str]:
     """
     Get qml module names that are used in a directory
@@ -144,19 +119,7 @@ def get_used_qml_module_names(dir_path: str) -> list[str]:
     Returns:
         list: module names
     """
-    imports = []
-    for root, _, file_names in os.walk(dir_path):
-        for file_name in file_names:
-            if file_name.endswith(".qml"):
-                file_path = os.path.join(root, file_name)
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                # match: import <ModuleIdentifier> [<Version.Number>] [as <Qualifier>]
-                pattern = re.compile(r"^import\s+([a-zA-Z][a-zA-Z0-9_\.]*)\s*", re.M)
-                file_imports = pattern.findall(content)
-                temp_list = [item for item in file_imports if item not in imports]
-                imports.extend(temp_list)
-    return imports
+    return qml_index.scan_qml_imports(dir_path)
 
 
 def get_all_qtqml_modules(qt_library_name: str, qt_quick_control_styles: None | list[str] = None) -> dict[str, QtQmlModuleInfo]:
@@ -168,38 +131,27 @@ def get_all_qtqml_modules(qt_library_name: str, qt_quick_control_styles: None |
     Returns:
         dict: key is module fullname, value is the module info of the qtqml module
     """
-    library_info = qt.get_qt_library_info(qt_library_name)
-    if "QmlImportsPath" in library_info.location:
-        qml_src_dir = library_info.location["QmlImportsPath"]
+    manifest = qt_manifest.load_qt_manifest(qt_library_name)
+    if "QmlImportsPath" in manifest.location:
+        qml_src_dir = manifest.location["QmlImportsPath"]
     else:
-        qml_src_dir = library_info.location["Qml2ImportsPath"]
+        qml_src_dir = manifest.location["Qml2ImportsPath"]
     qml_modules = {}
-    folders = []
-    for qml_plugin_file in misc.dlls_in_subdirs(qml_src_dir):
-        folders.append([os.path.dirname(qml_plugin_file), os.path.normpath(qml_plugin_file)])
-    for dirpath, dll_file in folders:
-        qmldir_path = os.path.normpath(os.path.join(dirpath, "qmldir"))
-        with open(qmldir_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        # match: module <ModuleIdentifier>
-        pattern = re.compile(r"^module\s+(\S+)", re.M)
-        result = pattern.findall(content)
-        assert len(result) == 1, content
-        module_name = result[0]
-        # match: import <ModuleIdentifier> [auto]
-        import_pattern = re.compile(r"^import\s+([a-zA-Z][a-zA-Z0-9_\.]*)\s*", re.M)
-        import_modules = import_pattern.findall(content)
+    for module_name, entry in qml_index.load_qml_module_index(qml_src_dir).items():
+        import_modules = list(entry.import_modules)
         if module_name == "QtQuick.Controls" and qt_quick_control_styles:
             for style in qt_quick_control_styles:
                 # QtQuick.Controls submodules that are implicitly used by the application
                 import_modules.append(f"QtQuick.Controls.{style}")
-        info = QtQmlModuleInfo(module_name, dll_file, qmldir_path, import_modules)
-        qml_modules[module_name] = info
+        qml_modules[module_name] = QtQmlModuleInfo(module_name, entry.module_path, entry.qmldir_path, import_modules)
     return qml_modules
 
 
 def collect_needed_qtqml_files(
-    qt_library_name: str, dir_path: str, qt_quick_control_styles: None | list[str] = None
+    qt_library_name: str,
+    dir_path: str,
+    qt_quick_control_styles: None | list[str] = None,
+    qtqml_modules: None | dict[str, QtQmlModuleInfo] = None,
 ) -> set[QtQmlModuleInfo]:
     """
     Collect qtqml dll files that are needed
@@ -207,11 +159,13 @@ def collect_needed_qtqml_files(
         qt_library_name(str): PyQt5, PySide6
         dir_path (str): root directory path
         qt_quick_control_styles: QtQuick.Control styles that are used
+        qtqml_modules: result of get_all_qtqml_modules if it's already got
     Returns:
         All needed QtQmlModuleInfo
     """
     used_qml_module_names = get_used_qml_module_names(dir_path)
-    qtqml_modules = get_all_qtqml_modules(qt_library_name, qt_quick_control_styles)
+    if qtqml_modules is None:
+        qtqml_modules = get_all_qtqml_modules(qt_library_name, qt_quick_control_styles)
     if qt_quick_control_styles:
         for style in qt_quick_control_styles:
             fullname = f"QtQuick.Controls.{style}"
@@ -260,42 +214,151 @@ def collect_qt_webengine_extra_files(qt_library_name: str) -> tuple[list[tuple[s
     Returns:
         tuple: binaries, datas
     """
-    library_info = qt.get_qt_library_info(qt_library_name)
+    manifest = qt_manifest.load_qt_manifest(qt_library_name)
     binaries = []
     datas = []
     locales = "qtwebengine_locales"
     resources = "resources"
     # Translations
-    locales_dir = os.path.join(library_info.location["TranslationsPath"], locales)
+    locales_dir = os.path.join(manifest.location["TranslationsPath"], locales)
     for root, _, file_names in os.walk(locales_dir):
         for file_name in file_names:
             fullpath = os.path.join(root, file_name)
             datas.append(
                 (
                     fullpath,
-                    os.path.join(library_info.qt_rel_dir, "translations", locales),
+                    os.path.join(manifest.qt_rel_dir, "translations", locales),
                 )
             )
     # Resources
-    resources_dir = os.path.join(library_info.location["DataPath"], resources)
+    resources_dir = os.path.join(manifest.location["DataPath"], resources)
     for root, _, file_names in os.walk(resources_dir):
         for file_name in file_names:
             fullpath = os.path.join(root, file_name)
             datas.append(
                 (
                     fullpath,
-                    os.path.join(library_info.qt_rel_dir, resources),
+                    os.path.join(manifest.qt_rel_dir, resources),
                 )
             )
     # Helper process executable (QtWebEngineProcess), located in ``LibraryExecutablesPath``.
     dest = os.path.join(
-        library_info.qt_rel_dir,
-        os.path.relpath(library_info.location["LibraryExecutablesPath"], library_info.location["PrefixPath"]),
+        manifest.qt_rel_dir,
+        os.path.relpath(manifest.location["LibraryExecutablesPath"], manifest.location["PrefixPath"]),
     )
-    binaries.append((os.path.join(library_info.location["LibraryExecutablesPath"], "QtWebEngineProcess.exe"), dest))
+    binaries.append((os.path.join(manifest.location["LibraryExecutablesPath"], "QtWebEngineProcess.exe"), dest))
     return binaries, datas
 
 
+def get_qt_plugin_name(plugin_file: str, plugins_dir: str) -> str:
+    """
+    Get Qt plugin name: <plugin type>/<file name without extension>, e.g. platforms/qwindows, imageformats/libqjpeg
+    """
+    relpath = os.path.relpath(plugin_file, plugins_dir).replace("\\", "/")
+    return os.path.splitext(relpath)[0]
+
+
+def load_qt_plugin_trace(trace_file: str, plugins_dir: str) -> set[str]:
+    """
+    Get names of the Qt plugins that are loaded at runtime
+    Args:
+        trace_file: output of the application running with environment variable QT_DEBUG_PLUGINS=1,
+                    or a file that lists plugin file paths line by line
+        plugins_dir: PluginsPath of the Qt installation
+    Returns:
+        set: plugin names, e.g. platforms/qwindows
+    """
+    # match: loaded library "<path>" (Qt5) or "<path>" loaded library (Qt6)
+    loaded_pattern = re.compile(r'"([^"]+)"')
+    plugin_names = set()
+    with open(trace_file, "r", encoding="utf-8", errors="replace") as fp:
+        for line in fp:
+            line = line.strip()
+            if "loaded library" in line.lower():
+                plugin_paths = loaded_pattern.findall(line)
+            elif os.path.splitext(line)[1] in (".dll", ".so", ".dylib"):
+                plugin_paths = [line]
+            else:
+                continue
+            for plugin_path in plugin_paths:
+                # The application may be traced on another machine, so only keep the last two path components
+                plugin_path = plugin_path.replace("\\", "/")
+                plugin_type, _, file_name = plugin_path.rpartition("/")
+                plugin_type = plugin_type.rpartition("/")[-1]
+                plugin_names.add(get_qt_plugin_name(os.path.join(plugins_dir, plugin_type, file_name), plugins_dir))
+    return plugin_names
+
+
+def is_qt_plugin_selected(plugin_name: str, allow_list: list[str], traced: set[str]) -> bool:
+    """
+    Check whether a Qt plugin is selected by the allow-list or the runtime trace
+    Args:
+        plugin_name: <plugin type>/<file name without extension>
+        allow_list: plugin types or plugin name patterns, e.g. styles, platforms/qwindows, imageformats/*jpeg
+        traced: plugin names loaded at runtime
+    Returns:
+        bool
+    """
+    if plugin_name in traced:
+        return True
+    plugin_type, _, file_name = plugin_name.partition("/")
+    # qwindows.dll on Windows, libqxcb.so on Linux
+    short_name = f"{plugin_type}/{file_name[3:]}" if file_name.startswith("lib") else plugin_name
+    for pattern in allow_list:
+        if pattern == plugin_type or fnmatch.fnmatch(plugin_name, pattern) or fnmatch.fnmatch(short_name, pattern):
+            return True
+    return False
+
+
+def select_qt_plugins(binaries: set[tuple[str, str]], plugins_dir: str, assemble_info: AssembleInfo) -> set[tuple[str, str]]:
+    """
+    Remove Qt plugins that are neither in the allow-list nor in the runtime trace
+    Args:
+        binaries: (src, dest_dir) collected by PyInstaller Qt hooks
+        plugins_dir: PluginsPath of the Qt installation
+        assemble_info: the assemble info
+    Returns:
+        set: selected binaries
+    """
+    if not assemble_info.qt_plugins and not assemble_info.qt_plugin_trace:
+        return binaries
+    plugins_dir = os.path.normpath(plugins_dir)
+    traced = set()
+    if assemble_info.qt_plugin_trace:
+        traced = load_qt_plugin_trace(assemble_info.qt_plugin_trace, plugins_dir)
+        log.logger.info("Qt plugins in runtime trace: %s", sorted(traced))
+    result = set()
+    selected_names = set()
+    full_count = full_size = selected_size = 0
+    for src, dest_dir in binaries:
+        normalized_src = os.path.normpath(src)
+        if not normalized_src.startswith(plugins_dir + os.sep):
+            result.add((src, dest_dir))
+            continue
+        plugin_size = os.path.getsize(normalized_src) if os.path.isfile(normalized_src) else 0
+        full_count += 1
+        full_size += plugin_size
+        plugin_name = get_qt_plugin_name(normalized_src, plugins_dir)
+        if not is_qt_plugin_selected(plugin_name, assemble_info.qt_plugins, traced):
+            continue
+        result.add((src, dest_dir))
+        selected_names.add(plugin_name)
+        selected_size += plugin_size
+    if not any(name.startswith("platforms/") for name in selected_names):
+        log.logger.warning("No Qt platform plugin is selected, the application may fail to start.")
+    log.logger.info(
+        "Qt plugins: selected %d of %d (%.2f MB of %.2f MB), saved %d files and %.2f MB: %s",
+        len(selected_names),
+        full_count,
+        selected_size / 1024 / 1024,
+        full_size / 1024 / 1024,
+        full_count - len(selected_names),
+        (full_size - selected_size) / 1024 / 1024,
+        sorted(selected_names),
+    )
+    return result
+
+
 def normalize_pyi_toc(entry: str, typecode: str, level: int = 1, dest: None | str = None) -> tuple[str, str, str]:
     """
     Return PyInstaller TOC with the input string list
@@ -309,13 +372,16 @@ def normalize_pyi_toc(entry: str, typecode: str, level: int = 1, dest: None | st
     return (dest, src, typecode)
 
 
-def process_qt_files(assemble_info: AssembleInfo) -> list[tuple[str, str]]:
+def process_qt_files(assemble_info: AssembleInfo) -> tuple[list[tuple[str, str]], list[tuple[str, str, str]]]:
     """
     Process Qt files
+    Returns:
+        Qt binaries, Qt files to copy to the output directory
     """
     if not assemble_info.qt_library_name:
         # Not a Qt application
-        return []
+        return [], []
+    manifest = qt_manifest.load_qt_manifest(assemble_info.qt_library_name)
     imported_module_names = set()
     binaries = set()
     datas = set()
@@ -327,20 +393,14 @@ def process_qt_files(assemble_info: AssembleInfo) -> list[tuple[str, str]]:
         for module_name in module_names:
             if module_name in imported_module_names:
                 continue
-            try:
-                hook = import_pyi_qt_hooks(module_name)
-            except FileNotFoundError:
-                # No such hook
-                pass
-            else:
-                todo.extend(hook.hiddenimports)
-                binaries.update(hook.binaries)
-                datas.update(hook.datas)
+            module_manifest = manifest.modules.get(module_name)
+            assert module_manifest is not None, f"{module_name} is not a Qt extension module"
+            todo.extend(module_manifest.hiddenimports)
+            binaries.update(module_manifest.binaries)
+            datas.update(module_manifest.datas)
             imported_module_names.add(module_name)
 
-            module = importlib.import_module(module_name)
-            assert isinstance(module.__loader__, machinery.ExtensionFileLoader)
-            module_file = module.__file__
+            module_file = module_manifest.file
             # NOTE: Paths are different from standard PyQt5
             start_from = os.path.normpath(os.path.join(module_file, "..", ".."))
             dest = os.path.relpath(module_file, start_from)
@@ -352,14 +412,20 @@ def process_qt_files(assemble_info: AssembleInfo) -> list[tuple[str, str]]:
     # Save results to local variables: binaries, datas
     process_qt_import(assemble_info.qt_modules)
 
+    # Only keep the Qt plugins that are really used
+    binaries = select_qt_plugins(binaries, manifest.location.get("PluginsPath", ""), assemble_info)
+
+    all_qtqml_modules = get_all_qtqml_modules(assemble_info.qt_library_name, assemble_info.qt_quick_control_styles)
     if is_qtquick_application(assemble_info):
         qtqml_modules = collect_needed_qtqml_files(
-            assemble_info.qt_library_name, assemble_info.qml_directory, assemble_info.qt_quick_control_styles
+            assemble_info.qt_library_name,
+            assemble_info.qml_directory,
+            assemble_info.qt_quick_control_styles,
+            all_qtqml_modules,
         )
     else:
         qtqml_modules = set()
     # Get binaries and datas that are not needed
-    all_qtqml_modules = get_all_qtqml_modules(assemble_info.qt_library_name)
     all_qtqml_binaries = set()
     all_qtqml_datas = set()
     qtqml_binaries = set()
@@ -395,25 +461,22 @@ def process_qt_files(assemble_info: AssembleInfo) -> list[tuple[str, str]]:
         result_binaries.extend(web_engine_binaries)
         result_datas.extend(web_engine_datas)
 
-    # Copy all Qt binaries and datas to the output directory
+    # All Qt binaries and datas are copied to the output directory
+    qt_files = []
     for src, dest_dir in itertools.chain(result_binaries, result_datas):
         if os.path.isdir(src):
             continue
         if src.endswith((".qml", ".qmltypes", ".js")):
             continue
-        dest_dir = os.path.join(paths.DEPLOY_DIR, dest_dir)
-        if not os.path.isdir(dest_dir):
-            os.makedirs(dest_dir)
-        try:
-            shutil.copy(src, dest_dir)
-        except FileExistsError:
-            # File is already there, skip it.
-            pass
-    return result_binaries
+        qt_files.append((os.path.join(dest_dir, os.path.basename(src)), src, "DATA"))
+    return result_binaries, qt_files
 
 
 def process_hook_modules(
-    modules: dict[str, modulefinder.Module], pyi_binaries: list[tuple[str, str, str]], pyi_datas: list[tuple[str, str, str]]
+    modules: dict[str, modulefinder.Module],
+    pyi_binaries: list[tuple[str, str, str]],
+    pyi_datas: list[tuple[str, str, str]],
+    registry: hook_registry.HookRegistry,
 ) -> None:
     """
     Process modules to add extra binaries or datas
@@ -422,44 +485,50 @@ def process_hook_modules(
 
     def process_impl(fullnames: _t.Iterable[str]) -> None:
         todo: list[str] = []
+        # Hooks of the same round are evaluated in parallel
+        hook_results = registry.evaluate(name for name in fullnames if name not in processed)
         for module_name in fullnames:
             if module_name in processed:
                 continue
-            try:
-                hook = import_tfreezer_hook(module_name)
-            except FileNotFoundError:
+            hook_result = hook_results.get(module_name)
+            if hook_result is None:
                 processed.add(module_name)
                 continue
-            for hiddenimport in hook.hiddenimports:
+            log.logger.info("Processing hook for '%s': %s", module_name, registry.get(module_name).path)
+            for hiddenimport in hook_result.hiddenimports:
                 if hiddenimport in processed:
                     continue
                 todo.append(hiddenimport)
-            pyi_binaries.extend(hook.binaries)
-            pyi_datas.extend(hook.datas)
-            if hasattr(hook, "hook") and callable(hook.hook):
+            pyi_binaries.extend(hook_result.binaries)
+            pyi_datas.extend(hook_result.datas)
+            if hook_result.has_hook_function:
+                hook: PyiQtHookModule = registry.load(module_name)
                 hook.hook(modules, pyi_binaries, pyi_datas)
             processed.add(module_name)
         if todo:
             process_impl(todo)
 
-    process_impl(modules.keys())
+    process_impl(list(modules.keys()))
+    log.logger.info("Hook results: %d cached, %d evaluated", registry.cache_hits, registry.cache_misses)
 
 
-def assemble_application(assemble_info: AssembleInfo) -> None:
+def resolve_dependencies(assemble_info: AssembleInfo) -> tuple[list[tuple[str, str, str]], list[tuple[str, str, str]]]:
     """
-    Assemble application
+    Resolve binaries and datas needed by the application, nothing is copied
+    Returns:
+        binaries with all their dependencies, datas
     """
-    # First clear the output directory
-    if os.path.isdir(paths.DEPLOY_DIR):
-        shutil.rmtree(paths.DEPLOY_DIR)
-    os.makedirs(paths.DEPLOY_DIR)
-
     # Initialize binaries with user inputs
     pyi_binaries = [normalize_pyi_toc(binary, "BINARY") for binary in assemble_info.binaries]
 
     # Analyze which modules are used to run the application
     analysis_info = generate_frozen_modules.ModuleAnalysisInfo(
-        assemble_info.entry_module_name, assemble_info.hidden_imports, assemble_info.excludes, []
+        assemble_info.entry_module_name,
+        assemble_info.hidden_imports,
+        assemble_info.excludes,
+        [],
+        prune_guarded_imports=config.load_prune_guarded_imports(),
+        startup_profile=config.load_startup_profile(),
     )
     modules = generate_frozen_modules.analyze_module(
         analysis_info, generate_frozen_modules.ModuleType.EXTENSION_MODULE | generate_frozen_modules.ModuleType.SOURCE_MODULE
@@ -469,7 +538,7 @@ def assemble_application(assemble_info: AssembleInfo) -> None:
     # And append them to the PyInstaller binaries
     # This should be done before calling build_main.find_binary_dependencies
     # Because some QtQml modules depend on some extra Qt modules, such as Qt6QmlModels.dll
-    qt_binaries = process_qt_files(assemble_info)
+    qt_binaries, qt_files = process_qt_files(assemble_info)
     for src, _ in qt_binaries:
         if os.path.isdir(src):
             continue
@@ -489,6 +558,9 @@ def assemble_application(assemble_info: AssembleInfo) -> None:
         if module.__file__.startswith(platform_dynload_dir):
             if assemble_info.ignore_platform_dynload:
                 continue
+        if module_name in assemble_info.static_extensions:
+            # Already a builtin module of the executable
+            continue
         level = module_name.count(".") + 1
         file_basename = os.path.basename(module.__file__)
         if "__init__" in file_basename:
@@ -498,8 +570,9 @@ def assemble_application(assemble_info: AssembleInfo) -> None:
         pyi_binaries.append(normalize_pyi_toc(module.__file__, "BINARY", level))
 
     # Process hooks
-    pyi_datas = []
-    process_hook_modules(modules, pyi_binaries, pyi_datas)
+    pyi_datas = list(qt_files)
+    registry = hook_registry.create_hook_registry(assemble_info.hook_dirs)
+    process_hook_modules(modules, pyi_binaries, pyi_datas, registry)
 
     # Get all dependencies of the binaries using PyInstaller's API
     import_packages = sorted(extension_modules)
@@ -509,6 +582,90 @@ def assemble_application(assemble_info: AssembleInfo) -> None:
         relpath = os.path.relpath(data, paths.APP_ROOT)
         pyi_datas.append(normalize_pyi_toc(data, "DATA", dest=relpath))
 
+    return dependencies, pyi_datas
+
+
+def get_extension_module_index(dependencies: _t.Iterable[tuple[str, str, str]]) -> dict[str, str]:
+    """
+    Get extension modules in the deploy directory, names follow from their destinations, see normalize_pyi_toc
+    Binaries that aren't extension modules, e.g. libfoo.so, only add names that are never imported
+    Returns:
+        module name -> path relative to the deploy directory
+    """
+    suffixes = sorted(machinery.EXTENSION_SUFFIXES, key=len, reverse=True)
+    index = {}
+    for dest, _, _ in dependencies:
+        suffix = next((suffix for suffix in suffixes if dest.endswith(suffix)), None)
+        if suffix is None:
+            continue
+        names = re.split(r"[\\/]", dest[: -len(suffix)])
+        if names[-1] == "__init__":
+            names.pop()
+        if names and all(name.isidentifier() for name in names):
+            index.setdefault(".".join(names), dest)
+    return index
+
+
+def dump_extension_module_index(dependencies: _t.Iterable[tuple[str, str, str]]) -> None:
+    """
+    Write the index of extension modules next to the executable, see TfSealedFinder in bootstrap/tf_importer.py
+    """
+    index = get_extension_module_index(dependencies)
+    contents = [f"{module_name}\t{dest}\n" for module_name, dest in sorted(index.items())]
+    # Keep in sync with EXTENSION_INDEX_NAME in bootstrap/tf_importer.py
+    with open(os.path.join(paths.DEPLOY_DIR, "tf_extension_index"), "w", encoding="utf-8") as fp:
+        fp.write("".join(contents))
+    log.logger.info("Indexed %d extension modules for sealed imports", len(index))
+
+
+def _get_resolved_dependencies_path() -> str:
+    return os.path.join(paths.BUILD_DIR, "resolved_dependencies")
+
+
+def dump_resolved_dependencies(assemble_info: AssembleInfo) -> None:
+    """
+    Resolve dependencies of everything but the given binaries, so that it runs while the executable is being built
+    """
+    # Not dataclasses.replace, ignore_platform_dynload and static_python aren't fields
+    partial_info = copy.copy(assemble_info)
+    partial_info.binaries = []
+    dependencies, pyi_datas = resolve_dependencies(partial_info)
+    contents = ["DEPENDENCIES = ["] + [f"    {dependency!r}," for dependency in dependencies] + ["]"]
+    contents += ["DATAS = ["] + [f"    {data!r}," for data in pyi_datas] + ["]", ""]
+    utils.write_text_if_changed(_get_resolved_dependencies_path(), "\n".join(contents))
+
+
+def load_resolved_dependencies(assemble_info: AssembleInfo) -> tuple[list[tuple[str, str, str]], list[tuple[str, str, str]]]:
+    """
+    Load dependencies dumped by dump_resolved_dependencies, only the given binaries are resolved
+    """
+    resolved_path = _get_resolved_dependencies_path()
+    if not os.path.isfile(resolved_path):
+        generate_frozen_modules.usage(f"Dependencies are not resolved. No such file: '{resolved_path}'")
+    module = utils.load_signle_module("tfreezer.resolved_dependencies", resolved_path)
+    pyi_binaries = [normalize_pyi_toc(binary, "BINARY") for binary in assemble_info.binaries]
+    dependencies = {os.path.normcase(dest): (dest, src, typecode) for dest, src, typecode in module.DEPENDENCIES}
+    for dest, src, typecode in build_main.find_binary_dependencies(pyi_binaries, [], set()):
+        dependencies.setdefault(os.path.normcase(dest), (dest, src, typecode))
+    return list(dependencies.values()), module.DATAS
+
+
+def assemble_application(assemble_info: AssembleInfo, reuse_resolved_dependencies: bool = False) -> None:
+    """
+    Assemble application
+    Args:
+        reuse_resolved_dependencies: whether to load dependencies dumped by dump_resolved_dependencies
+    """
+    if reuse_resolved_dependencies:
+        dependencies, pyi_datas = load_resolved_dependencies(assemble_info)
+    else:
+        dependencies, pyi_datas = resolve_dependencies(assemble_info)
+
+    # Clear the output directory
+    if os.path.isdir(paths.DEPLOY_DIR):
+        shutil.rmtree(paths.DEPLOY_DIR)
+    os.makedirs(paths.DEPLOY_DIR)
+
     # Copy all binaries and datas to the output directory
     for dest, src, _ in itertools.chain(dependencies, pyi_datas):
         if re.match(r"py(?:thon(?:com(?:loader)?)?|wintypes)\d+\.dll", dest):
@@ -521,6 +678,9 @@ def assemble_application(assemble_info: AssembleInfo) -> None:
             os.makedirs(dirname)
         shutil.copyfile(src, dest)
 
+    if assemble_info.sealed_imports:
+        dump_extension_module_index(dependencies)
+
 
 def main() -> None:
     """
@@ -534,6 +694,8 @@ def main() -> None:
         debugpy.wait_for_client()
 
     assemble_info = AssembleInfo("", "", "", [], [], [], [], [], [])
+    resolve_only = False
+    reuse_resolved_dependencies = False
     build_dir = sys.argv[1]
     paths.load_paths(build_dir)
     config.load_sys_path()
@@ -578,6 +740,10 @@ def main() -> None:
             assemble_info.ignore_platform_dynload = True
         elif arg.startswith("--static-python"):
             assemble_info.static_python = True
+        elif arg.startswith("--resolve-dependencies"):
+            resolve_only = True
+        elif arg.startswith("--reuse-resolved-dependencies"):
+            reuse_resolved_dependencies = True
         elif arg.startswith("--qml-directory"):
             datas = generate_frozen_modules.get_list_arg(arg, "--qml-directory")
             assemble_info.qml_directory = datas[0]
@@ -591,10 +757,18 @@ def main() -> None:
     module = utils.load_signle_module("tfreezer.config.qt_config", qt_config_file)
     assemble_info.qt_library_name = module.qt_library_name
     assemble_info.qt_modules = module.qt_modules
+    assemble_info.qt_plugins = getattr(module, "qt_plugins", [])
+    assemble_info.qt_plugin_trace = getattr(module, "qt_plugin_trace", "")
+    assemble_info.hook_dirs = config.load_hook_dirs()
+    assemble_info.static_extensions = config.load_static_extension_names()
+    assemble_info.sealed_imports = config.load_sealed_imports()
 
     if not assemble_info.qml_directory and is_qtquick_application(assemble_info):
         generate_frozen_modules.usage("Need to specify --qml-directory")
-    assemble_application(assemble_info)
+    if resolve_only:
+        dump_resolved_dependencies(assemble_info)
+        return
+    assemble_application(assemble_info, reuse_resolved_dependencies)
 
 
 if __name__ == "__main__":
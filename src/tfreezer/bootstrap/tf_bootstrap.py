@@ -9,6 +9,15 @@ import tf_importer
 # Install tf frozen importer
 tf_importer.install()
 
+# Load modules of the application from their sources (dev variant only)
+tf_importer.install_dev_overlay()
+
+# Find extension modules with the index of the assembled application instead of scanning directories
+tf_importer.install_sealed_finder()
+
+# Serve importlib.metadata from the index embedded by the analysis instead of scanning .dist-info directories
+tf_importer.install_metadata_finder()
+
 # Let other python modules know that the code is running in frozen mode.
 if not hasattr(sys, "frozen"):
     sys.frozen = True
@@ -3,8 +3,12 @@
 # contact: cookiezhx@163.com
 
 import sys
+import _imp
 import _frozen_importlib
-import pathlib
+import _frozen_importlib_external
+
+# Extension modules deployed next to the executable, written by assemble_application.py, one "<name>\t<relative path>" per line
+EXTENSION_INDEX_NAME = "tf_extension_index"
 
 
 class TfFrozenImporter(_frozen_importlib.FrozenImporter):
@@ -20,6 +24,9 @@ class TfFrozenImporter(_frozen_importlib.FrozenImporter):
 class TfFrozenResourceReader:
 
     def __init__(self, loader: type[TfFrozenImporter], name: str) -> None:
+        # Imported here, so that applications that never read resources don't import pathlib at startup
+        import pathlib  # pylint: disable=import-outside-toplevel
+
         self.loader = loader
         self.path = pathlib.Path(sys._stdlib_dir).joinpath(*name.split("."))
 
@@ -39,6 +46,99 @@ class TfFrozenResourceReader:
         return self.path
 
 
+class TfSealedFinder:
+    """
+    Replace PathFinder, extension modules of the application are found with the index written by assemble_application.py
+    Directories of the application and sys.path entries at startup are never scanned, so lookups of missing modules are
+    answered without touching the filesystem and the working directory can't shadow modules of the application.
+    Entries added to sys.path later, e.g. by tf_pywin32 or the application itself, are searched by PathFinder, even if they
+    are in sys._stdlib_dir. Other directories in sys._stdlib_dir, i.e. __path__ of frozen packages, are never scanned.
+    """
+
+    extension_modules: dict[str, str] = {}  # module name -> file
+    sealed_paths: frozenset[str] = frozenset()
+
+    @classmethod
+    def find_spec(cls, fullname: str, path=None, target=None):
+        module_file = cls.extension_modules.get(fullname)
+        if module_file is not None:
+            loader = _frozen_importlib_external.ExtensionFileLoader(fullname, module_file)
+            return _frozen_importlib_external.spec_from_file_location(fullname, module_file, loader=loader)
+        unsealed_paths = [entry for entry in (sys.path if path is None else path) if not cls.is_sealed(entry)]
+        if not unsealed_paths:
+            return None
+        return _frozen_importlib_external.PathFinder.find_spec(fullname, unsealed_paths, target)
+
+    @classmethod
+    def find_distributions(cls, context):
+        """
+        Used by importlib.metadata, only unsealed entries are searched
+        """
+        from importlib import metadata  # pylint: disable=import-outside-toplevel
+
+        unsealed_paths = [entry for entry in context.path if not cls.is_sealed(entry)]
+        unsealed_context = metadata.DistributionFinder.Context(name=context.name, path=unsealed_paths)
+        return _frozen_importlib_external.PathFinder.find_distributions(unsealed_context)
+
+    @classmethod
+    def invalidate_caches(cls) -> None:
+        _frozen_importlib_external.PathFinder.invalidate_caches()
+
+    @classmethod
+    def is_sealed(cls, entry: str) -> bool:
+        if entry in cls.sealed_paths:
+            return True
+        # Entries added to sys.path later are searched even if they are in sys._stdlib_dir, e.g. win32 of tf_pywin32
+        if entry in sys.path:
+            return False
+        # Packages of the application are in sys._stdlib_dir, see FrozenImporter
+        return entry.startswith(sys._stdlib_dir + _frozen_importlib_external.path_sep)
+
+
+class TfMetadataFinder:
+    """
+    Serve importlib.metadata from the index embedded by the analysis, see tf_metadata
+    """
+
+    @classmethod
+    def find_spec(cls, fullname: str, path=None, target=None):
+        return None
+
+    @classmethod
+    def find_distributions(cls, context):
+        # Imported here, importlib.metadata is only imported by applications that use it
+        import tf_metadata  # pylint: disable=import-outside-toplevel
+
+        return tf_metadata.find_distributions(context)
+
+
+class TfDevOverlayFinder:
+    """
+    Load modules of the application from their sources ahead of the frozen ones, it's only installed by the dev variant
+    Edits take effect without freezing again, dependencies that are not in the source roots stay frozen
+    """
+
+    source_roots: list[str] = []
+    entry_file = ""
+
+    @classmethod
+    def find_spec(cls, fullname: str, path=None, target=None):
+        if fullname == "__tfreezer_main__":
+            return _frozen_importlib_external.spec_from_file_location(fullname, cls.entry_file)
+        search_paths = cls.source_roots if path is None else [entry for entry in path if cls.is_source(entry)]
+        if not search_paths:
+            return None
+        spec = _frozen_importlib_external.PathFinder.find_spec(fullname, search_paths, target)
+        # Namespace packages, e.g. directories build and dist in the application root, are left to the other finders
+        if spec is None or spec.loader is None:
+            return None
+        return spec
+
+    @classmethod
+    def is_source(cls, entry: str) -> bool:
+        return any(entry == root or entry.startswith(root + _frozen_importlib_external.path_sep) for root in cls.source_roots)
+
+
 def install() -> None:
     """
     Install TfFrozenImporter to sys.meta_path
@@ -48,3 +148,50 @@ def install() -> None:
         if importer is _frozen_importlib.FrozenImporter:
             original_frozen_importer_index = index
     sys.meta_path.insert(original_frozen_importer_index, TfFrozenImporter)
+
+
+def install_sealed_finder() -> None:
+    """
+    Replace PathFinder in sys.meta_path by TfSealedFinder, nothing is done if the application isn't assembled
+    """
+    try:
+        with open(_frozen_importlib_external._path_join(sys._stdlib_dir, EXTENSION_INDEX_NAME), "r", encoding="utf-8") as fp:
+            lines = fp.read().splitlines()
+    except OSError:
+        return
+    for line in lines:
+        module_name, _, relative_path = line.partition("\t")
+        TfSealedFinder.extension_modules[module_name] = _frozen_importlib_external._path_join(sys._stdlib_dir, relative_path)
+    TfSealedFinder.sealed_paths = frozenset(sys.path) | {sys._stdlib_dir}
+    for index, finder in enumerate(sys.meta_path):
+        if finder is _frozen_importlib_external.PathFinder:
+            sys.meta_path[index] = TfSealedFinder
+
+
+def install_metadata_finder() -> None:
+    """
+    Insert TfMetadataFinder before the finder of sys.path, the index is only frozen if the application uses importlib.metadata
+    """
+    if not _imp.is_frozen("tf_metadata_index"):
+        return
+    index = len(sys.meta_path)
+    for finder_index, finder in enumerate(sys.meta_path):
+        if finder in (_frozen_importlib_external.PathFinder, TfSealedFinder):
+            index = finder_index
+            break
+    sys.meta_path.insert(index, TfMetadataFinder)
+
+
+def install_dev_overlay() -> None:
+    """
+    Insert TfDevOverlayFinder before TfFrozenImporter, tf_dev_overlay is only frozen by the dev variant
+    """
+    if not _imp.is_frozen("tf_dev_overlay"):
+        return
+    import tf_dev_overlay  # pylint: disable=import-outside-toplevel
+
+    TfDevOverlayFinder.source_roots = tf_dev_overlay.SOURCE_ROOTS
+    TfDevOverlayFinder.entry_file = tf_dev_overlay.ENTRY_FILE
+    sys.meta_path.insert(sys.meta_path.index(TfFrozenImporter), TfDevOverlayFinder)
+    # The launcher doesn't write bytecode, sources are cached like a normal interpreter does
+    sys.dont_write_bytecode = False
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Distributions of frozen packages for importlib.metadata, served from the index embedded by tfreezer.metadata_index.
+It's imported by TfMetadataFinder the first time importlib.metadata looks for distributions.
+"""
+
+import sys
+import pathlib
+from importlib import metadata
+
+import tf_metadata_index
+
+
+class TfDistribution(metadata.Distribution):
+    """
+    Distribution whose files in .dist-info are embedded in the executable
+    """
+
+    def __init__(self, files: dict[str, str]) -> None:
+        self._files = files
+
+    def read_text(self, filename):
+        return self._files.get(filename)
+
+    def locate_file(self, path):
+        return pathlib.Path(sys._stdlib_dir, path)
+
+
+def find_distributions(context: metadata.DistributionFinder.Context):
+    """
+    Find distributions by their names without scanning any directory
+    """
+    if context.name is None:
+        return iter([TfDistribution(files) for files in tf_metadata_index.DISTRIBUTIONS.values()])
+    files = tf_metadata_index.DISTRIBUTIONS.get(metadata.Prepared.normalize(context.name))
+    return iter([] if files is None else [TfDistribution(files)])
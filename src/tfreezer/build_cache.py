@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Content-addressed cache of build outputs: frozen modules, mypyc C sources and analysis results
+Keys are digests of everything an output depends on, machine-specific paths are replaced by tokens,
+so that builds on other machines with the same inputs hit the same entries.
+The cache is a directory, e.g. on a network filesystem, or an http server, see serve()
+
+Usage:
+    python -m tfreezer.build_cache --serve <directory> [port] [host]
+"""
+
+import typing as _t
+import sys
+import sysconfig
+import os
+import time
+import json
+import zlib
+import hashlib
+import platform
+import functools
+import threading
+import collections
+import urllib.error
+import urllib.request
+from http import server
+
+from tfreezer import paths, log, config
+
+CACHE_FORMAT_VERSION = 1
+# Kinds of entries, every kind is a directory of the cache
+KINDS = ("frozen", "mypyc", "analysis")
+# Timeout of requests to the cache server in seconds, a slow server must not slow down the build
+HTTP_TIMEOUT = 10
+
+
+@functools.cache
+def _get_path_roots() -> tuple[tuple[str, str], ...]:
+    """
+    Returns:
+        (token, root) of directories whose location differs between machines, the longest root first
+    """
+    roots = {"{tfreezer}": os.path.dirname(os.path.abspath(__file__))}
+    if paths.APP_ROOT:
+        roots["{app}"] = paths.APP_ROOT
+    install_paths = sysconfig.get_paths()
+    for name in ("stdlib", "platstdlib", "purelib", "platlib"):
+        roots[f"{{{name}}}"] = install_paths[name]
+    roots["{prefix}"] = sys.prefix
+    roots["{base_prefix}"] = sys.base_prefix
+    unique_roots: dict[str, str] = {}
+    for token, root in roots.items():
+        # The first token wins if roots are the same, e.g. stdlib and platstdlib
+        unique_roots.setdefault(os.path.normpath(os.path.abspath(root)), token)
+    return tuple(sorted(((token, root) for root, token in unique_roots.items()), key=lambda item: len(item[1]), reverse=True))
+
+
+def normalize_path(path: str) -> str:
+    """
+    Replace the root of a path by its token, e.g. /home/me/app/main.py -> {app}/main.py
+    """
+    path = os.path.normpath(os.path.abspath(path))
+    for token, root in _get_path_roots():
+        if os.path.normcase(path) == os.path.normcase(root):
+            return token
+        if os.path.normcase(path).startswith(os.path.normcase(os.path.join(root, ""))):
+            return f"{token}/{os.path.relpath(path, root).replace(os.sep, '/')}"
+    return path.replace(os.sep, "/")
+
+
+def denormalize_path(path: str) -> str:
+    """
+    The reverse of normalize_path on this machine
+    """
+    for token, root in _get_path_roots():
+        if path == token or path.startswith(f"{token}/"):
+            return os.path.normpath(root + path[len(token) :])
+    return os.path.normpath(path)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Replace roots of all paths in a text by their tokens, separators of the roots are kept
+    """
+    for token, root in _get_path_roots():
+        text = text.replace(root, token)
+    return text
+
+
+def denormalize_text(text: str) -> str:
+    for token, root in _get_path_roots():
+        text = text.replace(token, root)
+    return text
+
+
+def get_display_path(path: str) -> str:
+    """
+    Path of a source file shown in generated sources, e.g. in tracebacks, it's relative to the sys.path entry containing it,
+    like the file names of frozen modules
+    """
+    path = os.path.normpath(os.path.abspath(path))
+    entries = [os.path.normpath(os.path.abspath(entry or os.curdir)) for entry in sys.path]
+    containing_entries = [entry for entry in entries if os.path.normcase(path).startswith(os.path.normcase(os.path.join(entry, "")))]
+    if not containing_entries:
+        return normalize_path(path)
+    return os.path.relpath(path, max(containing_entries, key=len)).replace(os.sep, "/")
+
+
+def replace_source_paths(ctext: str, source_paths: _t.Iterable[str]) -> str:
+    """
+    Replace absolute paths of source files in a generated C source by their display paths, they are C string literals
+    """
+    for source_path in sorted(set(source_paths), key=len, reverse=True):
+        if not os.path.isabs(source_path):
+            continue
+        display_path = get_display_path(source_path)
+        ctext = ctext.replace(source_path.replace("\\", "\\\\"), display_path).replace(source_path, display_path)
+    return ctext
+
+
+@functools.cache
+def _hash_file_stat(path: str, size: int, mtime_ns: int) -> str:
+    with open(path, "rb") as fp:
+        return hashlib.sha256(fp.read()).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    """
+    Digest of the contents of a file, empty if it doesn't exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ""
+    return _hash_file_stat(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def compute_key(*parts: str) -> str:
+    sha = hashlib.sha256(str(CACHE_FORMAT_VERSION).encode("utf-8"))
+    for part in parts:
+        sha.update(part.encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+@functools.cache
+def get_tool_digest() -> str:
+    """
+    Digest of the python sources of tfreezer, outputs of another version of tfreezer are never reused
+    """
+    tool_dir = os.path.dirname(os.path.abspath(__file__))
+    sha = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(tool_dir):
+        dirnames[:] = sorted(name for name in dirnames if name not in ("cppsrc", "__pycache__"))
+        for filename in sorted(filenames):
+            if filename.endswith(".py"):
+                file_path = os.path.join(dirpath, filename)
+                sha.update(os.path.relpath(file_path, tool_dir).replace(os.sep, "/").encode("utf-8"))
+                sha.update(hash_file(file_path).encode("utf-8"))
+    return sha.hexdigest()
+
+
+class _DirectoryBackend:
+    """
+    Entries are files: <root>/<kind>/<key[:2]>/<key>, written to a temporary file and renamed,
+    renaming is atomic on network filesystems too, so that readers never see partial entries
+    """
+
+    def __init__(self, root: str) -> None:
+        self._root = root
+
+    def _get_path(self, kind: str, key: str) -> str:
+        return os.path.join(self._root, kind, key[:2], key)
+
+    def get(self, kind: str, key: str) -> _t.Optional[bytes]:
+        try:
+            with open(self._get_path(kind, key), "rb") as fp:
+                return fp.read()
+        except OSError:
+            return None
+
+    def put(self, kind: str, key: str, data: bytes) -> None:
+        entry_path = self._get_path(kind, key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # Unique among machines sharing the directory
+        temp_path = f"{entry_path}.{platform.node()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as fp:
+            fp.write(data)
+        os.replace(temp_path, entry_path)
+
+
+class _HttpBackend:
+    """
+    Entries are resources: GET and PUT <url>/<kind>/<key>, missing entries are 404
+    """
+
+    def __init__(self, url: str) -> None:
+        self._url = url.rstrip("/")
+        self._unreachable = False
+
+    def get(self, kind: str, key: str) -> _t.Optional[bytes]:
+        if self._unreachable:
+            # Every request would wait for the timeout
+            return None
+        try:
+            with urllib.request.urlopen(f"{self._url}/{kind}/{key}", timeout=HTTP_TIMEOUT) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                log.logger.warning("Build cache server responded %d to '%s/%s'", e.code, kind, key)
+            return None
+        except OSError as e:
+            log.logger.warning("Build cache server is unreachable, it's not used by this process: %s", e)
+            self._unreachable = True
+            return None
+
+    def put(self, kind: str, key: str, data: bytes) -> None:
+        if self._unreachable:
+            return
+        request = urllib.request.Request(f"{self._url}/{kind}/{key}", data=data, method="PUT")
+        try:
+            with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT):
+                pass
+        except urllib.error.HTTPError:
+            # The server is up, the caller warns about the entry
+            raise
+        except OSError as e:
+            log.logger.warning("Build cache server is unreachable, it's not used by this process: %s", e)
+            self._unreachable = True
+
+
+class BuildCache:
+    """
+    Compressed entries of a backend, hits and misses are counted per kind
+    """
+
+    def __init__(self, location: str) -> None:
+        self.location = location
+        self._backend = _HttpBackend(location) if "://" in location else _DirectoryBackend(location)
+        self._lock = threading.Lock()
+        self.hits: collections.Counter[str] = collections.Counter()
+        self.misses: collections.Counter[str] = collections.Counter()
+
+    def _count(self, kind: str, hit: bool) -> None:
+        # Entries are stored by callbacks of worker processes, which run in other threads
+        with self._lock:
+            (self.hits if hit else self.misses)[kind] += 1
+
+    def get(self, kind: str, key: str) -> _t.Optional[bytes]:
+        data = self._backend.get(kind, key)
+        if data is not None:
+            try:
+                data = zlib.decompress(data)
+            except zlib.error:
+                log.logger.warning("Build cache entry '%s/%s' is broken, ignore it.", kind, key)
+                data = None
+        self._count(kind, data is not None)
+        return data
+
+    def put(self, kind: str, key: str, data: bytes) -> None:
+        try:
+            self._backend.put(kind, key, zlib.compress(data))
+        except OSError as e:
+            # The cache is an optimization, the build goes on without it
+            log.logger.warning("Failed to store build cache entry '%s/%s': %s", kind, key, e)
+
+    def get_validated(self, kind: str, key: str) -> _t.Optional[_t.Any]:
+        """
+        Get an entry whose input files are only known after the output is built, e.g. modules imported by a module,
+        it's a hit only if all the input files are unchanged
+        Returns:
+            the payload, None if missed
+        """
+        data = self._backend.get(kind, key)
+        entry = None
+        if data is not None:
+            try:
+                entry = json.loads(zlib.decompress(data))
+            except (zlib.error, ValueError):
+                log.logger.warning("Build cache entry '%s/%s' is broken, ignore it.", kind, key)
+        if entry is not None and any(hash_file(denormalize_path(path)) != digest for path, digest in entry["inputs"].items()):
+            log.logger.debug("Build cache entry '%s/%s' is outdated", kind, key)
+            entry = None
+        self._count(kind, entry is not None)
+        return None if entry is None else entry["payload"]
+
+    def put_validated(self, kind: str, key: str, inputs: _t.Iterable[str], payload: _t.Any) -> None:
+        """
+        Args:
+            inputs: files the payload depends on
+            payload: json serializable, paths in it should be normalized
+        """
+        entry = {"inputs": {normalize_path(path): hash_file(path) for path in inputs}, "payload": payload}
+        self.put(kind, key, json.dumps(entry, sort_keys=True).encode("utf-8"))
+
+    def report(self) -> None:
+        """
+        Log hit rates and append them to ${BUILD_DIR}/build_cache_stats, a build runs several processes using the cache
+        """
+        if not self.hits and not self.misses:
+            return
+        for kind in KINDS:
+            total = self.hits[kind] + self.misses[kind]
+            if total:
+                hit_rate = 100 * self.hits[kind] / total
+                log.logger.info("Build cache %s: %d hits, %d misses (%.0f%%)", kind, self.hits[kind], self.misses[kind], hit_rate)
+        stats = {"time": time.time(), "hits": dict(self.hits), "misses": dict(self.misses)}
+        with open(_get_stats_path(), "a", encoding="utf-8") as fp:
+            fp.write(json.dumps(stats) + "\n")
+
+
+def _get_stats_path() -> str:
+    return os.path.join(paths.BUILD_DIR, "build_cache_stats")
+
+
+@functools.cache
+def get_build_cache() -> _t.Optional[BuildCache]:
+    """
+    Get the build cache configured by build_cache in the freeze config
+    Returns:
+        None if it's disabled
+    """
+    location = config.load_build_cache()
+    if not location:
+        return None
+    return BuildCache(location)
+
+
+def clear_stats() -> None:
+    """
+    Clear stats of the previous build
+    """
+    if os.path.isfile(_get_stats_path()):
+        os.remove(_get_stats_path())
+
+
+def report_stats() -> None:
+    """
+    Log hit rates of all processes of the build
+    """
+    if not os.path.isfile(_get_stats_path()):
+        return
+    hits: collections.Counter[str] = collections.Counter()
+    misses: collections.Counter[str] = collections.Counter()
+    with open(_get_stats_path(), "r", encoding="utf-8") as fp:
+        for line in fp:
+            try:
+                stats = json.loads(line)
+            except ValueError:
+                continue
+            hits.update(stats["hits"])
+            misses.update(stats["misses"])
+    summaries = [f"{kind} {hits[kind]}/{hits[kind] + misses[kind]}" for kind in KINDS if hits[kind] + misses[kind]]
+    total_hits, total = sum(hits.values()), sum(hits.values()) + sum(misses.values())
+    log.logger.info("Build cache hits: %s, %.0f%% in total", ", ".join(summaries), 100 * total_hits / total if total else 0)
+
+
+class _CacheRequestHandler(server.BaseHTTPRequestHandler):
+    """
+    Serve entries of a directory backend, it stands in for a real cache server, e.g. in CI
+    """
+
+    backend: _DirectoryBackend
+
+    def _parse_path(self) -> _t.Optional[tuple[str, str]]:
+        kind, _, key = self.path.strip("/").partition("/")
+        if kind not in KINDS or len(key) != 64 or any(char not in "0123456789abcdef" for char in key):
+            self.send_error(400)
+            return None
+        return kind, key
+
+    def do_GET(self) -> None:
+        entry = self._parse_path()
+        if entry is None:
+            return
+        data = self.backend.get(*entry)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self) -> None:
+        entry = self._parse_path()
+        if entry is None:
+            return
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.backend.put(*entry, data)
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: _t.Any) -> None:  # pylint: disable=redefined-builtin
+        log.logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def serve(directory: str, port: int = 8765, host: str = "127.0.0.1") -> None:
+    """
+    Serve a cache directory over http until interrupted, for local use and tests only.
+    It's not meant to be shared: anyone who can reach it can PUT entries without authentication,
+    and entries are compiled into applications, use an authenticated server or a filesystem with permissions instead
+    Args:
+        host: address to bind, only this machine can connect by default
+    """
+    handler = type("CacheRequestHandler", (_CacheRequestHandler,), {"backend": _DirectoryBackend(os.path.abspath(directory))})
+    with server.ThreadingHTTPServer((host, port), handler) as httpd:
+        log.logger.info("Serving build cache '%s' on %s:%d", os.path.abspath(directory), host, port)
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "--serve":
+        sys.exit(__doc__)
+    serve(sys.argv[2], *(int(port) for port in sys.argv[3:4]), *sys.argv[4:5])
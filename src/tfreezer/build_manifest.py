@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Manifest of everything a build depends on, an unchanged manifest means the previous build is up to date
+"""
+
+import typing as _t
+import sys
+import os
+import hashlib
+import platform
+from importlib import metadata
+
+from tfreezer import paths, utils
+
+MANIFEST_VERSION = 1
+# Directories that never contain application sources
+EXCLUDED_DIR_NAMES = frozenset(
+    (".git", ".hg", ".svn", "__pycache__", ".mypy_cache", ".pytest_cache", ".tox", ".venv", "venv", ".idea", ".vscode")
+)
+# Sections whose change makes the CMake cache invalid
+TOOLCHAIN_SECTIONS = ("interpreter", "cmake")
+# Sections whose change is tracked by the depfiles of the build commands, cmake doesn't need to configure again
+BUILD_GRAPH_SECTIONS = ("sources", "dependencies")
+# Files read by cmake at configure time, they always exist and are empty if unused,
+# so that cmake configures again when the build commands change them, see CMakeLists.txt and tfreezer.generate_frozen_modules
+CMAKE_PLAN_FILES = (
+    "frozen_headers",
+    "cython_sources",
+    "mypyc_include_dirs",
+    "mypyc_groups.cmake",
+    "static_extensions.cmake",
+    "frozen_stdlib.cmake",
+)
+# Files that decide the outputs of the build commands
+BUILD_PLAN_FILES = CMAKE_PLAN_FILES + ("mypyc_rejected_modules",)
+
+
+def _get_manifest_path() -> str:
+    return os.path.join(paths.BUILD_DIR, "build_manifest.json")
+
+
+def _digest_tree(root: str, excluded_dirs: _t.Collection[str]) -> str:
+    """
+    Digest of paths, sizes and modification times of all files in a directory, contents are not read
+    """
+    sha = hashlib.sha256()
+    excluded_dirs = {os.path.normcase(os.path.abspath(the_dir)) for the_dir in excluded_dirs}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(
+            name
+            for name in dirnames
+            if name not in EXCLUDED_DIR_NAMES and os.path.normcase(os.path.join(dirpath, name)) not in excluded_dirs
+        )
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            sha.update(f"{os.path.relpath(file_path, root)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+    return sha.hexdigest()
+
+
+def _get_analysis_depfile_path() -> str:
+    # The same as generate_frozen_modules.get_depfile_path("analysis")
+    return os.path.join(paths.BUILD_DIR, "depfiles", "analysis.d")
+
+
+def digest_dependencies() -> str:
+    """
+    Digest of paths, sizes and modification times of all files read by the previous analysis,
+    which includes modules outside APP_ROOT, e.g. editable installs and PYTHONPATH
+    Returns:
+        digest, "" if there is no previous analysis
+    """
+    depfile = _get_analysis_depfile_path()
+    if not os.path.isfile(depfile):
+        return ""
+    sha = hashlib.sha256()
+    for dependency in utils.read_depfile(depfile):
+        try:
+            stat = os.stat(dependency)
+        except OSError:
+            sha.update(f"{dependency}|missing\n".encode("utf-8"))
+            continue
+        sha.update(f"{dependency}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+    return sha.hexdigest()
+
+
+def _digest_file(path: _t.Optional[str]) -> str:
+    if not path or not os.path.isfile(path):
+        return ""
+    with open(path, "rb") as fp:
+        return hashlib.sha256(fp.read()).hexdigest()
+
+
+def digest_distributions() -> str:
+    """
+    Digest of installed distributions, site-packages are too large to be scanned
+    """
+    names = sorted({f"{dist.metadata['Name']}=={dist.version}" for dist in metadata.distributions()})
+    return hashlib.sha256("\n".join(names).encode("utf-8")).hexdigest()
+
+
+def compute_manifest(arguments: dict[str, _t.Any], config_file: _t.Optional[str]) -> dict[str, str]:
+    """
+    Compute the manifest of a build
+    Args:
+        arguments: command line arguments
+        config_file: the freeze config file
+    Returns:
+        {section: digest}
+    """
+    interpreter = "|".join(
+        (sys.executable, sys.version, sys.prefix, platform.platform(), os.environ.get("PYTHONPATH", ""), paths.CPP_SRC)
+    )
+    return {
+        "arguments": hashlib.sha256(repr(sorted(arguments.items())).encode("utf-8")).hexdigest(),
+        "config_file": _digest_file(config_file),
+        "interpreter": hashlib.sha256(interpreter.encode("utf-8")).hexdigest(),
+        # Changes of tfreezer itself, including the C++ sources
+        "tfreezer": _digest_tree(os.path.dirname(os.path.abspath(__file__)), ()),
+        "distributions": digest_distributions(),
+        "cmake": _digest_file(paths.CMAKE_EXE),
+        "sources": _digest_tree(paths.APP_ROOT, (paths.BUILD_DIR, paths.DEPLOY_DIR)),
+        "dependencies": digest_dependencies(),
+    }
+
+
+def get_changed_sections(manifest: dict[str, str]) -> list[str]:
+    """
+    Compare the manifest with the one of the previous successful build
+    Returns:
+        changed sections, all sections if the previous build is unknown, its outputs are missing or its analysis depfile is missing
+    """
+    previous = utils.load_json_cache(_get_manifest_path(), MANIFEST_VERSION)
+    previous_manifest = previous.get("manifest", {})
+    outputs = previous.get("outputs", [])
+    if not manifest.get("dependencies") or not outputs or not all(os.path.exists(os.path.join(paths.DEPLOY_DIR, name)) for name in outputs):
+        return list(manifest)
+    return [section for section, digest in manifest.items() if previous_manifest.get(section) != digest]
+
+
+def remove_manifest() -> None:
+    """
+    Invalidate the manifest before building, so that a failed build is never considered up to date
+    """
+    manifest_path = _get_manifest_path()
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+
+
+def dump_manifest(manifest: dict[str, str]) -> None:
+    """
+    Record the manifest of a successful build with its outputs
+    """
+    outputs = sorted(os.listdir(paths.DEPLOY_DIR)) if os.path.isdir(paths.DEPLOY_DIR) else []
+    utils.dump_json_cache(_get_manifest_path(), MANIFEST_VERSION, {"manifest": manifest, "outputs": outputs})
+
+
+def _get_plan_changed_path() -> str:
+    return os.path.join(paths.BUILD_DIR, "build_plan_changed")
+
+
+def mark_build_plan_changed() -> None:
+    """
+    Called by build commands if the files cmake reads at configure time change, the build has to run again
+    """
+    with open(_get_plan_changed_path(), "w", encoding="utf-8") as fp:
+        fp.write("")
+
+
+def pop_build_plan_changed() -> bool:
+    """
+    Returns:
+        whether the build plan changed in the last build, the mark is removed
+    """
+    plan_changed_path = _get_plan_changed_path()
+    if not os.path.isfile(plan_changed_path):
+        return False
+    os.remove(plan_changed_path)
+    return True
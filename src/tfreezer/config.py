@@ -6,6 +6,7 @@ import typing as _t
 import dataclasses
 import sys
 import os
+import pprint
 
 from tfreezer import paths, utils
 
@@ -15,6 +16,30 @@ UNSUPPORTED_MODULES = (
     "setuptools",
 )
 
+# How mypyc modules are grouped into C compilation units:
+# single: all modules in one group, modules can call each other natively
+# package: one group per top-level package
+# module: one group per module, modules must not import each other
+MYPYC_GROUPING_STRATEGIES = ("single", "package", "module")
+
+# How frozen modules are stored in the executable:
+# marshal: marshalled code objects, unmarshalled at import time
+# deepfreeze: statically initialized code objects, falls back to marshal on unsupported python versions
+FROZEN_FORMATS = ("marshal", "deepfreeze")
+
+# Where modules of the standard library are frozen:
+# none: with the modules of the application
+# static: once per interpreter into a static library in the shared cache directory, only modules the application needs are linked
+# shared: once per interpreter into a shared library, its frozen module table is merged with the one of the application at startup
+FROZEN_STDLIB_LIBRARY_TYPES = ("none", "static", "shared")
+
+# How the frozen application starts:
+# default: like a normal interpreter, site is imported and modules imported at startup by the build interpreter are frozen
+# minimal: site is skipped, only modules that the interpreter imports before the entry module and modules found by the analysis
+#   are frozen, imports under `if __name__ == "__main__":` of modules other than the entry module aren't followed,
+#   builtins added by site, e.g. exit() and help(), are unavailable
+STARTUP_PROFILES = ("default", "minimal")
+
 
 @dataclasses.dataclass
 class FreezeConfig:
@@ -26,6 +51,37 @@ class FreezeConfig:
     # qt related configs
     qt_library_name: str
     qt_modules: list[str]
+    # Qt plugins allow-list, e.g. platforms/qwindows, imageformats/qjpeg, styles (all plugins of a type)
+    qt_plugins: list[str] = dataclasses.field(default_factory=list)
+    # Output of the application running with environment variable QT_DEBUG_PLUGINS=1, loaded plugins are kept
+    qt_plugin_trace: str = ""
+    # directories containing user hooks: hook-<module fullname>.py
+    hook_dirs: list[str] = dataclasses.field(default_factory=list)
+    # one of MYPYC_GROUPING_STRATEGIES
+    mypyc_grouping: str = "single"
+    # modules compiled with Cython, .py or .pyx, fnmatch patterns are allowed for .py modules
+    cython_modules: list[str] = dataclasses.field(default_factory=list)
+    # extension modules linked into the executable: names of CPython modules, or dicts of build info, see static_extension_generator
+    static_extensions: list[_t.Union[str, dict[str, _t.Any]]] = dataclasses.field(default_factory=list)
+    # root of CPython's source tree matching the running interpreter, needed by CPython modules in static_extensions
+    cpython_source_dir: str = ""
+    # one of FROZEN_FORMATS
+    frozen_format: str = "marshal"
+    # freeze modules in worker processes as soon as the analysis finds them, instead of after the analysis
+    streaming_freeze: bool = False
+    # one of FROZEN_STDLIB_LIBRARY_TYPES
+    frozen_stdlib_library: str = "none"
+    # don't follow imports guarded by conditions that are false on this interpreter, e.g. if sys.platform == "win32":
+    prune_guarded_imports: bool = True
+    # one of STARTUP_PROFILES
+    startup_profile: str = "default"
+    # write an index of the deployed extension modules, tf_bootstrap finds them with it and never scans directories of
+    # the application, see TfSealedFinder in bootstrap/tf_importer.py
+    sealed_imports: bool = True
+    # content-addressed cache of frozen modules, mypyc sources and analysis results shared between builds and machines:
+    # "" to disable it, "local" for ${CACHE_DIR}/build_cache, a directory, e.g. on a network filesystem, or an http(s) url,
+    # environment variable TFREEZER_BUILD_CACHE overrides it
+    build_cache: str = ""
 
 
 def dump_freeze_config(
@@ -35,35 +91,35 @@ def dump_freeze_config(
     excludes: _t.Optional[list[str]],
     mypyc_modules: _t.Optional[list[str]],
     config_file: _t.Optional[str],
+    dev_overlay: bool = False,
 ) -> FreezeConfig:
+    """
+    Args:
+        dev_overlay: whether modules of the application are loaded from their sources at runtime, see --variant dev
+    """
     freeze_config = _parse_config(entry_module, hidden_imports, excludes, mypyc_modules, config_file)
     if not os.path.isdir(paths.BUILD_DIR):
         os.makedirs(paths.BUILD_DIR)
 
     # entry_module
     entry_module_file = os.path.join(paths.BUILD_DIR, "entry_module")
-    with open(entry_module_file, "w", encoding="utf-8") as fp:
-        fp.write(freeze_config.entry_module)
+    utils.write_text_if_changed(entry_module_file, freeze_config.entry_module)
 
     # hidden_imports
     hidden_imports_file = os.path.join(paths.BUILD_DIR, "hidden_imports")
-    with open(hidden_imports_file, "w", encoding="utf-8") as fp:
-        fp.write(freeze_config.hidden_imports)
+    utils.write_text_if_changed(hidden_imports_file, freeze_config.hidden_imports)
 
     # excludes
     excludes_file = os.path.join(paths.BUILD_DIR, "excludes")
-    with open(excludes_file, "w", encoding="utf-8") as fp:
-        fp.write(freeze_config.excludes)
+    utils.write_text_if_changed(excludes_file, freeze_config.excludes)
 
     # mypyc_modules
     mypyc_modules_file = os.path.join(paths.BUILD_DIR, "mypyc_modules")
-    with open(mypyc_modules_file, "w", encoding="utf-8") as fp:
-        fp.write(freeze_config.mypyc_modules)
+    utils.write_text_if_changed(mypyc_modules_file, freeze_config.mypyc_modules)
 
     # datas
     datas_file = os.path.join(paths.BUILD_DIR, "datas")
-    with open(datas_file, "w", encoding="utf-8") as fp:
-        fp.write(",".join(freeze_config.datas))
+    utils.write_text_if_changed(datas_file, ",".join(freeze_config.datas))
 
     # qt_config
     qt_config_file = os.path.join(paths.BUILD_DIR, "qt_config")
@@ -71,9 +127,84 @@ def dump_freeze_config(
     for qt_module in freeze_config.qt_modules:
         qt_config_contents.append(f'    "{qt_module}",')
     qt_config_contents.append("]")
+    qt_config_contents.append("qt_plugins = [")
+    for qt_plugin in freeze_config.qt_plugins:
+        qt_config_contents.append(f'    "{qt_plugin}",')
+    qt_config_contents.append("]")
+    qt_plugin_trace = os.path.abspath(freeze_config.qt_plugin_trace) if freeze_config.qt_plugin_trace else ""
+    qt_config_contents.append(f'qt_plugin_trace = r"{qt_plugin_trace}"')
     qt_config_contents.append("")  # Extra empty line to make it prettier
-    with open(qt_config_file, "w", encoding="utf-8") as fp:
-        fp.write("\n".join(qt_config_contents))
+    utils.write_text_if_changed(qt_config_file, "\n".join(qt_config_contents))
+
+    # hook_dirs
+    hook_dirs_file = os.path.join(paths.BUILD_DIR, "hook_dirs")
+    hook_dirs_contents = ["hook_dirs = ["]
+    for hook_dir in freeze_config.hook_dirs:
+        hook_dirs_contents.append(f'    r"{os.path.abspath(hook_dir)}",')
+    hook_dirs_contents.append("]")
+    hook_dirs_contents.append("")  # Extra empty line to make it prettier
+    utils.write_text_if_changed(hook_dirs_file, "\n".join(hook_dirs_contents))
+
+    # mypyc_config
+    mypyc_config_file = os.path.join(paths.BUILD_DIR, "mypyc_config")
+    mypyc_config_contents = [f'mypyc_grouping = "{freeze_config.mypyc_grouping}"']
+    mypyc_config_contents.append("")  # Extra empty line to make it prettier
+    utils.write_text_if_changed(mypyc_config_file, "\n".join(mypyc_config_contents))
+
+    # cython_config
+    cython_config_file = os.path.join(paths.BUILD_DIR, "cython_config")
+    cython_config_contents = ["cython_modules = ["]
+    for cython_module in freeze_config.cython_modules:
+        cython_config_contents.append(f'    "{cython_module}",')
+    cython_config_contents.append("]")
+    cython_config_contents.append("")  # Extra empty line to make it prettier
+    utils.write_text_if_changed(cython_config_file, "\n".join(cython_config_contents))
+
+    # static_extensions_config
+    static_extensions_config_file = os.path.join(paths.BUILD_DIR, "static_extensions_config")
+    cpython_source_dir = os.path.abspath(freeze_config.cpython_source_dir) if freeze_config.cpython_source_dir else ""
+    static_extensions = []
+    for entry in freeze_config.static_extensions:
+        if isinstance(entry, dict):
+            # Paths are relative to the working directory, like hook_dirs
+            entry = dict(entry)
+            for field in ("sources", "include_dirs", "library_dirs"):
+                entry[field] = [os.path.abspath(the_path) for the_path in entry.get(field, [])]
+        static_extensions.append(entry)
+    static_extensions_config_contents = [
+        f"static_extensions = {pprint.pformat(static_extensions)}",
+        f'cpython_source_dir = r"{cpython_source_dir}"',
+    ]
+    static_extensions_config_contents.append("")  # Extra empty line to make it prettier
+    utils.write_text_if_changed(static_extensions_config_file, "\n".join(static_extensions_config_contents))
+
+    # frozen_config
+    frozen_config_file = os.path.join(paths.BUILD_DIR, "frozen_config")
+    frozen_config_contents = [
+        f'frozen_format = "{freeze_config.frozen_format}"',
+        f"streaming_freeze = {freeze_config.streaming_freeze}",
+        f'frozen_stdlib_library = "{freeze_config.frozen_stdlib_library}"',
+    ]
+    frozen_config_contents.append("")  # Extra empty line to make it prettier
+    utils.write_text_if_changed(frozen_config_file, "\n".join(frozen_config_contents))
+
+    # build_cache_config, it's not an input of the analysis, the location of the cache doesn't change outputs
+    build_cache_config_file = os.path.join(paths.BUILD_DIR, "build_cache_config")
+    utils.write_text_if_changed(build_cache_config_file, f'build_cache = r"{freeze_config.build_cache}"\n')
+
+    # assemble_config
+    assemble_config_file = os.path.join(paths.BUILD_DIR, "assemble_config")
+    utils.write_text_if_changed(assemble_config_file, f"sealed_imports = {freeze_config.sealed_imports}\n")
+
+    # analysis_config
+    analysis_config_file = os.path.join(paths.BUILD_DIR, "analysis_config")
+    analysis_config_contents = [
+        f"prune_guarded_imports = {freeze_config.prune_guarded_imports}",
+        f'startup_profile = "{freeze_config.startup_profile}"',
+        f"dev_overlay = {dev_overlay}",
+    ]
+    analysis_config_contents.append("")  # Extra empty line to make it prettier
+    utils.write_text_if_changed(analysis_config_file, "\n".join(analysis_config_contents))
 
     return freeze_config
 
@@ -87,8 +218,7 @@ def dump_python_path() -> None:
         contents.append(f'    r"{path}",')
     contents.append("]")
     contents.append("")  # Extra empty line to make it prettier
-    with open(sys_path, "w", encoding="utf-8") as fp:
-        fp.write("\n".join(contents))
+    utils.write_text_if_changed(sys_path, "\n".join(contents))
 
 
 def load_sys_path() -> None:
@@ -101,6 +231,125 @@ def load_sys_path() -> None:
             sys.path.append(path)
 
 
+def load_hook_dirs() -> list[str]:
+    """
+    Load hook_dirs of the freeze config dumped by configure, hooks in them take precedence over builtin and entry point hooks
+    Returns:
+        absolute paths of the hook directories, empty if configure wasn't run
+    """
+    hook_dirs_file = os.path.join(paths.BUILD_DIR, "hook_dirs")
+    if not os.path.isfile(hook_dirs_file):
+        return []
+    module = utils.load_signle_module("tfreezer.config.hook_dirs", hook_dirs_file)
+    return module.hook_dirs
+
+
+def load_mypyc_grouping() -> str:
+    mypyc_config_file = os.path.join(paths.BUILD_DIR, "mypyc_config")
+    if not os.path.isfile(mypyc_config_file):
+        return "single"
+    module = utils.load_signle_module("tfreezer.config.mypyc_config", mypyc_config_file)
+    return getattr(module, "mypyc_grouping", "single")
+
+
+def load_cython_modules() -> list[str]:
+    cython_config_file = os.path.join(paths.BUILD_DIR, "cython_config")
+    if not os.path.isfile(cython_config_file):
+        return []
+    module = utils.load_signle_module("tfreezer.config.cython_config", cython_config_file)
+    return module.cython_modules
+
+
+def load_frozen_format() -> str:
+    frozen_config_file = os.path.join(paths.BUILD_DIR, "frozen_config")
+    if not os.path.isfile(frozen_config_file):
+        return "marshal"
+    module = utils.load_signle_module("tfreezer.config.frozen_config", frozen_config_file)
+    return getattr(module, "frozen_format", "marshal")
+
+
+def load_streaming_freeze() -> bool:
+    frozen_config_file = os.path.join(paths.BUILD_DIR, "frozen_config")
+    if not os.path.isfile(frozen_config_file):
+        return False
+    module = utils.load_signle_module("tfreezer.config.frozen_config", frozen_config_file)
+    return getattr(module, "streaming_freeze", False)
+
+
+def load_frozen_stdlib_library() -> str:
+    frozen_config_file = os.path.join(paths.BUILD_DIR, "frozen_config")
+    if not os.path.isfile(frozen_config_file):
+        return "none"
+    module = utils.load_signle_module("tfreezer.config.frozen_config", frozen_config_file)
+    return getattr(module, "frozen_stdlib_library", "none")
+
+
+def load_build_cache() -> str:
+    """
+    Returns:
+        location of the build cache, a directory or an url, empty if it's disabled
+    """
+    build_cache = os.environ.get("TFREEZER_BUILD_CACHE")
+    if build_cache is None:
+        build_cache_config_file = os.path.join(paths.BUILD_DIR, "build_cache_config")
+        if not os.path.isfile(build_cache_config_file):
+            return ""
+        module = utils.load_signle_module("tfreezer.config.build_cache_config", build_cache_config_file)
+        build_cache = getattr(module, "build_cache", "")
+    if build_cache == "local":
+        return os.path.join(paths.CACHE_DIR, "build_cache")
+    return build_cache
+
+
+def load_prune_guarded_imports() -> bool:
+    analysis_config_file = os.path.join(paths.BUILD_DIR, "analysis_config")
+    if not os.path.isfile(analysis_config_file):
+        return True
+    module = utils.load_signle_module("tfreezer.config.analysis_config", analysis_config_file)
+    return getattr(module, "prune_guarded_imports", True)
+
+
+def load_startup_profile() -> str:
+    analysis_config_file = os.path.join(paths.BUILD_DIR, "analysis_config")
+    if not os.path.isfile(analysis_config_file):
+        return "default"
+    module = utils.load_signle_module("tfreezer.config.analysis_config", analysis_config_file)
+    return getattr(module, "startup_profile", "default")
+
+
+def load_dev_overlay() -> bool:
+    analysis_config_file = os.path.join(paths.BUILD_DIR, "analysis_config")
+    if not os.path.isfile(analysis_config_file):
+        return False
+    module = utils.load_signle_module("tfreezer.config.analysis_config", analysis_config_file)
+    return getattr(module, "dev_overlay", False)
+
+
+def load_sealed_imports() -> bool:
+    assemble_config_file = os.path.join(paths.BUILD_DIR, "assemble_config")
+    if not os.path.isfile(assemble_config_file):
+        return True
+    module = utils.load_signle_module("tfreezer.config.assemble_config", assemble_config_file)
+    return getattr(module, "sealed_imports", True)
+
+
+def load_static_extensions_config() -> tuple[list[_t.Union[str, dict[str, _t.Any]]], str]:
+    """
+    Returns:
+        (static_extensions, cpython_source_dir)
+    """
+    static_extensions_config_file = os.path.join(paths.BUILD_DIR, "static_extensions_config")
+    if not os.path.isfile(static_extensions_config_file):
+        return [], ""
+    module = utils.load_signle_module("tfreezer.config.static_extensions_config", static_extensions_config_file)
+    return module.static_extensions, module.cpython_source_dir
+
+
+def load_static_extension_names() -> list[str]:
+    static_extensions, _ = load_static_extensions_config()
+    return [entry if isinstance(entry, str) else entry["name"] for entry in static_extensions]
+
+
 def _parse_config(
     entry_module: _t.Optional[str],
     hidden_imports: _t.Optional[list[str]],
@@ -128,6 +377,51 @@ def _parse_config(
             freeze_config.qt_library_name = module.qt_library_name
         if hasattr(module, "qt_modules") and isinstance(module.qt_modules, list):
             freeze_config.qt_modules = module.qt_modules
+        if hasattr(module, "qt_plugins") and isinstance(module.qt_plugins, list):
+            freeze_config.qt_plugins = module.qt_plugins
+        if hasattr(module, "qt_plugin_trace") and isinstance(module.qt_plugin_trace, str):
+            freeze_config.qt_plugin_trace = module.qt_plugin_trace
+        if hasattr(module, "hook_dirs") and isinstance(module.hook_dirs, list):
+            freeze_config.hook_dirs = module.hook_dirs
+        if hasattr(module, "mypyc_grouping") and isinstance(module.mypyc_grouping, str):
+            if module.mypyc_grouping not in MYPYC_GROUPING_STRATEGIES:
+                raise ValueError(f"mypyc_grouping should be one of {MYPYC_GROUPING_STRATEGIES}, got '{module.mypyc_grouping}'")
+            freeze_config.mypyc_grouping = module.mypyc_grouping
+        if hasattr(module, "cython_modules") and isinstance(module.cython_modules, list):
+            freeze_config.cython_modules = module.cython_modules
+        if hasattr(module, "static_extensions") and isinstance(module.static_extensions, list):
+            for entry in module.static_extensions:
+                if not isinstance(entry, str) and not (isinstance(entry, dict) and isinstance(entry.get("name"), str)):
+                    raise ValueError(f"static_extensions entry should be a module name or a dict with 'name', got {entry!r}")
+            freeze_config.static_extensions = module.static_extensions
+        if hasattr(module, "cpython_source_dir") and isinstance(module.cpython_source_dir, str):
+            freeze_config.cpython_source_dir = module.cpython_source_dir
+        if hasattr(module, "frozen_format") and isinstance(module.frozen_format, str):
+            if module.frozen_format not in FROZEN_FORMATS:
+                raise ValueError(f"frozen_format should be one of {FROZEN_FORMATS}, got '{module.frozen_format}'")
+            freeze_config.frozen_format = module.frozen_format
+        if hasattr(module, "streaming_freeze") and isinstance(module.streaming_freeze, bool):
+            freeze_config.streaming_freeze = module.streaming_freeze
+        if hasattr(module, "frozen_stdlib_library") and isinstance(module.frozen_stdlib_library, str):
+            if module.frozen_stdlib_library not in FROZEN_STDLIB_LIBRARY_TYPES:
+                raise ValueError(
+                    f"frozen_stdlib_library should be one of {FROZEN_STDLIB_LIBRARY_TYPES}, got '{module.frozen_stdlib_library}'"
+                )
+            freeze_config.frozen_stdlib_library = module.frozen_stdlib_library
+        if hasattr(module, "prune_guarded_imports") and isinstance(module.prune_guarded_imports, bool):
+            freeze_config.prune_guarded_imports = module.prune_guarded_imports
+        if hasattr(module, "startup_profile") and isinstance(module.startup_profile, str):
+            if module.startup_profile not in STARTUP_PROFILES:
+                raise ValueError(f"startup_profile should be one of {STARTUP_PROFILES}, got '{module.startup_profile}'")
+            freeze_config.startup_profile = module.startup_profile
+        if hasattr(module, "sealed_imports") and isinstance(module.sealed_imports, bool):
+            freeze_config.sealed_imports = module.sealed_imports
+        if hasattr(module, "build_cache") and isinstance(module.build_cache, str):
+            if module.build_cache and module.build_cache != "local" and "://" not in module.build_cache:
+                # Relative to the working directory, like hook_dirs
+                freeze_config.build_cache = os.path.abspath(module.build_cache)
+            else:
+                freeze_config.build_cache = module.build_cache
         return freeze_config
     if not entry_module:
         raise ValueError("--entry-module should be specified")
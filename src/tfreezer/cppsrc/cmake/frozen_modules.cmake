@@ -0,0 +1,99 @@
+if(CMAKE_VERSION VERSION_LESS 3.21)
+    message(FATAL_ERROR "DEPFILE of custom commands requires CMake 3.21 or newer, current version: ${CMAKE_VERSION}")
+endif()
+
+# Build commands of tfreezer, every command writes a depfile listing the files it read,
+# so the build system reruns a command only if its inputs change:
+#   tfreezer_analysis: analyze modules, dump frozen modules of every shard, the frozen module table and Cython sources
+#   frozen shards: freeze modules of a shard into one C source, shards are independent of each other
+#   tfreezer_mypyc_codegen: generate C sources of mypyc groups
+set(TF_GENERATE_FROZEN_MODULES ${CMAKE_CROSSCOMPILING_EMULATOR} ${PYTHON_EXECUTABLE} "-m" "tfreezer.generate_frozen_modules")
+set(TF_DEPFILES_DIR ${TF_BUILD_DIR}/depfiles)
+
+# Create target tfreezer_analysis
+# frozen_sources: the frozen module table and C sources of the shards, see ${TF_BUILD_DIR}/frozen_headers
+function(add_analysis_target frozen_sources)
+    list(GET frozen_sources 0 _frozen_modules_header)
+    list(SUBLIST frozen_sources 1 -1 _shard_sources)
+    set(_byproducts
+        ${_frozen_modules_header}
+        ${TF_BUILD_DIR}/mypyc_module_cache
+    )
+
+    foreach(_shard_source ${_shard_sources})
+        string(REGEX REPLACE "\\.c$" ".modules" _shard_modules ${_shard_source})
+        list(APPEND _byproducts ${_shard_modules})
+    endforeach()
+
+    if(EXISTS ${TF_BUILD_DIR}/cython_sources)
+        file(READ ${TF_BUILD_DIR}/cython_sources _cython_sources)
+        string(STRIP "${_cython_sources}" _cython_sources)
+        list(APPEND _byproducts ${_cython_sources})
+    endif()
+
+    add_custom_command(
+        OUTPUT ${TF_BUILD_DIR}/analysis.stamp
+        BYPRODUCTS ${_byproducts}
+        COMMAND ${TF_GENERATE_FROZEN_MODULES} "--analyze"
+        "${TF_BUILD_DIR}"
+        "${ENTRY_MODULE_NAME}" "--hidden-imports=${HIDDEN_IMPORTS}" "--excludes=${EXCLUDES}" "--mypyc-modules=${MYPYC_MODULES}"
+        DEPFILE ${TF_DEPFILES_DIR}/analysis.d
+        WORKING_DIRECTORY ${TF_APPROOT_DIR}
+        COMMENT "Analyzing modules"
+    )
+    add_custom_target(tfreezer_analysis
+        DEPENDS ${TF_BUILD_DIR}/analysis.stamp
+    )
+endfunction()
+
+# Add a command for every shard of frozen modules, the shards are sources of the target
+# With streaming_freeze, the analysis writes sources of the shards itself, and the commands find them up to date
+function(add_frozen_shard_commands frozen_sources)
+    list(SUBLIST frozen_sources 1 -1 _shard_sources)
+
+    foreach(_shard_source ${_shard_sources})
+        get_filename_component(_shard_name ${_shard_source} NAME_WE)
+        string(REGEX REPLACE "^frozen_shard_" "" _shard_index ${_shard_name})
+        string(REGEX REPLACE "\\.c$" ".modules" _shard_modules ${_shard_source})
+        add_custom_command(
+            OUTPUT ${_shard_source}
+            COMMAND ${TF_GENERATE_FROZEN_MODULES} "--make-freeze-shard"
+            "${TF_BUILD_DIR}"
+            "${_shard_index}"
+            DEPENDS ${_shard_modules}
+            DEPFILE ${TF_DEPFILES_DIR}/${_shard_name}.d
+            WORKING_DIRECTORY ${TF_APPROOT_DIR}
+            COMMENT "Freezing modules of ${_shard_name}"
+        )
+    endforeach()
+endfunction()
+
+# Create target tfreezer_mypyc_codegen generating C sources of all mypyc groups, see mypyc_libraries.cmake
+# Groups are generated together because they depend on each other, unchanged sources keep their modification time,
+# so only the groups that change are compiled again.
+# The target exists even without groups, so that rejected modules are compiled again once they are fixed
+function(add_mypyc_codegen_target)
+    set(_byproducts "")
+    if(DEFINED TF_MYPYC_GROUPS)
+        list(APPEND _byproducts ${TF_GENERATED_HEADERS_DIR}/mypyc_modules/tfreezer_mypyc_modules.h)
+    endif()
+
+    foreach(_group ${TF_MYPYC_GROUPS})
+        list(APPEND _byproducts ${TF_MYPYC_GROUP_SOURCES_${_group}})
+    endforeach()
+
+    add_custom_command(
+        OUTPUT ${TF_BUILD_DIR}/mypyc.stamp
+        BYPRODUCTS ${_byproducts}
+        COMMAND ${TF_GENERATE_FROZEN_MODULES} "--make-mypyc"
+        "${TF_BUILD_DIR}"
+        DEPENDS ${TF_BUILD_DIR}/mypyc_module_cache
+        DEPFILE ${TF_DEPFILES_DIR}/mypyc.d
+        WORKING_DIRECTORY ${TF_APPROOT_DIR}
+        COMMENT "Generating mypyc sources"
+    )
+    add_custom_target(tfreezer_mypyc_codegen
+        DEPENDS ${TF_BUILD_DIR}/mypyc.stamp
+    )
+    add_dependencies(tfreezer_mypyc_codegen tfreezer_analysis)
+endfunction()
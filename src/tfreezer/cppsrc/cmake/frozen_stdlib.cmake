@@ -0,0 +1,91 @@
+include(ExternalProject)
+
+set(_TF_FROZEN_STDLIB_LIST_DIR ${CMAKE_CURRENT_LIST_DIR})
+
+# Variables are set by ${TF_BUILD_DIR}/frozen_stdlib.cmake, which is generated by tfreezer.frozen_stdlib:
+# TF_FROZEN_STDLIB_TYPE (STATIC or SHARED), TF_FROZEN_STDLIB_SOURCE_DIR and TF_FROZEN_STDLIB_CACHE_DIR
+
+# Build the frozen standard library in the shared cache directory and link it to the target
+# STATIC: the frozen module table of the target refers to the modules it needs, only their objects are linked
+# SHARED: the library has its own frozen module table, main.cpp appends it to the table of the target at startup,
+#         TF_FROZEN_STDLIB_RUNTIME_LIBRARY is set to the library that is deployed with the target
+# The build directory is shared by all builds using the same compiler, so its steps run with the directory locked,
+# and everything that changes its configuration is in its name
+function(link_frozen_stdlib_library target)
+    get_property(_is_multi_config GLOBAL PROPERTY GENERATOR_IS_MULTI_CONFIG)
+    get_target_property(_python_include_dirs cpython::libpython INTERFACE_INCLUDE_DIRECTORIES)
+
+    if(_is_multi_config)
+        set(_build_type "")
+    else()
+        set(_build_type ${CMAKE_BUILD_TYPE})
+    endif()
+
+    # Installations of tfreezer can't share the directory, cmake refuses to configure it with another source directory
+    string(SHA1 _compiler_hash "${CMAKE_C_COMPILER}|${CMAKE_CXX_COMPILER}|${_python_include_dirs}|${_TF_FROZEN_STDLIB_LIST_DIR}")
+    string(SUBSTRING ${_compiler_hash} 0 8 _compiler_hash)
+    set(_compiler_key "${CMAKE_CXX_COMPILER_ID}-${CMAKE_CXX_COMPILER_VERSION}-${CMAKE_GENERATOR}-${TF_FROZEN_STDLIB_TYPE}")
+    string(MAKE_C_IDENTIFIER "${_compiler_key}-${_build_type}-${_compiler_hash}" _compiler_key)
+    set(_library_binary_dir "${TF_FROZEN_STDLIB_CACHE_DIR}/${_compiler_key}")
+    string(REPLACE ";" "|" _python_include_dirs "${_python_include_dirs}")
+    set(_extra_args "")
+
+    if(TF_FROZEN_STDLIB_TYPE STREQUAL "SHARED" AND WIN32)
+        get_target_property(_python_library cpython::libpython IMPORTED_IMPLIB)
+        list(APPEND _extra_args -DPYTHON_LIBRARY=${_python_library})
+        set(_library_file "lib/$<CONFIG>/frozen_stdlib${CMAKE_IMPORT_LIBRARY_SUFFIX}")
+        set(_runtime_library_file "bin/$<CONFIG>/frozen_stdlib${CMAKE_SHARED_LIBRARY_SUFFIX}")
+    elseif(TF_FROZEN_STDLIB_TYPE STREQUAL "SHARED")
+        set(_library_file "lib/$<CONFIG>/${CMAKE_SHARED_LIBRARY_PREFIX}frozen_stdlib${CMAKE_SHARED_LIBRARY_SUFFIX}")
+        set(_runtime_library_file ${_library_file})
+    else()
+        set(_library_file "lib/$<CONFIG>/${CMAKE_STATIC_LIBRARY_PREFIX}frozen_stdlib${CMAKE_STATIC_LIBRARY_SUFFIX}")
+    endif()
+
+    if(_is_multi_config)
+        set(_byproducts "")
+    else()
+        string(REPLACE "$<CONFIG>" "${CMAKE_BUILD_TYPE}" _byproducts "${_library_binary_dir}/${_library_file}")
+    endif()
+
+    set(_locked_command ${CMAKE_COMMAND} -DTF_LOCK_DIR=<BINARY_DIR> -P ${_TF_FROZEN_STDLIB_LIST_DIR}/locked_command.cmake)
+    set(_generator_args -G ${CMAKE_GENERATOR})
+    if(CMAKE_GENERATOR_PLATFORM)
+        list(APPEND _generator_args -A ${CMAKE_GENERATOR_PLATFORM})
+    endif()
+    if(CMAKE_GENERATOR_TOOLSET)
+        list(APPEND _generator_args -T ${CMAKE_GENERATOR_TOOLSET})
+    endif()
+
+    ExternalProject_Add(frozen_stdlib_build
+        SOURCE_DIR ${_TF_FROZEN_STDLIB_LIST_DIR}/../frozen_stdlib
+        BINARY_DIR ${_library_binary_dir}
+        LIST_SEPARATOR |
+        CONFIGURE_COMMAND ${_locked_command}
+        ${CMAKE_COMMAND} ${_generator_args} -S <SOURCE_DIR> -B <BINARY_DIR>
+        -DCMAKE_C_COMPILER=${CMAKE_C_COMPILER}
+        -DCMAKE_CXX_COMPILER=${CMAKE_CXX_COMPILER}
+        -DCMAKE_BUILD_TYPE=${CMAKE_BUILD_TYPE}
+        -DFROZEN_STDLIB_SOURCE_DIR=${TF_FROZEN_STDLIB_SOURCE_DIR}
+        -DFROZEN_STDLIB_TYPE=${TF_FROZEN_STDLIB_TYPE}
+        -DPYTHON_INCLUDE_DIR=${_python_include_dirs}
+        ${_extra_args}
+        BUILD_COMMAND ${_locked_command} ${CMAKE_COMMAND} --build <BINARY_DIR> --config $<CONFIG>
+        INSTALL_COMMAND ""
+        BUILD_BYPRODUCTS ${_byproducts}
+    )
+
+    add_dependencies(${target} frozen_stdlib_build)
+    target_link_libraries(${target}
+        PRIVATE
+        "${_library_binary_dir}/${_library_file}"
+    )
+
+    if(TF_FROZEN_STDLIB_TYPE STREQUAL "SHARED")
+        target_compile_definitions(${target}
+            PRIVATE
+            USING_FROZEN_STDLIB_TABLE
+        )
+        set(TF_FROZEN_STDLIB_RUNTIME_LIBRARY "${_library_binary_dir}/${_runtime_library_file}" PARENT_SCOPE)
+    endif()
+endfunction()
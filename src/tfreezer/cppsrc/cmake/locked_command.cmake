@@ -0,0 +1,41 @@
+# Run a command while holding the lock of a directory, the lock is released when cmake exits.
+# Build directories of ExternalProject in the shared cache directory are used by every build on the machine,
+# so their configure and build steps run through this script, see mypyc_libraries.cmake and frozen_stdlib.cmake
+# Usage: cmake -DTF_LOCK_DIR=<dir> -P locked_command.cmake <command> [<arg>...]
+cmake_minimum_required(VERSION 3.21)
+
+if(NOT DEFINED TF_LOCK_DIR)
+    message(FATAL_ERROR "TF_LOCK_DIR is not set.")
+endif()
+
+set(_command_args "")
+set(_script_index -1)
+math(EXPR _last_index "${CMAKE_ARGC} - 1")
+
+foreach(_index RANGE ${_last_index})
+    if(_script_index EQUAL -1)
+        if(CMAKE_ARGV${_index} STREQUAL "-P")
+            math(EXPR _script_index "${_index} + 1")
+        endif()
+    elseif(_index GREATER _script_index)
+        # Bracket arguments keep empty arguments, e.g. --config "", and ";" of lists passed with LIST_SEPARATOR
+        string(APPEND _command_args " [==[${CMAKE_ARGV${_index}}]==]")
+    endif()
+endforeach()
+
+if(NOT _command_args)
+    message(FATAL_ERROR "No command to run.")
+endif()
+
+file(MAKE_DIRECTORY ${TF_LOCK_DIR})
+file(LOCK ${TF_LOCK_DIR} DIRECTORY GUARD PROCESS RESULT_VARIABLE _lock_result)
+
+if(_lock_result)
+    message(FATAL_ERROR "Failed to lock '${TF_LOCK_DIR}': ${_lock_result}")
+endif()
+
+cmake_language(EVAL CODE "execute_process(COMMAND${_command_args} RESULT_VARIABLE _result)")
+
+if(_result)
+    message(FATAL_ERROR "Command failed with ${_result}:${_command_args}")
+endif()
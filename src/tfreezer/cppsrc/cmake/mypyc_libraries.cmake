@@ -0,0 +1,110 @@
+include(ExternalProject)
+
+set(_TF_MYPYC_LIBRARIES_LIST_DIR ${CMAKE_CURRENT_LIST_DIR})
+
+# Variables are set by ${TF_BUILD_DIR}/mypyc_groups.cmake, which is generated by tfreezer.mypyc_source_generator:
+# TF_MYPYC_VERSION, TF_MYPYC_RUNTIME_DIR, TF_MYPYC_RUNTIME_SOURCES, TF_MYPYC_RUNTIME_CACHE_DIR,
+# TF_MYPYC_GROUPS and TF_MYPYC_GROUP_SOURCES_<group>
+
+# Build the mypyc runtime in the shared cache directory, creates target mypyc::runtime
+# The build directory is shared by all builds using the same compiler, so its steps run with the directory locked,
+# and everything that changes its configuration is in its name
+function(add_mypyc_runtime_library)
+    get_property(_is_multi_config GLOBAL PROPERTY GENERATOR_IS_MULTI_CONFIG)
+    get_target_property(_python_include_dirs cpython::libpython INTERFACE_INCLUDE_DIRECTORIES)
+
+    if(_is_multi_config)
+        set(_build_type "")
+    else()
+        set(_build_type ${CMAKE_BUILD_TYPE})
+    endif()
+
+    # Installations of tfreezer can't share the directory, cmake refuses to configure it with another source directory
+    string(SHA1 _compiler_hash "${CMAKE_C_COMPILER}|${_python_include_dirs}|${_TF_MYPYC_LIBRARIES_LIST_DIR}")
+    string(SUBSTRING ${_compiler_hash} 0 8 _compiler_hash)
+    set(_compiler_key "${CMAKE_C_COMPILER_ID}-${CMAKE_C_COMPILER_VERSION}-${CMAKE_GENERATOR}-${_build_type}-${_compiler_hash}")
+    string(MAKE_C_IDENTIFIER "${_compiler_key}" _compiler_key)
+    set(_runtime_binary_dir "${TF_MYPYC_RUNTIME_CACHE_DIR}/${_compiler_key}")
+    string(REPLACE ";" "|" _runtime_sources "${TF_MYPYC_RUNTIME_SOURCES}")
+    string(REPLACE ";" "|" _python_include_dirs "${_python_include_dirs}")
+    set(_runtime_file_name "${CMAKE_STATIC_LIBRARY_PREFIX}mypyc_runtime${CMAKE_STATIC_LIBRARY_SUFFIX}")
+    set(_runtime_library "${_runtime_binary_dir}/lib/$<CONFIG>/${_runtime_file_name}")
+
+    if(_is_multi_config)
+        set(_byproducts "")
+    else()
+        set(_byproducts "${_runtime_binary_dir}/lib/${CMAKE_BUILD_TYPE}/${_runtime_file_name}")
+    endif()
+
+    set(_locked_command ${CMAKE_COMMAND} -DTF_LOCK_DIR=<BINARY_DIR> -P ${_TF_MYPYC_LIBRARIES_LIST_DIR}/locked_command.cmake)
+    set(_generator_args -G ${CMAKE_GENERATOR})
+    if(CMAKE_GENERATOR_PLATFORM)
+        list(APPEND _generator_args -A ${CMAKE_GENERATOR_PLATFORM})
+    endif()
+    if(CMAKE_GENERATOR_TOOLSET)
+        list(APPEND _generator_args -T ${CMAKE_GENERATOR_TOOLSET})
+    endif()
+
+    ExternalProject_Add(mypyc_runtime_build
+        SOURCE_DIR ${_TF_MYPYC_LIBRARIES_LIST_DIR}/../mypyc_runtime
+        BINARY_DIR ${_runtime_binary_dir}
+        LIST_SEPARATOR |
+        CONFIGURE_COMMAND ${_locked_command}
+        ${CMAKE_COMMAND} ${_generator_args} -S <SOURCE_DIR> -B <BINARY_DIR>
+        -DCMAKE_C_COMPILER=${CMAKE_C_COMPILER}
+        -DCMAKE_BUILD_TYPE=${CMAKE_BUILD_TYPE}
+        -DMYPYC_RUNTIME_DIR=${TF_MYPYC_RUNTIME_DIR}
+        -DMYPYC_RUNTIME_SOURCES=${_runtime_sources}
+        -DPYTHON_INCLUDE_DIR=${_python_include_dirs}
+        BUILD_COMMAND ${_locked_command} ${CMAKE_COMMAND} --build <BINARY_DIR> --config $<CONFIG>
+        INSTALL_COMMAND ""
+        BUILD_BYPRODUCTS ${_byproducts}
+    )
+
+    add_library(mypyc_runtime INTERFACE)
+    add_dependencies(mypyc_runtime mypyc_runtime_build)
+    target_include_directories(mypyc_runtime
+        INTERFACE
+        ${TF_MYPYC_RUNTIME_DIR}
+    )
+    target_link_libraries(mypyc_runtime
+        INTERFACE
+        ${_runtime_library}
+        cpython::libpython
+    )
+    add_library(mypyc::runtime ALIAS mypyc_runtime)
+endfunction()
+
+# Create a static library for each mypyc group and link them to the target
+function(link_mypyc_libraries target)
+    if(NOT TARGET mypyc::runtime)
+        add_mypyc_runtime_library()
+    endif()
+
+    foreach(_group ${TF_MYPYC_GROUPS})
+        set(_group_target mypyc_group_${_group})
+        add_library(${_group_target} STATIC
+            ${TF_MYPYC_GROUP_SOURCES_${_group}}
+        )
+        target_link_libraries(${_group_target}
+            PUBLIC
+            mypyc::runtime
+        )
+
+        if(TARGET tfreezer_mypyc_codegen)
+            add_dependencies(${_group_target} tfreezer_mypyc_codegen)
+        endif()
+
+        if(CMAKE_C_COMPILER_ID MATCHES "GNU|Clang")
+            # Generated headers contain tentative definitions, which MSVC merges by default
+            target_compile_options(${_group_target}
+                PRIVATE
+                -fcommon
+            )
+        endif()
+        target_link_libraries(${target}
+            PRIVATE
+            ${_group_target}
+        )
+    endforeach()
+endfunction()
@@ -0,0 +1,49 @@
+# Variables are set by ${TF_BUILD_DIR}/static_extensions.cmake, which is generated by tfreezer.static_extension_generator:
+# TF_STATIC_EXTENSIONS and TF_STATIC_EXTENSION_<SOURCES|INCLUDE_DIRS|DEFINITIONS|LIBRARIES|LIBRARY_DIRS>_<extension>
+
+# Build every extension as a static library and link it into the target
+function(link_static_extensions target)
+    get_target_property(_python_include_dirs cpython::libpython INTERFACE_INCLUDE_DIRECTORIES)
+    set(_python_internal_include_dirs "")
+    foreach(_include_dir ${_python_include_dirs})
+        if(EXISTS ${_include_dir}/internal)
+            list(APPEND _python_internal_include_dirs ${_include_dir}/internal)
+        endif()
+    endforeach()
+
+    foreach(_extension ${TF_STATIC_EXTENSIONS})
+        set(_library static_extension_${_extension})
+        add_library(${_library} STATIC
+            ${TF_STATIC_EXTENSION_SOURCES_${_extension}}
+        )
+        target_include_directories(${_library}
+            PRIVATE
+            ${TF_STATIC_EXTENSION_INCLUDE_DIRS_${_extension}}
+            ${_python_internal_include_dirs}
+        )
+        target_compile_definitions(${_library}
+            PRIVATE
+            ${TF_STATIC_EXTENSION_DEFINITIONS_${_extension}}
+        )
+        if(TF_STATIC_EXTENSION_LIBRARY_DIRS_${_extension})
+            target_link_directories(${_library}
+                PUBLIC
+                ${TF_STATIC_EXTENSION_LIBRARY_DIRS_${_extension}}
+            )
+        endif()
+        target_link_libraries(${_library}
+            PUBLIC
+            cpython::libpython
+            ${TF_STATIC_EXTENSION_LIBRARIES_${_extension}}
+        )
+        target_link_libraries(${target}
+            PRIVATE
+            ${_library}
+        )
+    endforeach()
+
+    target_compile_definitions(${target}
+        PRIVATE
+        USING_STATIC_EXTENSIONS
+    )
+endfunction()
@@ -20,6 +20,39 @@
 #    include "mypyc_modules/tfreezer_mypyc_modules.h"
 #endif
 
+#if defined(USING_CYTHON_MODULES)
+#    include "cython_modules/tfreezer_cython_modules.h"
+#endif
+
+#if defined(USING_STATIC_EXTENSIONS)
+#    include "static_extensions/tfreezer_static_extensions.h"
+#endif
+
+#if defined(USING_FROZEN_STDLIB_TABLE)
+#    if defined(_WIN32)
+#        define TF_FROZEN_STDLIB_IMPORT __declspec(dllimport)
+#    else
+#        define TF_FROZEN_STDLIB_IMPORT
+#    endif
+// Frozen module table of the shared frozen standard library, see cmake/frozen_stdlib.cmake
+extern "C" TF_FROZEN_STDLIB_IMPORT const struct _frozen tfreezer_frozen_stdlib_modules[];
+
+// Modules of the application come first, so that they override modules of the standard library with the same name
+static const struct _frozen* merge_frozen_modules(const struct _frozen* app_modules, const struct _frozen* stdlib_modules)
+{
+    static std::vector<struct _frozen> merged_modules;
+    for (const struct _frozen* table : {app_modules, stdlib_modules})
+    {
+        for (const struct _frozen* module = table; module->name != nullptr; module++)
+        {
+            merged_modules.push_back(*module);
+        }
+    }
+    merged_modules.push_back(_frozen{}); // sentinel
+    return merged_modules.data();
+}
+#endif
+
 #define STR_HELPER(x) #x
 #define STR(x)        STR_HELPER(x)
 
@@ -113,6 +146,9 @@ static int multiprocess_main(int argc, char** argv)
     auto executable_directory = executable_path.parent_path().wstring();
 
     config.write_bytecode = 0;
+#    if defined(TF_MINIMAL_STARTUP)
+    config.site_import = 0; // startup_profile = "minimal", site isn't frozen
+#    endif
 
     // In Python3.11, this will not work.
     // See: https://github.com/python/cpython/issues/106718
@@ -313,8 +349,18 @@ WinMain(HINSTANCE hInst, HINSTANCE hPrevInst, LPSTR lpCmdLine, int nShowCmd) //
 #if defined(USING_MYPYC_MODULES)
     INITIALIZE_MYPYC_MODULES
 #endif
+#if defined(USING_CYTHON_MODULES)
+    INITIALIZE_CYTHON_MODULES
+#endif
+#if defined(USING_STATIC_EXTENSIONS)
+    INITIALIZE_STATIC_EXTENSIONS
+#endif
 #if defined(FREEZE_APPLICATION)
+#    if defined(USING_FROZEN_STDLIB_TABLE)
+    PyImport_FrozenModules = merge_frozen_modules(_PyImport_FrozenModules, tfreezer_frozen_stdlib_modules);
+#    else
     PyImport_FrozenModules = _PyImport_FrozenModules;
+#    endif
 
     bool is_multiprocessing = false;
     for (int arg_idx = 0; arg_idx < argc; arg_idx++)
@@ -367,6 +413,9 @@ WinMain(HINSTANCE hInst, HINSTANCE hPrevInst, LPSTR lpCmdLine, int nShowCmd) //
     auto executable_directory = executable_path.parent_path().wstring();
 
     config.write_bytecode = 0;
+#    if defined(TF_MINIMAL_STARTUP)
+    config.site_import = 0; // startup_profile = "minimal", site isn't frozen
+#    endif
 
     // In Python3.11, this will not work.
     // See: https://github.com/python/cpython/issues/106718
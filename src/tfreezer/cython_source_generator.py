@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Compile modules to C with Cython, the modules are linked into the executable and registered by PyImport_AppendInittab
+"""
+
+import sys
+import os
+import re
+import hashlib
+
+from mypyc.namegen import exported_name
+from mypyc.build import write_file
+
+from tfreezer import paths, log, utils, build_cache
+
+CYTHON_SOURCE_SUFFIXES = (".pyx", ".py")
+
+
+class CythonSourceGenerator:
+
+    def __init__(self):
+        self._modules: dict[str, str] = {}  # module name -> source path
+        self._sources: dict[str, str] = {}  # module name -> generated C path
+        self._target_dir = os.path.join(paths.BUILD_DIR, "generated", "cython_modules")
+        # Raw outputs of Cython, compared with the sources to skip unchanged modules
+        self._raw_dir = os.path.join(self._target_dir, "raw")
+
+    def add_module(self, module_name: str, module_path: str) -> None:
+        self._modules[module_name] = module_path
+
+    def generate(self) -> None:
+        """
+        Compile all added modules to C
+        A module is compiled again only if the digest of its source, the files it cimports and Cython changes
+        """
+        if not self._modules:
+            return
+        try:
+            from Cython.Compiler import Main  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            log.logger.error("Cython is not installed, it's required by cython_modules. Try: pip install tfreezer[cython]")
+            sys.exit(1)
+        os.makedirs(self._raw_dir, exist_ok=True)
+        for module_name, module_path in self._modules.items():
+            c_name = f"{exported_name(module_name)}.c"
+            raw_path = os.path.join(self._raw_dir, c_name)
+            digest_path = f"{raw_path}.digest"
+            digest = get_module_digest(module_path)
+            if not os.path.isfile(raw_path) or _read_text(digest_path) != digest:
+                log.logger.info("Compiling '%s' with Cython: %s", module_name, module_path)
+                options = Main.CompilationOptions(Main.default_options, output_file=raw_path, language_level=3)
+                result = Main.compile_single(module_path, options, full_module_name=module_name)
+                if result.num_errors:
+                    log.logger.error("Failed to compile '%s' with Cython", module_name)
+                    sys.exit(1)
+                utils.write_text_if_changed(digest_path, digest)
+            with open(raw_path, "r", encoding="utf-8") as fp:
+                ctext = fp.read()
+            # Paths of the sources are machine specific, see tfreezer.build_cache
+            ctext = build_cache.replace_source_paths(ctext, [os.path.abspath(module_path)])
+            c_path = os.path.join(self._target_dir, c_name)
+            write_file(c_path, rename_init_function(ctext, module_name))  # keep mtime if not changed
+            self._sources[module_name] = c_path
+
+    def dump_cython_info(self) -> None:
+        """
+        Dump Cython sources for cmake and the header registering the modules
+        """
+        cython_sources_path = os.path.join(paths.BUILD_DIR, "cython_sources")
+        if not self._sources:
+            # Clear outputs of previous builds, cmake configures again if they change
+            utils.write_text_if_changed(cython_sources_path, "")
+            return
+        sources = [the_path.replace("\\", "/") for the_path in self._sources.values()]
+        utils.write_text_if_changed(cython_sources_path, ";".join(sources))
+        header_lines = ["#pragma once", "#include <Python.h>", "", "#ifdef __cplusplus", 'extern "C" {', "#endif"]
+        initialize_macro_lines = ["#define INITIALIZE_CYTHON_MODULES"]
+        for module_name in self._sources:
+            header_lines.append(f"PyMODINIT_FUNC PyInit_{exported_name(module_name)}(void);")
+            initialize_macro_lines[-1] += " \\"
+            initialize_macro_lines.append(f'    PyImport_AppendInittab("{module_name}", &PyInit_{exported_name(module_name)});')
+        header_lines.extend(["#ifdef __cplusplus", "}", "#endif", ""])
+        header_lines.extend(initialize_macro_lines)
+        header_lines.append("")
+        write_file(os.path.join(self._target_dir, "tfreezer_cython_modules.h"), "\n".join(header_lines))
+
+
+def get_module_digest(module_path: str) -> str:
+    """
+    Digest of a module, the .pxd and .pxi files it cimports or includes, and the version of Cython
+    Modification times are not used, they are not changed by upgrades of Cython and may go backwards with checkouts
+    """
+    import Cython  # pylint: disable=import-outside-toplevel
+    from Cython.Build.Dependencies import create_dependency_tree  # pylint: disable=import-outside-toplevel
+
+    sha = hashlib.sha256(f"{Cython.__version__}\n".encode("utf-8"))
+    for dependency in sorted(create_dependency_tree(quiet=True).all_dependencies(module_path)):
+        sha.update(f"{os.path.abspath(dependency)}\n".encode("utf-8"))
+        try:
+            with open(dependency, "rb") as fp:
+                sha.update(fp.read())
+        except OSError:
+            sha.update(b"missing")
+    return sha.hexdigest()
+
+
+def _read_text(path: str) -> str:
+    if not os.path.isfile(path):
+        return ""
+    with open(path, "r", encoding="utf-8") as fp:
+        return fp.read()
+
+
+def rename_init_function(ctext: str, module_name: str) -> str:
+    """
+    Cython names the init function after the last component of the module name,
+    rename it after the fullname so that modules with the same name in different packages don't conflict
+    """
+    short_name = module_name.rpartition(".")[-1]
+    return re.sub(rf"\bPyInit_{re.escape(short_name)}\b", f"PyInit_{exported_name(module_name)}", ctext)
+
+
+def find_pyx_module(module_name: str) -> str:
+    """
+    Find source of a module that can't be found by modulefinder, e.g. .pyx files
+    Returns:
+        path of the source, empty string if not found
+    """
+    relpath = module_name.replace(".", os.sep)
+    for search_path in sys.path:
+        for suffix in CYTHON_SOURCE_SUFFIXES:
+            candidate = os.path.join(search_path or os.getcwd(), relpath + suffix)
+            if os.path.isfile(candidate):
+                return candidate
+    return ""
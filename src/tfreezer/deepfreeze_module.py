@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""Python implementation of the idea of ${CPYTHON_SRC}/Tools/build/deepfreeze.py
+
+Code objects of a module are written as statically initialized C data, the frozen module table
+gets them through `get_code`, so nothing is unmarshalled or allocated at import time.
+
+Unlike CPython's deepfreeze the generated C is compiled outside of libpython:
+type pointers and runtime singletons (None, small ints, empty tuple, etc.) are imported from libpython,
+their addresses are not constant on Windows, so they are patched when the code is got for the first time.
+Modules containing unsupported constants fall back to marshal with the same getter.
+"""
+
+import sys
+import io
+import types
+import marshal
+import opcode
+import typing as _t
+
+from tfreezer import freeze_module
+
+header = "/* Auto-generated by tfreezer.deepfreeze_module */"
+
+# The layout of the objects changes between python versions
+SUPPORTED_VERSIONS = ((3, 11),)
+
+# Reference count of static objects, they are never deallocated
+IMMORTAL_REFCNT = 999999999
+# See: ${CPYTHON_SRC}/Include/internal/pycore_code.h
+CO_FAST_LOCAL = 0x20
+CO_FAST_CELL = 0x40
+CO_FAST_FREE = 0x80
+RESUME = opcode.opmap.get("RESUME", -1)
+
+# Types of the static objects, indexes are used in the generated C
+OBJECT_TYPES = ("PyUnicode_Type", "PyBytes_Type", "PyTuple_Type", "PyLong_Type", "PyFloat_Type", "PyComplex_Type", "PyCode_Type")
+
+
+class DeepFreezeError(Exception):
+    """
+    The module can't be deep-frozen, it should fall back to marshal
+    """
+
+
+def is_supported() -> bool:
+    return sys.version_info[:2] in SUPPORTED_VERSIONS
+
+
+def get_getter_name(name: str) -> str:
+    """
+    Name of the function returning the code object of the module
+    """
+    return f"{freeze_module.get_varname(name, '_Py_get_')}_toplevel"
+
+
+def format_c_array(data: _t.Iterable[int], signed_char: bool = False) -> str:
+    values = [value - 256 if signed_char and value > 127 else value for value in data]
+    lines = []
+    for n in range(0, len(values), 16):
+        lines.append("        " + ", ".join(str(value) for value in values[n : n + 16]) + ",")
+    return "\n".join(lines)
+
+
+def is_identifier_like(text: str) -> bool:
+    """
+    Strings interned by the code object constructor, see: all_name_chars in ${CPYTHON_SRC}/Objects/codeobject.c
+    """
+    return text.isascii() and all(char.isalnum() or char == "_" for char in text)
+
+
+def get_localsplus(code: types.CodeType) -> tuple[tuple[str, ...], bytes]:
+    """
+    Get co_localsplusnames and co_localspluskinds, which are not exposed to python
+    """
+    kinds: dict[str, int] = {}
+    for name in code.co_varnames:
+        kinds[name] = kinds.get(name, 0) | CO_FAST_LOCAL
+    for name in code.co_cellvars:
+        kinds[name] = kinds.get(name, 0) | CO_FAST_CELL
+    for name in code.co_freevars:
+        if name in kinds:
+            raise DeepFreezeError(f"'{name}' is both a cell and a free variable of {code.co_qualname}")
+        kinds[name] = CO_FAST_FREE
+    names = tuple(kinds)
+    # The compiler uses the same order, double check it
+    for i, name in enumerate(names):
+        if code._varname_from_oparg(i) != name:  # type: ignore[attr-defined]
+            raise DeepFreezeError(f"Unexpected order of local variables of {code.co_qualname}")
+    return names, bytes(kinds.values())
+
+
+class Printer:
+    """
+    Write objects as C data, every object is written once
+    """
+
+    def __init__(self, scope: str) -> None:
+        self.scope = scope  # prefix of the names, so that modules can be written into one C file
+        self.lines: list[str] = []
+        self.cache: dict[tuple[str, _t.Any], _t.Optional[str]] = {}
+        self.counter = 0
+        self.objects: list[tuple[str, int]] = []  # (object address, index of OBJECT_TYPES)
+        self.runtime_slots: list[tuple[str, str]] = []  # (slot, C expression creating the object at runtime)
+        self.interned_slots: list[str] = []  # slots of strings that should be interned
+
+    def new_name(self, prefix: str) -> str:
+        self.counter += 1
+        return f"{self.scope}_{prefix}_{self.counter}"
+
+    def add_object(self, address: str, type_name: str) -> str:
+        self.objects.append((address, OBJECT_TYPES.index(type_name)))
+        return address
+
+    def set_slot(self, slot: str, obj: object) -> str:
+        """
+        Get the initializer of a slot referencing obj, patch the slot at runtime if obj is not static
+        """
+        address = self.generate(obj)
+        if address is not None:
+            return address
+        self.runtime_slots.append((slot, self.runtime_expression(obj)))
+        return "NULL"
+
+    def generate(self, obj: object) -> _t.Optional[str]:
+        """
+        Write obj as static C data
+        Returns:
+            address of the object, or None if the object is created at runtime
+        """
+        key = (type(obj).__name__, id(obj) if isinstance(obj, types.CodeType) else repr(obj))
+        if key in self.cache:
+            return self.cache[key]
+        if self.is_singleton(obj) or type(obj) is frozenset:
+            address = None
+        elif type(obj) is str:
+            address = self.generate_unicode(obj)
+        elif type(obj) is bytes:
+            address = self.generate_bytes(obj)
+        elif type(obj) is tuple:
+            address = self.generate_tuple(obj)
+        elif type(obj) is int:
+            address = self.generate_int(obj)
+        elif type(obj) is float:
+            address = self.generate_float(obj)
+        elif type(obj) is complex:
+            address = self.generate_complex(obj)
+        elif isinstance(obj, types.CodeType):
+            address = self.generate_code(obj)
+        else:
+            raise DeepFreezeError(f"Unsupported constant: {type(obj).__name__}")
+        self.cache[key] = address
+        return address
+
+    @staticmethod
+    def is_singleton(obj: object) -> bool:
+        """
+        Objects shared by the runtime, or that can't be written as constants
+        """
+        if obj is None or obj is Ellipsis or type(obj) is bool:
+            return True
+        if type(obj) is int:
+            return -5 <= obj <= 256  # small ints
+        if type(obj) is float:
+            return obj != obj or abs(obj) == float("inf")  # nan and inf
+        if type(obj) in (str, bytes):
+            return len(obj) <= 1  # empty and single character strings
+        if type(obj) is tuple:
+            return not obj  # empty tuple
+        return False
+
+    def runtime_expression(self, obj: object) -> str:
+        """
+        C expression creating a new reference of obj, for objects that can't be static data
+        """
+        if obj is None:
+            return "Py_NewRef(Py_None)"
+        if obj is Ellipsis:
+            return "Py_NewRef(Py_Ellipsis)"
+        if obj is True:
+            return "Py_NewRef(Py_True)"
+        if obj is False:
+            return "Py_NewRef(Py_False)"
+        if type(obj) is int:
+            return f"PyLong_FromLong({obj})"
+        if type(obj) is float:
+            if obj != obj:
+                return "PyFloat_FromDouble(Py_NAN)"
+            return f"PyFloat_FromDouble({'-' if obj < 0 else ''}Py_HUGE_VAL)"
+        if type(obj) is str:
+            return f"PyUnicode_FromOrdinal({ord(obj)})" if obj else "PyUnicode_New(0, 0)"
+        if type(obj) is bytes:
+            return f'PyBytes_FromStringAndSize("\\x{obj[0]:02x}", 1)' if obj else "PyBytes_FromStringAndSize(NULL, 0)"
+        if type(obj) is tuple:
+            return "PyTuple_New(0)"
+        if type(obj) is frozenset:
+            items = tuple(sorted(obj, key=repr))  # deterministic output
+            address = self.generate(items)
+            return f"PyFrozenSet_New({address})" if address else "PyFrozenSet_New(NULL)"
+        raise DeepFreezeError(f"Unsupported constant: {type(obj).__name__}")
+
+    def write_object(self, prefix: str, fields: list[str], initializers: list[str]) -> str:
+        name = self.new_name(prefix)
+        self.lines.append("static struct {")
+        self.lines.extend(f"    {field}" for field in fields)
+        self.lines.append(f"}} {name} = {{")
+        self.lines.extend(f"    {initializer}" for initializer in initializers)
+        self.lines.append("};")
+        return name
+
+    @staticmethod
+    def object_head(size: _t.Optional[int] = None) -> str:
+        head = f".ob_refcnt = {IMMORTAL_REFCNT}, .ob_type = NULL"
+        if size is None:
+            return f".ob_base = {{{head}}},"
+        return f".ob_base = {{.ob_base = {{{head}}}, .ob_size = {size}}},"
+
+    def generate_unicode(self, text: str) -> str:
+        max_char = max(map(ord, text))
+        if max_char < 128:
+            name = self.write_object(
+                "const_str",
+                ["PyASCIIObject _ascii;", f"uint8_t _data[{len(text) + 1}];"],
+                [
+                    "._ascii = {",
+                    f"    {self.object_head()}",
+                    f"    .length = {len(text)}, .hash = -1,",
+                    "    .state = {.kind = 1, .compact = 1, .ascii = 1, .ready = 1},",
+                    "},",
+                    "._data = {",
+                    format_c_array(text.encode("ascii") + b"\0"),
+                    "},",
+                ],
+            )
+            return self.add_object(f"(PyObject *)&{name}", "PyUnicode_Type")
+        kind, datatype = (1, "uint8_t") if max_char < 256 else (2, "uint16_t") if max_char < 65536 else (4, "uint32_t")
+        name = self.write_object(
+            "const_str",
+            ["PyCompactUnicodeObject _compact;", f"{datatype} _data[{len(text) + 1}];"],
+            [
+                "._compact = {",
+                "    ._base = {",
+                f"        {self.object_head()}",
+                f"        .length = {len(text)}, .hash = -1,",
+                f"        .state = {{.kind = {kind}, .compact = 1, .ascii = 0, .ready = 1}},",
+                "    },",
+                "},",
+                "._data = {",
+                format_c_array([ord(char) for char in text] + [0]),
+                "},",
+            ],
+        )
+        return self.add_object(f"(PyObject *)&{name}", "PyUnicode_Type")
+
+    def generate_bytes(self, data: bytes) -> str:
+        name = self.write_object(
+            "const_bytes",
+            ["PyObject_VAR_HEAD", "Py_hash_t ob_shash;", f"char ob_sval[{len(data) + 1}];"],
+            [self.object_head(len(data)), ".ob_shash = -1,", ".ob_sval = {", format_c_array(data + b"\0", signed_char=True), "},"],
+        )
+        return self.add_object(f"(PyObject *)&{name}", "PyBytes_Type")
+
+    def generate_tuple(self, items: tuple[_t.Any, ...]) -> str:
+        name = self.new_name("const_tuple")
+        slots = [self.set_slot(f"{name}._object.ob_item[{i}]", item) for i, item in enumerate(items)]
+        self.lines.append("static struct {")
+        # Tuples are gc objects, the gc head is zero as they are never tracked, see: ${CPYTHON_SRC}/Include/internal/pycore_gc.h
+        self.lines.append("    struct { uintptr_t _gc_next; uintptr_t _gc_prev; } _gc_head;")
+        self.lines.append(f"    struct {{ PyObject_VAR_HEAD PyObject *ob_item[{len(items)}]; }} _object;")
+        self.lines.append(f"}} {name} = {{")
+        self.lines.append(f"    ._object = {{ {self.object_head(len(items))} .ob_item = {{ {', '.join(slots)} }} }},")
+        self.lines.append("};")
+        return self.add_object(f"(PyObject *)&{name}._object", "PyTuple_Type")
+
+    def generate_int(self, value: int) -> str:
+        name = self.new_name("const_int")
+        sign = -1 if value < 0 else 1
+        self.lines.append("#if PYLONG_BITS_IN_DIGIT == 30")
+        for bits in (30, 15):
+            if bits == 15:
+                self.lines.append("#elif PYLONG_BITS_IN_DIGIT == 15")
+            rest, digits = abs(value), []
+            while rest:
+                rest, digit = divmod(rest, 1 << bits)
+                digits.append(digit)
+            self.lines.append("static struct {")
+            self.lines.append(f"    PyObject_VAR_HEAD digit ob_digit[{len(digits)}];")
+            self.lines.append(f"}} {name} = {{ {self.object_head(sign * len(digits))} .ob_digit = {{ {', '.join(map(str, digits))} }} }};")
+        self.lines.append("#else")
+        self.lines.append('#error "PYLONG_BITS_IN_DIGIT should be 15 or 30"')
+        self.lines.append("#endif")
+        return self.add_object(f"(PyObject *)&{name}", "PyLong_Type")
+
+    def generate_float(self, value: float) -> str:
+        name = self.new_name("const_float")
+        self.lines.append(f"static PyFloatObject {name} = {{ {self.object_head()} .ob_fval = {value!r} }};")
+        return self.add_object(f"(PyObject *)&{name}", "PyFloat_Type")
+
+    def generate_complex(self, value: complex) -> str:
+        for part in (value.real, value.imag):
+            if part != part or abs(part) == float("inf"):
+                raise DeepFreezeError("Unsupported constant: non-finite complex")
+        name = self.new_name("const_complex")
+        self.lines.append(f"static PyComplexObject {name} = {{ {self.object_head()} .cval = {{ {value.real!r}, {value.imag!r} }} }};")
+        return self.add_object(f"(PyObject *)&{name}", "PyComplex_Type")
+
+    def generate_code(self, code: types.CodeType) -> str:
+        name = self.new_name("code_object")
+        localsplusnames, localspluskinds = get_localsplus(code)
+        nlocals = nplaincellvars = ncellvars = nfreevars = 0
+        for kind in localspluskinds:
+            if kind & CO_FAST_LOCAL:
+                nlocals += 1
+                ncellvars += 1 if kind & CO_FAST_CELL else 0
+            elif kind & CO_FAST_CELL:
+                ncellvars += 1
+                nplaincellvars += 1
+            elif kind & CO_FAST_FREE:
+                nfreevars += 1
+        fields = {
+            "co_consts": code.co_consts,
+            "co_names": code.co_names,
+            "co_exceptiontable": code.co_exceptiontable,
+            "co_localsplusnames": localsplusnames,
+            "co_localspluskinds": localspluskinds,
+            "co_filename": code.co_filename,
+            "co_name": code.co_name,
+            "co_qualname": code.co_qualname,
+            "co_linetable": code.co_linetable,
+        }
+        initializers = {field: self.set_slot(f"{name}.{field}", value) for field, value in fields.items()}
+        self.intern_tuple(code.co_names, all_strings=True)
+        self.intern_tuple(localsplusnames, all_strings=True)
+        self.intern_tuple(code.co_consts, all_strings=False)
+        co_code = code.co_code
+        first_traceable = next((i for i in range(0, len(co_code), 2) if co_code[i] == RESUME), len(co_code)) // 2
+        # The order must be the same as _PyCode_DEF in ${CPYTHON_SRC}/Include/cpython/code.h, otherwise MSVC complains
+        self.lines.append(f"static struct _PyCode_DEF({len(co_code)}) {name} = {{")
+        self.lines.append(f"    {self.object_head(len(co_code) // 2)}")
+        for field in ("co_consts", "co_names", "co_exceptiontable"):
+            self.lines.append(f"    .{field} = {initializers[field]},")
+        self.lines.append(f"    .co_flags = {code.co_flags},")
+        self.lines.append("    .co_warmup = -8,  /* QUICKENING_INITIAL_WARMUP_VALUE */")
+        self.lines.append("    ._co_linearray_entry_size = 0,")
+        for field in ("co_argcount", "co_posonlyargcount", "co_kwonlyargcount", "co_stacksize", "co_firstlineno"):
+            self.lines.append(f"    .{field} = {getattr(code, field)},")
+        self.lines.append(f"    .co_nlocalsplus = {len(localsplusnames)},")
+        self.lines.append(f"    .co_nlocals = {nlocals},")
+        self.lines.append(f"    .co_nplaincellvars = {nplaincellvars},")
+        self.lines.append(f"    .co_ncellvars = {ncellvars},")
+        self.lines.append(f"    .co_nfreevars = {nfreevars},")
+        for field in ("co_localsplusnames", "co_localspluskinds", "co_filename", "co_name", "co_qualname", "co_linetable"):
+            self.lines.append(f"    .{field} = {initializers[field]},")
+        self.lines.append("    .co_weakreflist = NULL,")
+        self.lines.append("    ._co_code = NULL,")
+        self.lines.append("    ._co_linearray = NULL,")
+        self.lines.append(f"    ._co_firsttraceable = {first_traceable},")
+        self.lines.append("    .co_extra = NULL,")
+        self.lines.append("    .co_code_adaptive = {")
+        self.lines.append(format_c_array(co_code, signed_char=True))
+        self.lines.append("    },")
+        self.lines.append("};")
+        return self.add_object(f"(PyObject *)&{name}", "PyCode_Type")
+
+    def intern_tuple(self, items: tuple[_t.Any, ...], all_strings: bool) -> None:
+        """
+        Intern strings in a tuple like PyCode_New does, static strings are patched in their tuples
+        """
+        if not items:
+            return
+        address = self.cache[("tuple", repr(items))]
+        tuple_name = address.rpartition("&")[-1]
+        for i, item in enumerate(items):
+            if type(item) is str and len(item) > 1 and (all_strings or is_identifier_like(item)):
+                self.interned_slots.append(f"&{tuple_name}.ob_item[{i}]")
+            elif type(item) is tuple and not all_strings:
+                self.intern_tuple(item, all_strings)
+
+
+# Included once by files containing several modules
+SOURCE_PROLOGUE = f"""{header}
+#include "Python.h"
+#include "marshal.h"
+"""
+
+
+def get_deepfrozen_source(name: str, code: types.CodeType) -> str:
+    """
+    Get C source of the code object of a module as static C data with its getter
+    """
+    scope = freeze_module.get_varname(name, "_Py_DF__")
+    printer = Printer(scope)
+    toplevel = printer.generate(code)
+    getter = get_getter_name(name)
+    lines = [
+        "#if PY_VERSION_HEX < 0x030B0000 || PY_VERSION_HEX >= 0x030C0000",
+        '#error "Deep-frozen modules were generated for python 3.11"',
+        "#endif",
+        "",
+    ]
+    lines.extend(printer.lines)
+    lines.append("")
+    lines.append(f"static const struct {{ PyObject *object; int type; }} {scope}_static_objects[] = {{")
+    lines.extend(f"    {{{address}, {type_index}}}," for address, type_index in printer.objects)
+    lines.append("};")
+    lines.append("")
+    lines.append(f"static int {scope}_initialize_objects(void)")
+    lines.append("{")
+    lines.append(f"    PyTypeObject *object_types[] = {{{', '.join(f'&{type_name}' for type_name in OBJECT_TYPES)}}};")
+    lines.append(f"    for (size_t i = 0; i < sizeof({scope}_static_objects) / sizeof({scope}_static_objects[0]); i++) {{")
+    lines.append(f"        Py_SET_TYPE({scope}_static_objects[i].object, object_types[{scope}_static_objects[i].type]);")
+    lines.append("    }")
+    for slot, expression in printer.runtime_slots:
+        lines.append(f"    if (({slot} = {expression}) == NULL) return -1;")
+    for slot in printer.interned_slots:
+        lines.append(f"    PyUnicode_InternInPlace({slot});")
+    lines.append("    return 0;")
+    lines.append("}")
+    lines.append("")
+    lines.append(f"PyObject *{getter}(void)")
+    lines.append("{")
+    lines.append("    static int initialized = 0;")
+    lines.append("    if (!initialized) {")
+    lines.append(f"        if ({scope}_initialize_objects() < 0) return NULL;")
+    lines.append("        initialized = 1;")
+    lines.append("    }")
+    lines.append(f"    return Py_NewRef({toplevel});")
+    lines.append("}")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def get_marshalled_source(name: str, marshalled: bytes) -> str:
+    """
+    Fallback of get_deepfrozen_source, the getter unmarshals the code object
+    """
+    arrayname = freeze_module.get_varname(name, "_Py_M__")
+    outfile = io.StringIO()
+    outfile.write("static ")
+    freeze_module.write_code(outfile, marshalled, arrayname)
+    outfile.write(f"\nPyObject *{get_getter_name(name)}(void)\n{{\n")
+    outfile.write(f"    return PyMarshal_ReadObjectFromString((const char *){arrayname}, sizeof({arrayname}));\n}}\n")
+    return outfile.getvalue()
+
+
+def get_source(name: str, text: bytes) -> tuple[str, bool]:
+    """
+    Get C source of a module without SOURCE_PROLOGUE
+    Returns:
+        (source, False if the module falls back to marshal)
+    """
+    filename = f"<frozen {name}>"
+    code = compile(text, filename, "exec", optimize=0, dont_inherit=True)
+    if is_supported():
+        try:
+            return get_deepfrozen_source(name, code), True
+        except DeepFreezeError:
+            pass
+    return get_marshalled_source(name, freeze_module.normalize_marshalled(marshal.dumps(code))), False
+
+
+def deep_freeze(name: str, text: bytes, outpath: str) -> bool:
+    """
+    Write a module to its own C file
+    Returns:
+        False if the module falls back to marshal
+    """
+    source, is_deepfrozen = get_source(name, text)
+    with open(outpath, "w", encoding="utf-8") as outfile:
+        outfile.write(SOURCE_PROLOGUE)
+        outfile.write("\n")
+        outfile.write(source)
+    return is_deepfrozen
@@ -11,13 +11,26 @@ The generated byte code is slightly different because
 compile() sets the PyCF_SOURCE_IS_UTF8 flag and objects have a
 reference count > 1. Marshal adds the `FLAG_REF` flag and creates a
 reference `hashtable`.
+Reference counts depend on the state of the interpreter, normalize_marshalled()
+removes the flags that are never used, so that the output only depends on the input.
 """
 
 import marshal
+import struct
 import sys
 
 header = "/* Auto-generated by tfreezer.freeze_module */"
 
+# See: ${CPYTHON_SRC}/Python/marshal.c
+_FLAG_REF = 0x80
+_SINGLETON_TYPES = b"0NFTS."
+_FIXED_SIZES = {ord("i"): 4, ord("I"): 8, ord("g"): 8, ord("y"): 16}
+_SIZED_TYPES = b"stuaA"  # 4 bytes size
+_SHORT_SIZED_TYPES = b"zZf"  # 1 byte size
+_SEQUENCE_TYPES = b"([<>"  # 4 bytes length
+# Code objects of python 3.11+: 5 ints, 8 objects, firstlineno, 2 objects
+_CODE_LAYOUT = (5, 8, 1, 2)
+
 
 def read_text(inpath: str) -> bytes:
     with open(inpath, "rb") as f:
@@ -28,7 +41,85 @@ def compile_and_marshal(name: str, text: bytes) -> bytes:
     filename = f"<frozen {name}>"
     # exec == Py_file_input
     code = compile(text, filename, "exec", optimize=0, dont_inherit=True)
-    return marshal.dumps(code)
+    return normalize_marshalled(marshal.dumps(code))
+
+
+def _scan_object(data: bytes, offset: int, flag_offsets: list[int], references: list[tuple[int, int]]) -> int:
+    """
+    Scan a marshalled object, reference indexes are assigned to flagged objects in pre-order, like marshal does
+    Args:
+        flag_offsets: offsets of flagged objects, the index of an offset is the reference index of the object
+        references: (offset of the index, reference index) of TYPE_REF
+    Returns:
+        offset after the object
+    """
+    type_code = data[offset] & ~_FLAG_REF
+    if data[offset] & _FLAG_REF:
+        flag_offsets.append(offset)
+    offset += 1
+    if type_code in _SINGLETON_TYPES:
+        return offset
+    if type_code == ord("r"):
+        references.append((offset, struct.unpack_from("<i", data, offset)[0]))
+        return offset + 4
+    if type_code in _FIXED_SIZES:
+        return offset + _FIXED_SIZES[type_code]
+    if type_code == ord("l"):
+        return offset + 4 + 2 * abs(struct.unpack_from("<i", data, offset)[0])
+    if type_code in _SIZED_TYPES:
+        return offset + 4 + struct.unpack_from("<i", data, offset)[0]
+    if type_code in _SHORT_SIZED_TYPES:
+        return offset + 1 + data[offset]
+    if type_code == ord("x"):
+        offset += 1 + data[offset]
+        return offset + 1 + data[offset]
+    if type_code in _SEQUENCE_TYPES or type_code == ord(")"):
+        if type_code == ord(")"):
+            length, offset = data[offset], offset + 1
+        else:
+            length, offset = struct.unpack_from("<i", data, offset)[0], offset + 4
+        for _ in range(length):
+            offset = _scan_object(data, offset, flag_offsets, references)
+        return offset
+    if type_code == ord("{"):
+        while data[offset] != ord("0"):
+            offset = _scan_object(data, offset, flag_offsets, references)
+            offset = _scan_object(data, offset, flag_offsets, references)
+        return offset + 1
+    if type_code == ord("c"):
+        int_count, object_count, line_count, table_count = _CODE_LAYOUT
+        offset += 4 * int_count
+        for _ in range(object_count):
+            offset = _scan_object(data, offset, flag_offsets, references)
+        offset += 4 * line_count
+        for _ in range(table_count):
+            offset = _scan_object(data, offset, flag_offsets, references)
+        return offset
+    raise ValueError(f"Unsupported marshal type {chr(type_code)!r} at offset {offset - 1}")
+
+
+def normalize_marshalled(marshalled: bytes) -> bytes:
+    """
+    Remove FLAG_REF of objects that are never referred to again, and renumber the references,
+    the output of marshal.dumps() depends on reference counts otherwise
+    """
+    if sys.version_info < (3, 11):
+        return marshalled
+    flag_offsets: list[int] = []
+    references: list[tuple[int, int]] = []
+    end = _scan_object(marshalled, 0, flag_offsets, references)
+    assert end == len(marshalled), f"{len(marshalled) - end} bytes left after the marshalled object"
+    referred_indexes = {index for _, index in references}
+    new_indexes: dict[int, int] = {}
+    normalized = bytearray(marshalled)
+    for index, flag_offset in enumerate(flag_offsets):
+        if index in referred_indexes:
+            new_indexes[index] = len(new_indexes)
+        else:
+            normalized[flag_offset] &= ~_FLAG_REF
+    for offset, index in references:
+        struct.pack_into("<i", normalized, offset, new_indexes[index])
+    return bytes(normalized)
 
 
 def get_varname(name: str, prefix: str) -> str:
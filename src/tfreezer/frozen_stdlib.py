@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+The standard library frozen once per interpreter into a library in the shared cache directory,
+applications built with it only freeze their own modules, see FROZEN_STDLIB_LIBRARY_TYPES in tfreezer.config
+"""
+
+import typing as _t
+import sys
+import sysconfig
+import os
+import shutil
+import hashlib
+import dataclasses
+
+from tfreezer import paths, utils
+
+# Packages of the standard library that applications don't import
+EXCLUDED_PACKAGES = ("test", "tests", "idlelib", "turtledemo", "__phello__", "site-packages", "dist-packages", "__pycache__")
+EXCLUDED_MODULES = ("__hello__",)
+# Frozen module table of the shared library, see cppsrc/main.cpp, it's unused and dropped by the linker in the static library
+TABLE_SOURCE_NAME = "frozen_stdlib_table.cpp"
+
+
+@dataclasses.dataclass
+class FrozenStdlibLibrary:
+    """
+    Data struct for the frozen standard library of an interpreter
+    """
+
+    directory: str  # ${CACHE_DIR}/frozen_stdlib/<key>, build directories of compilers are in it
+    modules: dict[str, str]  # module name -> module file, empty if the sources are not generated yet
+
+    @property
+    def source_dir(self) -> str:
+        return os.path.join(self.directory, "sources")
+
+    @property
+    def modules_path(self) -> str:
+        return os.path.join(self.source_dir, "modules")
+
+    def contains(self, module_name: str, module_file: str) -> bool:
+        """
+        Check whether a module is in the library, modules of the application may shadow modules of the standard library
+        """
+        stdlib_file = self.modules.get(module_name)
+        return stdlib_file is not None and os.path.normcase(stdlib_file) == os.path.normcase(module_file)
+
+
+def get_stdlib_modules(excludes: _t.Iterable[str] = ()) -> dict[str, str]:
+    """
+    Get source modules of the standard library
+    Args:
+        excludes: module names to skip, e.g. modules frozen by the interpreter itself
+    Returns:
+        module name -> module file
+    """
+    excludes = set(excludes) | set(EXCLUDED_MODULES)
+    stdlib_dir = sysconfig.get_paths()["stdlib"]
+    modules = {}
+    for root, dirs, files in os.walk(stdlib_dir):
+        relative_dir = os.path.relpath(root, stdlib_dir)
+        package = "" if relative_dir == os.curdir else relative_dir.replace(os.sep, ".")
+        # Namespace packages are not in the standard library
+        dirs[:] = sorted(
+            dir_name
+            for dir_name in dirs
+            if dir_name not in EXCLUDED_PACKAGES and dir_name.isidentifier() and os.path.isfile(os.path.join(root, dir_name, "__init__.py"))
+        )
+        for file_name in sorted(files):
+            stem, ext = os.path.splitext(file_name)
+            if ext != ".py" or not stem.isidentifier() or (stem == "__init__" and not package):
+                continue
+            module_name = package if stem == "__init__" else f"{package}.{stem}" if package else stem
+            if module_name not in excludes:
+                modules[module_name] = os.path.join(root, file_name)
+    return modules
+
+
+def get_library(frozen_format: str, generator_files: _t.Iterable[str]) -> FrozenStdlibLibrary:
+    """
+    Get the frozen standard library of this interpreter, it's shared by all applications
+    Args:
+        frozen_format: one of tfreezer.config.FROZEN_FORMATS
+        generator_files: files deciding the generated sources, a new library is generated if they change
+    """
+    digest = hashlib.sha256(sys.version.encode("utf-8"))
+    digest.update(sysconfig.get_paths()["stdlib"].encode("utf-8"))
+    for generator_file in sorted({os.path.abspath(the_path) for the_path in generator_files} | {os.path.abspath(__file__)}):
+        with open(generator_file, "rb") as fp:
+            digest.update(fp.read())
+    key = f"py{sys.version_info.major}.{sys.version_info.minor}-{frozen_format}-{digest.hexdigest()[:16]}"
+    library = FrozenStdlibLibrary(os.path.join(paths.CACHE_DIR, "frozen_stdlib", key), {})
+    if os.path.isfile(library.modules_path):
+        library.modules = utils.load_signle_module("tfreezer.frozen_stdlib_modules", library.modules_path).FROZEN_STDLIB_MODULES
+    return library
+
+
+def write_library_sources(library: FrozenStdlibLibrary, module_sources: dict[str, tuple[str, str]], table_source: str) -> None:
+    """
+    Write one C source per module and the frozen module table, every module is an object file of the static library
+    Args:
+        module_sources: module name -> (module file, C source)
+        table_source: C++ source of the frozen module table
+    """
+    # Generated next to the library and renamed, so that builds running at the same time never see partial sources
+    temp_dir = f"{library.source_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    for module_name, (_, source) in module_sources.items():
+        with open(os.path.join(temp_dir, f"{module_name}.c"), "w", encoding="utf-8") as fp:
+            fp.write(source)
+    with open(os.path.join(temp_dir, TABLE_SOURCE_NAME), "w", encoding="utf-8") as fp:
+        fp.write(table_source)
+    contents = ["FROZEN_STDLIB_MODULES = {"]
+    contents.extend(f'    "{module_name}": r"{module_file}",' for module_name, (module_file, _) in module_sources.items())
+    contents.extend(["}", ""])
+    with open(os.path.join(temp_dir, os.path.basename(library.modules_path)), "w", encoding="utf-8") as fp:
+        fp.write("\n".join(contents))
+    try:
+        os.rename(temp_dir, library.source_dir)
+    except OSError:
+        # Generated by another build in the meantime
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    library.modules = {module_name: module_file for module_name, (module_file, _) in module_sources.items()}
+
+
+def dump_frozen_stdlib_info(library: _t.Optional[FrozenStdlibLibrary], library_type: str) -> None:
+    """
+    Dump the frozen standard library for cmake, see cmake/frozen_stdlib.cmake
+    Args:
+        library: None if the standard library is frozen with the application
+        library_type: one of tfreezer.config.FROZEN_STDLIB_LIBRARY_TYPES
+    """
+    frozen_stdlib_path = os.path.join(paths.BUILD_DIR, "frozen_stdlib.cmake")
+    if library is None:
+        # Clear outputs of previous builds, cmake configures again if they change
+        utils.write_text_if_changed(frozen_stdlib_path, "")
+        return
+    cmake_lines = [
+        f'set(TF_FROZEN_STDLIB_TYPE "{library_type.upper()}")',
+        f'set(TF_FROZEN_STDLIB_SOURCE_DIR "{library.source_dir}")'.replace("\\", "/"),
+        f'set(TF_FROZEN_STDLIB_CACHE_DIR "{library.directory}")'.replace("\\", "/"),
+        "",  # Extra empty line to make it prettier
+    ]
+    # Kept unchanged if possible, cmake configures again if it changes
+    utils.write_text_if_changed(frozen_stdlib_path, "\n".join(cmake_lines))
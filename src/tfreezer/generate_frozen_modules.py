@@ -17,14 +17,19 @@ import importlib
 from importlib import machinery, util
 import modulefinder
 import dataclasses
+import fnmatch
 import subprocess
-import shutil
-import multiprocessing
+import io
+import zlib
+import contextlib
+import concurrent.futures
 
 if os.environ.get("DEBUG"):
     import debugpy
 
-from tfreezer import paths, log, utils, config, freeze_module, mypyc_source_generator
+from tfreezer import paths, log, utils, config, freeze_module, mypyc_source_generator, cython_source_generator
+from tfreezer import static_extension_generator, deepfreeze_module, build_manifest, import_guards, frozen_stdlib, build_cache
+from tfreezer import metadata_index
 from tfreezer.hooks import analysis_hooks
 
 # See: ${CPYTHON_SRC}/Python/frozen.c
@@ -55,7 +60,16 @@ OFFICIAL_FROZEN_MODULE_NAMES = (
 FROZEN_MODULES_HEADER_SRC = """\
 // Generated by: tfreezer.generate_frozen_modules
 #include "Python.h"
-{frozen_headers}
+{startup_definitions}
+
+// Defined in the shards of frozen modules
+#ifdef __cplusplus
+extern "C" {{
+#endif
+{declarations}
+#ifdef __cplusplus
+}}
+#endif
 
 static struct _frozen _PyImport_FrozenModules[] = {{
 {module_infos}
@@ -63,6 +77,52 @@ static struct _frozen _PyImport_FrozenModules[] = {{
 }};
 """
 
+FROZEN_STDLIB_TABLE_SRC = """\
+// Generated by: tfreezer.generate_frozen_modules
+#include "Python.h"
+
+#if defined(_WIN32)
+#    define TF_FROZEN_STDLIB_EXPORT __declspec(dllexport)
+#else
+#    define TF_FROZEN_STDLIB_EXPORT __attribute__((visibility("default")))
+#endif
+
+// Defined in the sources of the modules
+extern "C" {{
+{declarations}
+}}
+
+extern "C" TF_FROZEN_STDLIB_EXPORT const struct _frozen tfreezer_frozen_stdlib_modules[] = {{
+{module_infos}
+    {{0, 0, 0}}  /* sentinel */
+}};
+"""
+
+DEV_OVERLAY_MODULE_SRC = """\
+# Generated by: tfreezer.generate_frozen_modules
+# Modules in the source roots are loaded from their sources, see TfDevOverlayFinder in bootstrap/tf_importer.py
+SOURCE_ROOTS = {source_roots!r}
+ENTRY_FILE = {entry_file!r}
+"""
+
+# Frozen modules are distributed to a fixed number of C files, so that outputs of the build commands don't change
+# when modules are added or removed, and the shards are frozen and compiled concurrently
+FROZEN_SHARD_COUNT = 16
+# Config files in the build directory read by the analysis
+ANALYSIS_CONFIG_FILES = (
+    "paths",
+    "entry_module",
+    "hidden_imports",
+    "excludes",
+    "mypyc_modules",
+    "python_path",
+    "cython_config",
+    "static_extensions_config",
+    "frozen_config",
+    "analysis_config",
+    "mypyc_rejected_modules",
+)
+
 
 @dataclasses.dataclass
 class ModuleInfo:
@@ -85,7 +145,10 @@ class ModuleAnalysisInfo:
     entry_module_name: str  # A python module name or a signle python_file
     hidden_imports: list[str]  # hidden import module names
     excludes: list[str]  # exclude module names
-    mypyc_module_names: list[str]  # modules that are needed to be compiled to c using mypyc
+    mypyc_module_names: list[str]  # modules that are needed to be compiled to c using mypyc, fnmatch patterns are allowed, e.g. mylib.*
+    cython_module_names: list[str] = dataclasses.field(default_factory=list)  # modules compiled to c using Cython, patterns are allowed
+    prune_guarded_imports: bool = True  # whether to skip imports guarded by conditions that are false on this interpreter
+    startup_profile: str = "default"  # one of tfreezer.config.STARTUP_PROFILES
 
 
 class ModuleType(enum.IntFlag):
@@ -144,14 +207,20 @@ def get_list_arg(arg_str: str, arg_name: str = "") -> typing.List[str]:
     return list_args
 
 
-def get_python_bootstrap_module_names() -> typing.List[str]:
+def get_python_bootstrap_module_names(import_site: bool = True) -> typing.List[str]:
     """
     Get python bootstrap module names
+    Args:
+        import_site: False to get the modules imported before the main module without site, the environment is ignored too
     Returns:
         list
     """
+    options = "" if import_site else "-S -I "
     with subprocess.Popen(
-        f'{sys.executable} -c "import sys; print(list(sys.modules.keys()))"', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        f'{sys.executable} {options}-c "import sys; print(list(sys.modules.keys()))"',
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
     ) as p:
         p.wait()
         stdout, stderr = p.communicate()
@@ -176,17 +245,6 @@ def get_python_bootstrap_module_names() -> typing.List[str]:
     return bootstrap_module_names
 
 
-def clear_frozen_module_dir() -> None:
-    """
-    Clear frozen module dir
-    Returns:
-        None
-    """
-    if os.path.isdir(paths.FROZEN_MODULE_DIR):
-        shutil.rmtree(paths.FROZEN_MODULE_DIR)
-    os.makedirs(paths.FROZEN_MODULE_DIR)
-
-
 def is_package(module: types.ModuleType) -> bool:
     """
     Return True if the module is a package.
@@ -292,9 +350,59 @@ def get_module_varname(name: str, prefix: str) -> str:
     return f"{prefix}{name.replace('.', '_')}"
 
 
-def analyze_module(analysis_info: ModuleAnalysisInfo, module_type: ModuleType) -> dict[str, modulefinder.Module]:
+class _AnalysisModuleFinder(modulefinder.ModuleFinder):
+    """
+    ModuleFinder that reports every source module once it's loaded, before its imports are scanned,
+    and doesn't follow imports in branches that never run on the target
+    """
+
+    def __init__(
+        self,
+        module_found_callback: typing.Optional[typing.Callable[[str, modulefinder.Module], None]],
+        pruned_imports: typing.Optional[list[import_guards.PrunedImport]],
+        *args,
+        evaluate_name: bool = False,
+        **kwargs,
+    ) -> None:
+        """
+        Args:
+            pruned_imports: imports in branches that never run are appended to it, None means nothing is pruned
+            evaluate_name: whether `if __name__ == "__main__":` is only true for the entry module
+        """
+        super().__init__(*args, **kwargs)
+        self._module_found_callback = module_found_callback
+        self._pruned_imports = pruned_imports
+        self._evaluate_name = evaluate_name
+        self._found_module_names: set[str] = set()
+
+    def scan_code(self, co: types.CodeType, m: modulefinder.Module) -> None:
+        # Also called for nested code objects of the module
+        if m.__name__ not in self._found_module_names:
+            self._found_module_names.add(m.__name__)
+            if self._module_found_callback is not None:
+                self._module_found_callback(m.__name__, m)
+            if self._pruned_imports is not None and m.__file__ and m.__file__.endswith(tuple(machinery.SOURCE_SUFFIXES)):
+                pruned_co, pruned_imports = import_guards.prune_guarded_imports(
+                    m.__name__, freeze_module.read_text(m.__file__), m.__file__, self._evaluate_name
+                )
+                if pruned_co is not None:
+                    co = pruned_co
+                    self._pruned_imports.extend(pruned_imports)
+        super().scan_code(co, m)
+
+
+def analyze_module(
+    analysis_info: ModuleAnalysisInfo,
+    module_type: ModuleType,
+    module_found_callback: typing.Optional[typing.Callable[[str, modulefinder.Module], None]] = None,
+    pruned_imports: typing.Optional[list[import_guards.PrunedImport]] = None,
+) -> dict[str, modulefinder.Module]:
     """
     Get all [module_type] of modules used by [analysis_info]
+    Args:
+        module_found_callback: called with (name, module) for every source module as soon as it's found,
+            the entry module is named __main__
+        pruned_imports: imports that aren't followed because of analysis_info.prune_guarded_imports are appended to it
     Returns:
         All module infos
     """
@@ -322,18 +430,22 @@ def analyze_module(analysis_info: ModuleAnalysisInfo, module_type: ModuleType) -
         excludes += [
             "multiprocessing.popen_spawn_win32",
         ]
-    bootstrap_module_names = get_python_bootstrap_module_names()
-    # modules that are imported by the Python runtime
-    # copy from ${CPYTHON_SRC}/Tools/freeze/freeze.py
-    bootstrap_module_names += ["site", "warnings", "encodings.utf_8", "encodings.latin_1"]
+    if analysis_info.startup_profile == "minimal":
+        # site isn't imported, warnings is imported at startup if there are warning options, e.g. PYTHONWARNINGS
+        bootstrap_module_names = get_python_bootstrap_module_names(import_site=False)
+        bootstrap_module_names += ["warnings", "encodings.utf_8", "encodings.latin_1"]
+    else:
+        bootstrap_module_names = get_python_bootstrap_module_names()
+        # modules that are imported by the Python runtime
+        # copy from ${CPYTHON_SRC}/Tools/freeze/freeze.py
+        bootstrap_module_names += ["site", "warnings", "encodings.utf_8", "encodings.latin_1"]
+        # pathlib is imported lazily by the resource reader of bootstrap module tf_importer,
+        # with the minimal profile it's only frozen if the application imports it, e.g. through importlib.resources
+        bootstrap_module_names.append("pathlib")
     hidden_imports += bootstrap_module_names
     if "os.path" in hidden_imports:
         hidden_imports.remove("os.path")  # remove alias module
 
-    if "pathlib" not in hidden_imports:
-        # pathlib is used by bootstrap module: tf_importer
-        hidden_imports.append("pathlib")
-
     module_info = get_module_info(analysis_info.entry_module_name, is_entry_module=True)
     additional_path = None
     path = sys.path[:]
@@ -350,7 +462,17 @@ def analyze_module(analysis_info: ModuleAnalysisInfo, module_type: ModuleType) -
     extra_hidden_imports: list[str] = []
     replace_paths: list[str, str] = []
     extra_modules = analysis_hooks.hook(extra_hidden_imports, excludes, path, replace_paths)
-    finder = modulefinder.ModuleFinder(path=path, excludes=excludes, replace_paths=replace_paths)
+    if pruned_imports is None:
+        pruned_imports = []
+    finder = _AnalysisModuleFinder(
+        module_found_callback,
+        pruned_imports if analysis_info.prune_guarded_imports else None,
+        # With the minimal profile, self-tests and demos of library modules aren't frozen
+        evaluate_name=analysis_info.startup_profile == "minimal",
+        path=path,
+        excludes=excludes,
+        replace_paths=replace_paths,
+    )
     finder.modules.update(extra_modules)
 
     # Add tfreezer bootstrap modules
@@ -385,24 +507,50 @@ def analyze_module(analysis_info: ModuleAnalysisInfo, module_type: ModuleType) -
     return modules
 
 
+def is_mypyc_module(module_name: str, module: modulefinder.Module, patterns: list[str]) -> bool:
+    """
+    Check whether a module matches mypyc module names
+    Args:
+        module_name: fullname of the module
+        module: the module found by modulefinder
+        patterns: exact module names or fnmatch patterns, e.g. mylib.* matches all submodules of mylib
+    Returns:
+        bool
+    """
+    for pattern in patterns:
+        if pattern == module_name:
+            return True
+        # A package compiled by mypyc can't have submodules, so packages are only compiled if they are specified exactly
+        if module.__path__ is None and fnmatch.fnmatchcase(module_name, pattern):
+            return True
+    return False
+
+
 def get_frozen_module_names(
     analysis_info: ModuleAnalysisInfo,
     *,
     info: typing.Optional[dict[str, modulefinder.Module]] = None,
     mypyc_module_info: typing.Optional[dict[str, modulefinder.Module]],
+    cython_module_info: typing.Optional[dict[str, modulefinder.Module]] = None,
+    module_found_callback: typing.Optional[typing.Callable[[str, modulefinder.Module], None]] = None,
+    pruned_imports: typing.Optional[list[import_guards.PrunedImport]] = None,
 ) -> list[str]:
     """
     Get all frozen module names
     Returns:
         All frozen module names
     """
-    modules = analyze_module(analysis_info, ModuleType.SOURCE_MODULE)
+    modules = analyze_module(analysis_info, ModuleType.SOURCE_MODULE, module_found_callback, pruned_imports)
     module_names = sorted(modules.keys())
     frozen_module_names = []
     for module_name in module_names:
         if is_frozen_module(module_name):
             continue
-        if module_name in analysis_info.mypyc_module_names:
+        if is_mypyc_module(module_name, modules[module_name], analysis_info.cython_module_names):
+            if cython_module_info is not None:
+                cython_module_info[module_name] = modules[module_name]
+            continue
+        if is_mypyc_module(module_name, modules[module_name], analysis_info.mypyc_module_names):
             if mypyc_module_info is not None:
                 mypyc_module_info[module_name] = modules[module_name]
             continue
@@ -410,53 +558,167 @@ def get_frozen_module_names(
     if info is not None:
         for module_name, module in modules.items():
             info[module_name] = module
+    for pattern in analysis_info.mypyc_module_names:
+        if not any(is_mypyc_module(module_name, modules[module_name], [pattern]) for module_name in module_names):
+            log.logger.warning("mypyc module '%s' doesn't match any analyzed source module", pattern)
     return frozen_module_names
 
 
-def _dump_frozen_module_info(module_names: list[str], module_info: dict[str, modulefinder.Module], headers: list[str]) -> None:
+def get_frozen_format() -> str:
     """
-    Dump frozen module info to build directory
+    Get the format of frozen modules, deepfreeze falls back to marshal on unsupported python versions
     """
-    info_file = os.path.join(paths.BUILD_DIR, "frozen_module_cache")
-    info_file_contents = ["FROZEN_MODULES = {"]
-    for module_name in module_names:
-        file_path = "Unknown file"
-        module = module_info.get(module_name)
-        if module:
-            file_path = module.__file__
-        info_file_contents.append(f'    "{module_name}": r"{file_path}",')
-    info_file_contents.append("}")
-    info_file_contents.append("")  # extra empty line to make the file prettier
-    with open(info_file, "w", encoding="utf-8") as fp:
-        fp.write("\n".join(info_file_contents))
-    cmake_info_file = os.path.join(paths.BUILD_DIR, "frozen_headers")
-    with open(cmake_info_file, "w", encoding="utf-8") as fp:
-        fp.write(";".join(headers))
+    frozen_format = config.load_frozen_format()
+    if frozen_format == "deepfreeze" and not deepfreeze_module.is_supported():
+        log.logger.warning("deepfreeze doesn't support python %d.%d, frozen modules are marshalled", *sys.version_info[:2])
+        return "marshal"
+    return frozen_format
 
 
-def _load_frozen_module_info() -> dict[str, str]:
+def get_shard_index(module_name: str) -> int:
     """
-    Load frozen module names and paths
+    Get the shard of a frozen module, crc32 is stable between processes unlike hash()
     """
-    info_file = os.path.join(paths.BUILD_DIR, "frozen_module_cache")
-    if not os.path.isfile(info_file):
-        usage(f"Failed to load frozen module info. No such file: '{info_file}'")
-    fullname = "tfreezer.frozen_module_cache"
-    module = utils.load_signle_module(fullname, info_file)
-    assert hasattr(module, "FROZEN_MODULES")
-    return module.FROZEN_MODULES
+    return zlib.crc32(module_name.encode("utf-8")) % FROZEN_SHARD_COUNT
+
+
+def get_shard_source_path(index: int) -> str:
+    return os.path.join(paths.FROZEN_MODULE_DIR, f"frozen_shard_{index}.c")
+
+
+def get_shard_modules_path(index: int) -> str:
+    return os.path.join(paths.FROZEN_MODULE_DIR, f"frozen_shard_{index}.modules")
+
+
+def get_depfile_path(name: str) -> str:
+    return os.path.join(paths.BUILD_DIR, "depfiles", f"{name}.d")
+
 
+def get_stamp_path(name: str) -> str:
+    return os.path.join(paths.BUILD_DIR, f"{name}.stamp")
 
-def print_frozen_header_file_names(entry_module_name: str, hidden_imports_arg: str, excludes_arg: str, mypyc_modules_arg: str) -> None:
+
+def _write_stamp(name: str) -> None:
+    with open(get_stamp_path(name), "w", encoding="utf-8") as fp:
+        fp.write("")
+
+
+def _read_build_plan() -> dict[str, typing.Optional[str]]:
+    """
+    Read the files that decide the outputs of the build commands
+    """
+    plan = {}
+    for file_name in build_manifest.BUILD_PLAN_FILES:
+        file_path = os.path.join(paths.BUILD_DIR, file_name)
+        plan[file_name] = None
+        if os.path.isfile(file_path):
+            with open(file_path, "r", encoding="utf-8") as fp:
+                plan[file_name] = fp.read()
+    return plan
+
+
+def _check_build_plan(previous_plan: dict[str, typing.Optional[str]]) -> None:
+    """
+    Stop the build if the build plan changes, outputs of the current build graph are stale
+    """
+    changed = [file_name for file_name, content in _read_build_plan().items() if previous_plan[file_name] != content]
+    if not changed:
+        return
+    build_manifest.mark_build_plan_changed()
+    usage(f"The build plan changed ({', '.join(changed)}), build again to configure cmake with it")
+
+
+def _load_module_cache(path: str, name: str) -> dict[str, typing.Any]:
+    if not os.path.isfile(path):
+        usage(f"Failed to load module info. No such file: '{path}'")
+    module = utils.load_signle_module(f"tfreezer.{os.path.basename(path).replace('.', '_')}", path)
+    assert hasattr(module, name)
+    return getattr(module, name)
+
+
+def _get_frozen_table_entry(module_name: str, is_package: bool, is_deepfreeze: bool) -> tuple[list[str], str]:
+    """
+    Returns:
+        (declarations of the frozen data defined in another file, entry of the frozen module table)
     """
-    Print all frozen header file names for cmake
+    is_package_literal = "true" if is_package else "false"
+    if is_deepfreeze:
+        getter = deepfreeze_module.get_getter_name(module_name)
+        return [f"PyObject *{getter}(void);"], f'    {{"{module_name}", NULL, 0, {is_package_literal}, {getter}}},'
+    varname = get_module_varname(module_name, "_Py_M__")
+    declarations = [f"extern const unsigned char {varname}[];", f"extern const int {varname}_size;"]
+    return declarations, f'    {{"{module_name}", {varname}, {varname}_size, {is_package_literal}}},'
+
+
+def _dump_frozen_module_info(
+    module_names: list[str],
+    module_info: dict[str, modulefinder.Module],
+    entry_module_name: str,
+    stdlib_library: typing.Optional[frozen_stdlib.FrozenStdlibLibrary] = None,
+) -> list[dict[str, str]]:
+    """
+    Dump frozen modules of every shard and the frozen module table to build directory
     Args:
-        entry_module: A python module name or a single python_file
-        hidden_imports_arg: hidden import modules, e.g. --hidden-imports=xx,yy,aa.bb
-        excludes_arg: excludes modules, e.g. --excludes=test,unittest
-        mypyc_modules_arg: excludes modules, e.g. --mypyc-modules-=mylib1,mylib1.performance_sensitive
+        stdlib_library: modules in it aren't frozen again, they are in the table only if the library is static
     Returns:
-        None
+        frozen modules of every shard, module name -> module file
+    """
+    is_deepfreeze = get_frozen_format() == "deepfreeze"
+    is_static_stdlib = config.load_frozen_stdlib_library() == "static"
+    shards: list[dict[str, str]] = [{} for _ in range(FROZEN_SHARD_COUNT)]
+    declarations = []
+    frozen_structs = []
+    stdlib_module_count = 0
+    for module_name in module_names:
+        module = module_info.get(module_name)
+        if module_name == "__tfreezer_main__":
+            module_file = get_module_info(entry_module_name, is_entry_module=True).origin
+        elif module is None or not os.path.isfile(module.__file__):
+            module_file = get_module_info(module_name).origin
+        else:
+            module_file = module.__file__
+        is_stdlib_module = stdlib_library is not None and stdlib_library.contains(module_name, module_file)
+        if is_stdlib_module:
+            stdlib_module_count += 1
+        else:
+            shards[get_shard_index(module_name)][module_name] = module_file
+        if is_stdlib_module and not is_static_stdlib:
+            continue
+        module_declarations, frozen_struct = _get_frozen_table_entry(module_name, file_is_package(module_file), is_deepfreeze)
+        declarations.extend(module_declarations)
+        frozen_structs.append(frozen_struct)
+    if stdlib_library is not None:
+        log.logger.info("%d modules of the standard library are linked from '%s'", stdlib_module_count, stdlib_library.directory)
+    if not os.path.isdir(paths.FROZEN_MODULE_DIR):
+        os.makedirs(paths.FROZEN_MODULE_DIR)
+    for index, shard in enumerate(shards):
+        # Kept unchanged if modules of the shard don't change, so that the shard isn't frozen again
+        contents = ["FROZEN_MODULES = {"]
+        contents.extend(f'    "{module_name}": r"{module_file}",' for module_name, module_file in shard.items())
+        contents.extend(["}", ""])
+        utils.write_text_if_changed(get_shard_modules_path(index), "\n".join(contents))
+    # Read by main.cpp, which includes the header
+    startup_definitions = "#define TF_MINIMAL_STARTUP\n" if config.load_startup_profile() == "minimal" else ""
+    frozen_modules_header_src = FROZEN_MODULES_HEADER_SRC.format(
+        startup_definitions=startup_definitions, declarations="\n".join(declarations), module_infos="\n".join(frozen_structs)
+    )
+    utils.write_text_if_changed(paths.FROZEN_MODULES_HEADER, frozen_modules_header_src)
+    _dump_frozen_sources()
+    return shards
+
+
+def _dump_frozen_sources() -> None:
+    """
+    The outputs are fixed, the table header is generated by the analysis and shards by the freeze commands or the streaming freezer
+    """
+    frozen_sources = [paths.FROZEN_MODULES_HEADER] + [get_shard_source_path(index) for index in range(FROZEN_SHARD_COUNT)]
+    cmake_info_file = os.path.join(paths.BUILD_DIR, "frozen_headers")
+    utils.write_text_if_changed(cmake_info_file, ";".join(the_path.replace("\\", "/") for the_path in frozen_sources))
+
+
+def _load_analysis_info(entry_module_name: str, hidden_imports_arg: str, excludes_arg: str, mypyc_modules_arg: str) -> ModuleAnalysisInfo:
+    """
+    Load analysis info from command line args, args may be files containing the values
     """
     if os.path.isfile(entry_module_name) and not entry_module_name.endswith(".py"):
         with open(entry_module_name, "r", encoding="utf-8") as fp:
@@ -476,74 +738,518 @@ def print_frozen_header_file_names(entry_module_name: str, hidden_imports_arg: s
     hidden_imports = get_list_arg(hidden_imports_arg, "--hidden-imports")
     excludes = get_list_arg(excludes_arg, "--excludes")
     mypyc_modules = get_list_arg(mypyc_modules_arg, "--mypyc-modules")
-    analysis_info = ModuleAnalysisInfo(entry_module_name, hidden_imports, excludes, mypyc_modules)
+    cython_modules = config.load_cython_modules()
+    prune_guarded_imports = config.load_prune_guarded_imports()
+    startup_profile = config.load_startup_profile()
+    return ModuleAnalysisInfo(
+        entry_module_name, hidden_imports, excludes, mypyc_modules, cython_modules, prune_guarded_imports, startup_profile
+    )
+
+
+def _dump_pruned_imports(pruned_imports: list[import_guards.PrunedImport]) -> None:
+    """
+    Report imports in branches that never run on this interpreter, they are not followed
+    """
+    for pruned_import in pruned_imports:
+        log.logger.debug("Pruned import: %s", pruned_import)
+    report_path = os.path.join(paths.BUILD_DIR, "pruned_imports")
+    module_names = {pruned_import.module_name for pruned_import in pruned_imports}
+    log.logger.info("Pruned imports of %d branches in %d modules, see %s", len(pruned_imports), len(module_names), report_path)
+    lines = [str(pruned_import) for pruned_import in pruned_imports]
+    lines.append("")
+    utils.write_text_if_changed(report_path, "\n".join(lines))
+
+
+def _dump_dev_overlay_module(entry_module_name: str) -> dict[str, modulefinder.Module]:
+    """
+    Generate the module listing the sources of the application for the dev variant,
+    the source roots are the application root and the entries of sys.path in it
+    Returns:
+        the module to freeze with the application
+    """
+    app_root = os.path.normcase(os.path.abspath(paths.APP_ROOT))
+    excluded_dirs = [os.path.normcase(os.path.abspath(the_dir)) for the_dir in (paths.BUILD_DIR, paths.DEPLOY_DIR)]
+    source_roots: list[str] = []
+    for entry in [paths.APP_ROOT] + sys.path:
+        source_root = os.path.abspath(entry or paths.APP_ROOT)
+        normalized_root = os.path.normcase(source_root)
+        if not os.path.isdir(source_root) or os.path.commonpath([normalized_root, app_root]) != app_root:
+            continue
+        if any(os.path.commonpath([normalized_root, the_dir]) == the_dir for the_dir in excluded_dirs):
+            continue
+        if source_root not in source_roots:
+            source_roots.append(source_root)
+    entry_file = get_module_info(entry_module_name, is_entry_module=True).origin
+    module_path = os.path.join(paths.GENERATED_HEADERS_DIR, "tf_dev_overlay.py")
+    if not os.path.isdir(paths.GENERATED_HEADERS_DIR):
+        os.makedirs(paths.GENERATED_HEADERS_DIR)
+    utils.write_text_if_changed(module_path, DEV_OVERLAY_MODULE_SRC.format(source_roots=source_roots, entry_file=entry_file))
+    log.logger.info("Modules in %s are loaded from their sources", ", ".join(source_roots))
+    return {"tf_dev_overlay": modulefinder.Module("tf_dev_overlay", module_path)}
+
+
+def _get_analysis_cache_key(analysis_info: ModuleAnalysisInfo) -> str:
+    """
+    Key of the analysis results in the build cache, files read by the analysis validate the entry
+    """
+    parts = [sys.version, build_cache.get_tool_digest(), build_manifest.digest_distributions(), repr(analysis_info), repr(sys.path)]
+    for file_name in ANALYSIS_CONFIG_FILES:
+        # Paths of the build are machine specific, rejected mypyc modules don't change which modules are found
+        if file_name in ("paths", "mypyc_rejected_modules"):
+            continue
+        file_path = os.path.join(paths.BUILD_DIR, file_name)
+        if os.path.isfile(file_path):
+            with open(file_path, "r", encoding="utf-8") as fp:
+                parts.append(f"{file_name}={fp.read()}")
+    return build_cache.compute_key("analysis", *(build_cache.normalize_text(part) for part in parts))
+
+
+def _load_cached_analysis(
+    key: str,
+) -> typing.Optional[tuple[list[str], dict[str, modulefinder.Module], list[str], list[str], list[import_guards.PrunedImport]]]:
+    """
+    Returns:
+        (frozen module names, all analyzed modules, mypyc module names, cython module names, pruned imports), None if missed
+    """
+    cache = build_cache.get_build_cache()
+    payload = None if cache is None else cache.get_validated("analysis", key)
+    if payload is None:
+        return None
     module_info = {}
-    mypyc_module_info = {}
-    module_names = get_frozen_module_names(analysis_info, info=module_info, mypyc_module_info=mypyc_module_info)
-    headers = [paths.FROZEN_MODULES_HEADER.replace("\\", "/")]
-    for module_name in module_names:
-        header = os.path.join(paths.FROZEN_MODULE_DIR, f"{module_name}.h")
-        header = header.replace("\\", "/")
-        headers.append(header)
-    mypyc_generator = mypyc_source_generator.MyPycSourceGenerator()
+    for module_name, (module_file, module_path) in payload["modules"].items():
+        module_file = None if module_file is None else build_cache.denormalize_path(module_file)
+        module_path = None if module_path is None else [build_cache.denormalize_path(the_path) for the_path in module_path]
+        module_info[module_name] = modulefinder.Module(module_name, module_file, module_path)
+    pruned_imports = [import_guards.PrunedImport(**pruned_import) for pruned_import in payload["pruned_imports"]]
+    log.logger.info("Analysis of %d modules is loaded from the build cache", len(module_info))
+    return payload["module_names"], module_info, payload["mypyc_module_names"], payload["cython_module_names"], pruned_imports
+
+
+def _store_analysis(
+    key: str,
+    module_names: list[str],
+    module_info: dict[str, modulefinder.Module],
+    mypyc_module_names: list[str],
+    cython_module_names: list[str],
+    pruned_imports: list[import_guards.PrunedImport],
+) -> None:
+    cache = build_cache.get_build_cache()
+    if cache is None:
+        return
+    modules = {}
+    for module_name, module in module_info.items():
+        module_file = None if module.__file__ is None else build_cache.normalize_path(module.__file__)
+        module_path = None if module.__path__ is None else [build_cache.normalize_path(the_path) for the_path in module.__path__]
+        modules[module_name] = [module_file, module_path]
+    payload = {
+        "module_names": module_names,
+        "modules": modules,
+        "mypyc_module_names": mypyc_module_names,
+        "cython_module_names": cython_module_names,
+        "pruned_imports": [dataclasses.asdict(pruned_import) for pruned_import in pruned_imports],
+    }
+    inputs = [module.__file__ for module in module_info.values() if module.__file__ and os.path.isfile(module.__file__)]
+    cache.put_validated("analysis", key, inputs, payload)
+
+
+def analyze(
+    analysis_info: ModuleAnalysisInfo, streaming_freezer: typing.Optional["StreamingFreezer"] = None
+) -> tuple[list[str], dict[str, modulefinder.Module], list[str]]:
+    """
+    Analyze modules, generate Cython modules and static extension info
+    Args:
+        streaming_freezer: freezes modules while they are being found
+    Returns:
+        (frozen module names without rejected mypyc modules, all analyzed modules, source files read by the analysis)
+    """
+    cache_key = _get_analysis_cache_key(analysis_info) if build_cache.get_build_cache() is not None else ""
+    cached_analysis = _load_cached_analysis(cache_key) if cache_key else None
+    if cached_analysis is not None:
+        # Nothing is streamed, the streaming freezer freezes the modules once the shards are known
+        module_names, module_info, mypyc_module_names, cython_module_names, pruned_imports = cached_analysis
+        mypyc_module_info = {module_name: module_info[module_name] for module_name in mypyc_module_names}
+        cython_module_info = {module_name: module_info[module_name] for module_name in cython_module_names}
+    else:
+        module_info = {}
+        mypyc_module_info = {}
+        cython_module_info = {}
+        pruned_imports = []
+        module_names = get_frozen_module_names(
+            analysis_info,
+            info=module_info,
+            mypyc_module_info=mypyc_module_info,
+            cython_module_info=cython_module_info,
+            module_found_callback=None if streaming_freezer is None else streaming_freezer.on_module_found,
+            pruned_imports=pruned_imports,
+        )
+        if cache_key:
+            _store_analysis(cache_key, module_names, module_info, list(mypyc_module_info), list(cython_module_info), pruned_imports)
+    _dump_pruned_imports(pruned_imports)
+    if "importlib.metadata" in module_info:
+        # Distribution metadata is embedded, .dist-info directories aren't needed at runtime
+        metadata_modules = metadata_index.dump_metadata_modules(module_info)
+        module_info.update(metadata_modules)
+        module_names = module_names + list(metadata_modules)
+    if config.load_dev_overlay():
+        dev_overlay_modules = _dump_dev_overlay_module(analysis_info.entry_module_name)
+        module_info.update(dev_overlay_modules)
+        module_names = module_names + list(dev_overlay_modules)
+    dependencies = [module.__file__ for module in module_info.values() if module.__file__ and os.path.isfile(module.__file__)]
+    cython_generator = cython_source_generator.CythonSourceGenerator()
+    for module_name, module in cython_module_info.items():
+        cython_generator.add_module(module_name, module.__file__)
+    for module_name in analysis_info.cython_module_names:
+        if module_name in cython_module_info or any(char in module_name for char in "*?["):
+            continue
+        # .pyx modules can't be found by modulefinder, their imports should be added to hidden_imports
+        module_path = cython_source_generator.find_pyx_module(module_name)
+        if not module_path:
+            log.logger.error("Can't find source of cython module '%s'", module_name)
+            sys.exit(1)
+        cython_generator.add_module(module_name, module_path)
+        dependencies.append(module_path)
+    cython_generator.generate()
+    cython_generator.dump_cython_info()
+    static_extensions, cpython_source_dir = config.load_static_extensions_config()
+    extension_generator = static_extension_generator.StaticExtensionGenerator()
+    extension_generator.add_extensions(static_extensions, cpython_source_dir)
+    extension_generator.dump_static_extension_info()
+    # Modules compiled by the mypyc command
+    mypyc_module_cache = ["MYPYC_MODULES = {"]
     for module_name, module in mypyc_module_info.items():
-        mypyc_generator.generate(module_name, module.__file__)
+        mypyc_module_cache.append(f'    "{module_name}": r"{module.__file__}",')
+    mypyc_module_cache.extend(["}", ""])
+    utils.write_text_if_changed(os.path.join(paths.BUILD_DIR, "mypyc_module_cache"), "\n".join(mypyc_module_cache))
+    return module_names, module_info, dependencies
+
+
+def add_rejected_mypyc_modules(module_names: list[str]) -> list[str]:
+    """
+    Modules that mypyc can't compile are frozen as normal modules
+    """
+    mypyc_modules = _load_module_cache(os.path.join(paths.BUILD_DIR, "mypyc_module_cache"), "MYPYC_MODULES")
+    rejected_mypyc_modules = [module_name for module_name in _load_rejected_mypyc_modules() if module_name in mypyc_modules]
+    return sorted(module_names + rejected_mypyc_modules)
+
+
+def _write_analysis_depfile(dependencies: list[str]) -> None:
+    dependencies = list(dependencies)
+    for file_name in ANALYSIS_CONFIG_FILES:
+        file_path = os.path.join(paths.BUILD_DIR, file_name)
+        if os.path.isfile(file_path):
+            dependencies.append(file_path)
+    dependencies.append(os.path.abspath(__file__))
+    utils.write_depfile(get_depfile_path("analysis"), get_stamp_path("analysis"), dependencies)
+    _write_stamp("analysis")
+
+
+def _load_rejected_mypyc_modules() -> list[str]:
+    rejected_file = os.path.join(paths.BUILD_DIR, "mypyc_rejected_modules")
+    if not os.path.isfile(rejected_file):
+        return []
+    return _load_module_cache(rejected_file, "REJECTED_MODULES")
+
+
+def generate_mypyc_sources() -> None:
+    """
+    Compile modules found by the analysis with mypyc, all groups are compiled together because they depend on each other
+    """
+    mypyc_modules = _load_module_cache(os.path.join(paths.BUILD_DIR, "mypyc_module_cache"), "MYPYC_MODULES")
+    mypyc_generator = mypyc_source_generator.MyPycSourceGenerator(config.load_mypyc_grouping())
+    for module_name, module_file in mypyc_modules.items():
+        mypyc_generator.add_module(module_name, module_file)
+    rejected_mypyc_modules = mypyc_generator.generate()
     mypyc_generator.dump_mypyc_info()
-    _dump_frozen_module_info(module_names, module_info, headers)
+    utils.write_text_if_changed(os.path.join(paths.BUILD_DIR, "mypyc_rejected_modules"), _format_rejected_modules(rejected_mypyc_modules))
+    dependencies = list(mypyc_modules.values())
+    dependencies.append(os.path.join(paths.BUILD_DIR, "mypyc_config"))
+    dependencies.append(os.path.abspath(mypyc_source_generator.__file__))
+    utils.write_depfile(get_depfile_path("mypyc"), get_stamp_path("mypyc"), dependencies)
+    _write_stamp("mypyc")
+
 
+def _format_rejected_modules(module_names: typing.Iterable[str]) -> str:
+    return "\n".join(["REJECTED_MODULES = ["] + [f'    "{module_name}",' for module_name in sorted(module_names)] + ["]", ""])
 
-def freeze(module_name: str, module_file: str, header_path: str) -> None:
+
+def print_frozen_header_file_names() -> None:
     """
-    Freeze module
-    Entry function in multiprocessing
+    Plan the build at configure time without analyzing modules, the outputs of frozen modules are fixed.
+    Plan files of mypyc, Cython, static extensions and the standard library are generated by the build commands,
+    cmake configures again once they change
+    Returns:
+        None
     """
-    log.logger.info("Generating header: '%s'", header_path)
-    text = freeze_module.read_text(module_file)
-    marshalled = freeze_module.compile_and_marshal(module_name, text)
-    freeze_module.write_frozen(header_path, module_file, module_name, marshalled)
+    _dump_frozen_sources()
+    # Contents of unused plan files, so that builds without mypyc, Cython, etc. don't change the plan
+    for file_name in build_manifest.BUILD_PLAN_FILES:
+        file_path = os.path.join(paths.BUILD_DIR, file_name)
+        if not os.path.isfile(file_path):
+            utils.write_text_if_changed(file_path, _format_rejected_modules(()) if file_name == "mypyc_rejected_modules" else "")
 
 
-def make_freeze(entry_module_name: str) -> None:
+def analyze_modules(entry_module_name: str, hidden_imports_arg: str, excludes_arg: str, mypyc_modules_arg: str) -> None:
     """
-    Generate all frozen headers for the entry_module_name
+    Analyze modules at build time, the build stops if outputs of the build commands change
     Args:
+        entry_module: A python module name or a single python_file
         hidden_imports_arg: hidden import modules, e.g. --hidden-imports=xx,yy,aa.bb
         excludes_arg: excludes modules, e.g. --excludes=test,unittest
+        mypyc_modules_arg: excludes modules, e.g. --mypyc-modules-=mylib1,mylib1.performance_sensitive
+    """
+    build_plan = _read_build_plan()
+    analysis_info = _load_analysis_info(entry_module_name, hidden_imports_arg, excludes_arg, mypyc_modules_arg)
+    stdlib_library = _prepare_frozen_stdlib()
+    with _create_streaming_freezer(analysis_info, stdlib_library) as streaming_freezer:
+        module_names, module_info, dependencies = analyze(analysis_info, streaming_freezer)
+        # Rejected modules of the previous mypyc build, the build plan changes if they change
+        module_names = add_rejected_mypyc_modules(module_names)
+        shards = _dump_frozen_module_info(module_names, module_info, analysis_info.entry_module_name, stdlib_library)
+        if streaming_freezer is not None:
+            streaming_freezer.write_shard_sources(shards)
+    if stdlib_library is not None:
+        dependencies.append(stdlib_library.modules_path)
+    _write_analysis_depfile(dependencies)
+    _check_build_plan(build_plan)
+
+
+def make_mypyc() -> None:
+    """
+    Generate mypyc sources at build time, the build stops if outputs of the build commands change
+    """
+    build_plan = _read_build_plan()
+    generate_mypyc_sources()
+    _check_build_plan(build_plan)
+
+
+def get_marshalled_source(module_name: str, module_file: str) -> str:
+    """
+    Get C source of a marshalled module, the size is a variable because the table is compiled in another file
+    """
+    log.logger.info("Freezing '%s': '%s'", module_name, module_file)
+    text = freeze_module.read_text(module_file)
+    marshalled = freeze_module.compile_and_marshal(module_name, text)
+    varname = get_module_varname(module_name, "_Py_M__")
+    outfile = io.StringIO()
+    freeze_module.write_code(outfile, marshalled, varname)
+    outfile.write(f"const int {varname}_size = (int)sizeof({varname});\n")
+    return outfile.getvalue()
+
+
+def get_deepfrozen_source(module_name: str, module_file: str) -> str:
+    log.logger.info("Deep-freezing '%s': '%s'", module_name, module_file)
+    text = freeze_module.read_text(module_file)
+    source, is_deepfrozen = deepfreeze_module.get_source(module_name, text)
+    if not is_deepfrozen:
+        log.logger.info("'%s' can't be deep-frozen, it's marshalled", module_name)
+    return source
+
+
+def _get_source_generator() -> tuple[typing.Callable[[str, str], str], str, str]:
+    """
+    Returns:
+        (function generating the C source of a module, prologue of shard sources, file of the function for depfiles)
+    """
+    if get_frozen_format() == "deepfreeze":
+        return get_deepfrozen_source, deepfreeze_module.SOURCE_PROLOGUE, deepfreeze_module.__file__
+    return get_marshalled_source, f"{freeze_module.header}\n", freeze_module.__file__
+
+
+def _submit_freeze(
+    executor: typing.Optional[concurrent.futures.Executor], generator: typing.Callable[[str, str], str], module_name: str, module_file: str
+) -> concurrent.futures.Future[str]:
+    """
+    Generate the C source of a module in a worker process, or in this process without an executor,
+    sources are looked up in the build cache first and stored into it once they are generated
+    Returns:
+        future of the C source
+    """
+    cache = build_cache.get_build_cache()
+    key = ""
+    if cache is not None:
+        # Frozen sources don't contain paths, code objects are named <frozen module_name>
+        key = build_cache.compute_key(
+            generator.__name__, sys.version, build_cache.get_tool_digest(), module_name, build_cache.hash_file(module_file)
+        )
+        data = cache.get("frozen", key)
+        if data is not None:
+            future: concurrent.futures.Future[str] = concurrent.futures.Future()
+            future.set_result(data.decode("utf-8"))
+            return future
+    if executor is not None:
+        future = executor.submit(generator, module_name, module_file)
+    else:
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(generator(module_name, module_file))
+        except Exception as e:  # pylint: disable=broad-except
+            future.set_exception(e)
+    if cache is not None:
+
+        def store(done: concurrent.futures.Future[str]) -> None:
+            if not done.cancelled() and done.exception() is None:
+                cache.put("frozen", key, done.result().encode("utf-8"))
+
+        future.add_done_callback(store)
+    return future
+
+
+def _write_shard_source(index: int, modules: dict[str, str], module_sources: list[str]) -> None:
+    """
+    Write the C source of a shard and its depfile
+    """
+    _, prologue, generator_file = _get_source_generator()
+    source_path = get_shard_source_path(index)
+    with open(source_path, "w", encoding="utf-8") as fp:
+        fp.write("\n".join([prologue] + module_sources))
+    dependencies = [get_shard_modules_path(index), os.path.join(paths.BUILD_DIR, "frozen_config"), os.path.abspath(generator_file)]
+    dependencies.extend(modules.values())
+    utils.write_depfile(get_depfile_path(f"frozen_shard_{index}"), source_path, dependencies)
+
+
+def _prepare_frozen_stdlib() -> typing.Optional[frozen_stdlib.FrozenStdlibLibrary]:
+    """
+    Get the frozen standard library, its sources are generated once per interpreter and shared by all applications
+    Returns:
+        None if the standard library is frozen with the application
+    """
+    library_type = config.load_frozen_stdlib_library()
+    if library_type == "none":
+        frozen_stdlib.dump_frozen_stdlib_info(None, library_type)
+        return None
+    generator, prologue, generator_file = _get_source_generator()
+    frozen_format = get_frozen_format()
+    library = frozen_stdlib.get_library(frozen_format, [generator_file, freeze_module.__file__, __file__])
+    if not library.modules:
+        stdlib_modules = frozen_stdlib.get_stdlib_modules(name for name in OFFICIAL_FROZEN_MODULE_NAMES if is_frozen_module(name))
+        log.logger.info("Freezing %d modules of the standard library to '%s'", len(stdlib_modules), library.directory)
+        module_sources: dict[str, tuple[str, str]] = {}
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            futures = {
+                module_name: _submit_freeze(executor, generator, module_name, module_file)
+                for module_name, module_file in stdlib_modules.items()
+            }
+            for module_name, future in futures.items():
+                if future.exception() is not None:
+                    # e.g. modules of other platforms with syntax errors, they are frozen with the application if they are needed
+                    log.logger.warning("Failed to freeze '%s' of the standard library: %s", module_name, future.exception())
+                    continue
+                module_sources[module_name] = (stdlib_modules[module_name], prologue + "\n" + future.result())
+        declarations = []
+        frozen_structs = []
+        for module_name, (module_file, _) in module_sources.items():
+            is_package = file_is_package(module_file)
+            module_declarations, frozen_struct = _get_frozen_table_entry(module_name, is_package, frozen_format == "deepfreeze")
+            declarations.extend(module_declarations)
+            frozen_structs.append(frozen_struct)
+        table_source = FROZEN_STDLIB_TABLE_SRC.format(declarations="\n".join(declarations), module_infos="\n".join(frozen_structs))
+        frozen_stdlib.write_library_sources(library, module_sources, table_source)
+    frozen_stdlib.dump_frozen_stdlib_info(library, library_type)
+    return library
+
+
+def make_freeze_shard(index: str) -> None:
+    """
+    Generate the C source of a shard of frozen modules
+    Args:
+        index: index of the shard
     Returns:
         None
     """
     if sys.version_info >= (3, 11):
         os.environ["PYDEVD_DISABLE_FILE_VALIDATION"] = "1"
-    clear_frozen_module_dir()
-    if os.path.isfile(entry_module_name):
-        with open(entry_module_name, "r", encoding="utf-8") as fp:
-            entry_module_name = fp.read().strip()
-    modules = _load_frozen_module_info()
-    headers = []
-    frozen_structs = []
-    with multiprocessing.Pool(processes=multiprocessing.cpu_count()) as pool:
-        for module_name, module_file in modules.items():
-            if module_name == "__tfreezer_main__":
-                module_info = get_module_info(entry_module_name, is_entry_module=True)
-                module_file = module_info.origin
-            elif not os.path.isfile(module_file):
-                module_info = get_module_info(module_name)
-                module_file = module_info.origin
-            header_name = f"{module_name}.h"
-            header_path = os.path.join(paths.FROZEN_MODULE_DIR, header_name)
-            pool.apply_async(freeze, args=(module_name, module_file, header_path))
-            headers.append(f'#include "{header_name}"')
-            varname = get_module_varname(module_name, "_Py_M__")
-            is_package_literal = "true" if file_is_package(module_file) else "false"
-            frozen_struct_literal = f'    {{"{module_name}", {varname}, (int)sizeof({varname}), {is_package_literal}}},'
-            frozen_structs.append(frozen_struct_literal)
-        pool.close()
-        pool.join()
-    headers_literal = "\n".join(headers)
-    frozen_structs_literal = "\n".join(frozen_structs)
-    frozen_modules_header_src = FROZEN_MODULES_HEADER_SRC.format(frozen_headers=headers_literal, module_infos=frozen_structs_literal)
-    with open(paths.FROZEN_MODULES_HEADER, "w", encoding="utf-8") as fp:
-        fp.write(frozen_modules_header_src)
+    modules = _load_module_cache(get_shard_modules_path(int(index)), "FROZEN_MODULES")
+    generator, _, _ = _get_source_generator()
+    module_sources = [_submit_freeze(None, generator, module_name, module_file).result() for module_name, module_file in modules.items()]
+    _write_shard_source(int(index), modules, module_sources)
+
+
+class StreamingFreezer:
+    """
+    Freeze modules in worker processes as soon as the analysis finds them, so that analysis and freezing overlap
+    Shards that are up to date are skipped, like the build commands of shards
+    """
+
+    def __init__(
+        self, analysis_info: ModuleAnalysisInfo, stdlib_library: typing.Optional[frozen_stdlib.FrozenStdlibLibrary] = None
+    ) -> None:
+        self._analysis_info = analysis_info
+        self._stdlib_library = stdlib_library
+        self._generator, _, _ = _get_source_generator()
+        self._executor = concurrent.futures.ProcessPoolExecutor()
+        # module name -> (module file, future of the C source), in discovery order
+        self._futures: dict[str, tuple[str, concurrent.futures.Future[str]]] = {}
+        self._streamed_count = 0
+        # Modules of the shards that are up to date, they are only frozen again if their shard changes
+        self._up_to_date_shards: list[dict[str, str]] = []
+        for index in range(FROZEN_SHARD_COUNT):
+            modules_path = get_shard_modules_path(index)
+            if utils.is_output_up_to_date(get_shard_source_path(index), get_depfile_path(f"frozen_shard_{index}"), [modules_path]):
+                self._up_to_date_shards.append(_load_module_cache(modules_path, "FROZEN_MODULES"))
+            else:
+                self._up_to_date_shards.append({})
+
+    def __enter__(self) -> "StreamingFreezer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._executor.shutdown(cancel_futures=True)
+
+    def _submit(self, module_name: str, module_file: str) -> None:
+        self._futures[module_name] = (module_file, _submit_freeze(self._executor, self._generator, module_name, module_file))
+
+    def on_module_found(self, module_name: str, module: modulefinder.Module) -> None:
+        """
+        Callback of analyze_module, modules that pass the same filters as get_frozen_module_names are frozen
+        """
+        if module_name == "__main__":
+            module_name = "__tfreezer_main__"
+        elif module_name in sys.builtin_module_names or is_frozen_module(module_name):
+            return
+        if not module.__file__ or not module.__file__.endswith(tuple(machinery.SOURCE_SUFFIXES)):
+            return
+        if is_mypyc_module(module_name, module, self._analysis_info.cython_module_names + self._analysis_info.mypyc_module_names):
+            return
+        if self._stdlib_library is not None and self._stdlib_library.contains(module_name, module.__file__):
+            return
+        if self._up_to_date_shards[get_shard_index(module_name)].get(module_name) == module.__file__:
+            return
+        self._submit(module_name, module.__file__)
+        self._streamed_count += 1
+
+    def write_shard_sources(self, shards: list[dict[str, str]]) -> None:
+        """
+        Write sources of the shards that aren't up to date, modules that weren't streamed are frozen now
+        Args:
+            shards: returned by _dump_frozen_module_info
+        """
+        stale_indexes = []
+        for index, modules in enumerate(shards):
+            source_path, modules_path = get_shard_source_path(index), get_shard_modules_path(index)
+            if utils.is_output_up_to_date(source_path, get_depfile_path(f"frozen_shard_{index}"), [modules_path]):
+                continue
+            stale_indexes.append(index)
+            for module_name, module_file in modules.items():
+                streamed_file, _ = self._futures.get(module_name, ("", None))
+                if streamed_file != module_file:
+                    self._submit(module_name, module_file)
+        for index in stale_indexes:
+            _write_shard_source(index, shards[index], [self._futures[module_name][1].result() for module_name in shards[index]])
+        log.logger.info(
+            "Wrote %d of %d shards, %d modules frozen during the analysis, %d after it",
+            len(stale_indexes),
+            len(shards),
+            self._streamed_count,
+            len(self._futures) - self._streamed_count,
+        )
+
+
+def _create_streaming_freezer(
+    analysis_info: ModuleAnalysisInfo, stdlib_library: typing.Optional[frozen_stdlib.FrozenStdlibLibrary]
+) -> typing.ContextManager[typing.Optional[StreamingFreezer]]:
+    if not config.load_streaming_freeze():
+        return contextlib.nullcontext()
+    return StreamingFreezer(analysis_info, stdlib_library)
 
 
 def main() -> None:
@@ -565,15 +1271,31 @@ def main() -> None:
             "--get-frozen-header-file-names",
             print_frozen_header_file_names,
             "Unable to get frozen header file names.",
-            "Print all frozen header file names for cmake.",
+            "Dump all frozen header file names and the other plan files for cmake.",
+        )
+    )
+    options.append(
+        (
+            "--analyze",
+            analyze_modules,
+            "Unable to analyze modules.",
+            "Analyze modules and dump frozen modules of every shard.",
         )
     )
     options.append(
         (
-            "--make-freeze",
-            make_freeze,
-            "Unable to locate the Python library for linking.",
-            "Generate all frozen headers.",
+            "--make-freeze-shard",
+            make_freeze_shard,
+            "Unable to freeze modules.",
+            "Generate the C source of a shard of frozen modules.",
+        )
+    )
+    options.append(
+        (
+            "--make-mypyc",
+            make_mypyc,
+            "Unable to compile modules with mypyc.",
+            "Generate C sources of mypyc groups.",
         )
     )
 
@@ -581,10 +1303,16 @@ def main() -> None:
     build_dir = sys.argv[2]
     paths.load_paths(build_dir)
     config.load_sys_path()
-    for argument, handler, _, _ in options:
-        if option != argument:
-            continue
-        handler(*sys.argv[3:])
+    try:
+        for argument, handler, _, _ in options:
+            if option != argument:
+                continue
+            handler(*sys.argv[3:])
+    finally:
+        # Also reached if the build plan changes
+        cache = build_cache.get_build_cache()
+        if cache is not None:
+            cache.report()
 
 
 def usage(msg: str) -> None:
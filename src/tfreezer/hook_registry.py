@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Index of assemble-time hooks
+"""
+
+import sys
+import os
+import types
+import typing as _t
+import hashlib
+import dataclasses
+import multiprocessing
+from importlib import metadata
+
+from tfreezer import log, utils, paths
+
+# Third-party hook packs register a callable returning a list of hook directories, e.g.:
+# [project.entry-points."tfreezer.hooks"]
+# my_hooks = "my_hooks:get_hook_dirs"
+HOOK_ENTRY_POINT_GROUP = "tfreezer.hooks"
+
+HOOK_FILE_PREFIX = "hook-"
+HOOK_FILE_SUFFIX = ".py"
+
+BUILTIN_HOOKS_DIR = os.path.join(os.path.dirname(__file__), "hooks")
+
+HOOK_CACHE_VERSION = 2
+
+
+@dataclasses.dataclass
+class HookInfo:
+    """
+    Data struct for a registered hook
+    """
+
+    module_name: str  # fullname of the module that the hook is applied to
+    path: str  # path of the hook file
+    origin: str  # "builtin", "user" or "entry_point:<entry point name>"
+
+
+@dataclasses.dataclass
+class HookResult:
+    """
+    Data struct for the outputs of a hook module
+    """
+
+    hiddenimports: list[str]
+    binaries: list[tuple[str, str, str]]  # PyInstaller TOC
+    datas: list[tuple[str, str, str]]  # PyInstaller TOC
+    has_hook_function: bool  # whether the hook module has a `hook` function, see HookRegistry.call_hook_function
+
+    @classmethod
+    def from_json(cls, data: dict[str, _t.Any]) -> "HookResult":
+        return cls(
+            data["hiddenimports"],
+            [tuple(toc) for toc in data["binaries"]],
+            [tuple(toc) for toc in data["datas"]],
+            data["has_hook_function"],
+        )
+
+
+class HookRegistry:
+    """
+    Index hook files once so that looking up a hook for a module name doesn't touch the file system
+    """
+
+    def __init__(self) -> None:
+        self._hooks: dict[str, HookInfo] = {}
+        self._loaded: dict[str, types.ModuleType] = {}
+        self._cache_file = os.path.join(paths.CACHE_DIR, "hooks", "hook_results.json")
+        self._cache: _t.Optional[dict[str, dict[str, _t.Any]]] = None  # "<module name>|<cache key>" -> outputs of the hook
+        self._new_cache_entries: dict[str, dict[str, _t.Any]] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __contains__(self, module_name: str) -> bool:
+        return module_name in self._hooks
+
+    def __len__(self) -> int:
+        return len(self._hooks)
+
+    @property
+    def hooks(self) -> _t.Mapping[str, HookInfo]:
+        """
+        All registered hooks, key is module fullname
+        """
+        return types.MappingProxyType(self._hooks)
+
+    def add_hook_dir(self, hook_dir: str, origin: str) -> int:
+        """
+        Index all hook files in a directory
+        Hooks registered later override the ones registered before
+        Args:
+            hook_dir: path of the directory
+            origin: where the directory comes from
+        Returns:
+            int: count of hooks found in the directory
+        """
+        hook_dir = os.path.abspath(hook_dir)
+        if not os.path.isdir(hook_dir):
+            log.logger.warning("Hook directory '%s' (%s) doesn't exist, skip it.", hook_dir, origin)
+            return 0
+        count = 0
+        with os.scandir(hook_dir) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                if not (entry.name.startswith(HOOK_FILE_PREFIX) and entry.name.endswith(HOOK_FILE_SUFFIX)):
+                    continue
+                module_name = entry.name[len(HOOK_FILE_PREFIX) : -len(HOOK_FILE_SUFFIX)]
+                previous = self._hooks.get(module_name)
+                if previous is not None:
+                    log.logger.debug("Hook for '%s' from %s overrides the one from %s", module_name, origin, previous.origin)
+                self._hooks[module_name] = HookInfo(module_name, entry.path, origin)
+                self._loaded.pop(module_name, None)
+                count += 1
+        return count
+
+    def get(self, module_name: str) -> _t.Optional[HookInfo]:
+        """
+        Get hook info of a module
+        Args:
+            module_name: fullname of the module
+        Returns:
+            HookInfo or None if there is no hook for the module
+        """
+        return self._hooks.get(module_name)
+
+    def load(self, module_name: str) -> _t.Optional[types.ModuleType]:
+        """
+        Load the hook module of a module, a hook module is loaded at most once
+        Args:
+            module_name: fullname of the module
+        Returns:
+            hook module or None if there is no hook for the module
+        """
+        if module_name in self._loaded:
+            return self._loaded[module_name]
+        hook_info = self._hooks.get(module_name)
+        if hook_info is None:
+            return None
+        hook = utils.load_signle_module(f"tfreezer.hooks.{module_name}", hook_info.path)
+        self._loaded[module_name] = hook
+        return hook
+
+    def evaluate(self, module_names: _t.Iterable[str]) -> dict[str, HookResult]:
+        """
+        Get the outputs of the hooks of the modules
+        Hooks are executed in worker processes so that the packages imported by them don't pollute the assemble process.
+        The `hook` function takes the live modules of the application, so it's called in the assemble process, see load.
+        Outputs are cached by the module name, the hook file content, the version of the distribution the module belongs to
+        and the interpreter, so that builds with other hook directories or virtual environments don't replace each other's entries.
+        Args:
+            module_names: fullnames of the modules, modules without hooks are ignored
+        Returns:
+            dict: key is module fullname, value is HookResult
+        """
+        cache = self._load_cache()
+        results: dict[str, HookResult] = {}
+        pending: dict[str, str] = {}  # module name -> cache key
+        for module_name in module_names:
+            hook_info = self._hooks.get(module_name)
+            if hook_info is None or module_name in results or module_name in pending:
+                continue
+            cache_key = get_hook_cache_key(hook_info)
+            cached = cache.get(f"{module_name}|{cache_key}")
+            if cached is not None:
+                log.logger.debug("Hook result of '%s' is cached", module_name)
+                results[module_name] = HookResult.from_json(cached)
+                self.cache_hits += 1
+                continue
+            pending[module_name] = cache_key
+        if not pending:
+            return results
+        self.cache_misses += len(pending)
+        log.logger.info("Evaluating %d hooks in worker processes: %s", len(pending), sorted(pending))
+        processes = min(len(pending), multiprocessing.cpu_count())
+        with multiprocessing.Pool(processes=processes, initializer=_init_hook_worker, initargs=(sys.path[:],)) as pool:
+            async_results = {
+                module_name: pool.apply_async(evaluate_hook, args=(module_name, self._hooks[module_name].path)) for module_name in pending
+            }
+            for module_name, async_result in async_results.items():
+                data = async_result.get()
+                results[module_name] = HookResult.from_json(data)
+                self._new_cache_entries[f"{module_name}|{pending[module_name]}"] = data
+        self._save_cache()
+        return results
+
+    def _load_cache(self) -> dict[str, dict[str, _t.Any]]:
+        if self._cache is None:
+            self._cache = utils.load_json_cache(self._cache_file, HOOK_CACHE_VERSION)
+        return self._cache
+
+    def _save_cache(self) -> None:
+        # Merged with the entries written by other builds in the meantime
+        self._cache = utils.load_json_cache(self._cache_file, HOOK_CACHE_VERSION)
+        self._cache.update(self._new_cache_entries)
+        utils.dump_json_cache(self._cache_file, HOOK_CACHE_VERSION, self._cache)
+
+
+def get_hook_cache_key(hook_info: HookInfo) -> str:
+    """
+    Get cache key of a hook result
+    Args:
+        hook_info: the hook
+    Returns:
+        str
+    """
+    with open(hook_info.path, "rb") as fp:
+        hook_hash = hashlib.sha256(fp.read()).hexdigest()
+    python_version = f"{sys.version_info.major}.{sys.version_info.minor}"
+    distribution_version = utils.get_distribution_version(hook_info.module_name)
+    return f"{hook_hash}|{distribution_version}|{sys.platform}|{python_version}|{sys.prefix}"
+
+
+def _init_hook_worker(sys_path: list[str]) -> None:
+    for path in sys_path:
+        if path not in sys.path:
+            sys.path.append(path)
+
+
+def evaluate_hook(module_name: str, hook_path: str) -> dict[str, _t.Any]:
+    """
+    Execute a hook module and collect its outputs
+    Entry function in multiprocessing
+    """
+    hook = utils.load_signle_module(f"tfreezer.hooks.{module_name}", hook_path)
+    return {
+        "hiddenimports": list(getattr(hook, "hiddenimports", [])),
+        "binaries": [list(toc) for toc in getattr(hook, "binaries", [])],
+        "datas": [list(toc) for toc in getattr(hook, "datas", [])],
+        "has_hook_function": callable(getattr(hook, "hook", None)),
+    }
+
+
+def iterate_entry_point_hook_dirs() -> _t.Generator[tuple[str, str], None, None]:
+    """
+    Iterate hook directories registered by installed distributions
+    Returns:
+        Generator of (hook directory, origin)
+    """
+    for entry_point in metadata.entry_points(group=HOOK_ENTRY_POINT_GROUP):
+        origin = f"entry_point:{entry_point.name}"
+        try:
+            get_hook_dirs = entry_point.load()
+            hook_dirs = get_hook_dirs()
+        except Exception:  # pylint: disable=broad-exception-caught
+            log.logger.exception("Failed to get hook directories from entry point '%s'", entry_point.value)
+            continue
+        for hook_dir in hook_dirs:
+            yield hook_dir, origin
+
+
+def create_hook_registry(user_hook_dirs: _t.Iterable[str] = ()) -> HookRegistry:
+    """
+    Create a hook registry with builtin hooks, entry point hooks and user hooks
+    Priority: user hooks > entry point hooks > builtin hooks
+    Args:
+        user_hook_dirs: hook directories specified in freeze config
+    Returns:
+        HookRegistry
+    """
+    registry = HookRegistry()
+    registry.add_hook_dir(BUILTIN_HOOKS_DIR, "builtin")
+    for hook_dir, origin in iterate_entry_point_hook_dirs():
+        registry.add_hook_dir(hook_dir, origin)
+    for hook_dir in user_hook_dirs:
+        registry.add_hook_dir(hook_dir, "user")
+    log.logger.info("Indexed %d hooks", len(registry))
+    return registry
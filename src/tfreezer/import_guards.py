@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Evaluate guards of imports for the interpreter that runs the application, e.g.
+    if sys.platform == "win32": ...
+    if sys.version_info < (3, 11): ...
+    if TYPE_CHECKING: ...
+    if __name__ == "__main__": ... (only if the module name is known, see prune_guarded_imports)
+Imports in branches that are never run are not followed by the analysis
+"""
+
+import typing as _t
+import types
+import sys
+import os
+import ast
+import operator
+import dataclasses
+
+_UNKNOWN = object()
+# Modules whose names are resolved in conditions, names bound to anything else are unknown
+_RESOLVED_MODULES = ("sys", "os", "typing", "typing_extensions")
+_TYPE_CHECKING_NAMES = ("typing.TYPE_CHECKING", "typing_extensions.TYPE_CHECKING")
+
+_COMPARE_OPERATORS: dict[type, _t.Callable[[_t.Any, _t.Any], bool]] = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda left, right: left in right,
+    ast.NotIn: lambda left, right: left not in right,
+}
+
+
+@dataclasses.dataclass
+class PrunedImport:
+    """
+    Data struct for imports in a branch that is never run
+    """
+
+    module_name: str  # module containing the guard
+    lineno: int  # line of the pruned branch
+    guard: str  # source of the condition
+    value: bool  # value of the condition on the target
+    imports: list[str]  # imports of the pruned branch, as written in the source
+
+    def __str__(self) -> str:
+        return f"{self.module_name}:{self.lineno}: {', '.join(self.imports)} (`{self.guard}` is {self.value})"
+
+
+class GuardEvaluator:
+    """
+    Evaluate conditions that only depend on the platform and the version of the interpreter
+    Conditions that depend on anything else are unknown
+    """
+
+    def __init__(self, module_aliases: dict[str, str], module_name: _t.Optional[str] = None) -> None:
+        """
+        Args:
+            module_aliases: name bound in the module -> qualified name, e.g. sys, os.path, typing.TYPE_CHECKING
+            module_name: value of __name__, None if unknown
+        """
+        self._module_aliases = module_aliases
+        self._module_name = module_name
+
+    def evaluate(self, node: ast.expr) -> _t.Optional[bool]:
+        """
+        Returns:
+            value of the condition, None if unknown
+        """
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            value = self.evaluate(node.operand)
+            return None if value is None else not value
+        if isinstance(node, ast.BoolOp):
+            values = [self.evaluate(operand) for operand in node.values]
+            # A known value that decides the result wins over unknown ones
+            deciding = isinstance(node.op, ast.Or)
+            if deciding in values:
+                return deciding
+            return None if None in values else not deciding
+        if isinstance(node, (ast.Name, ast.Attribute)) and self._get_name(node) in _TYPE_CHECKING_NAMES:
+            return False
+        if isinstance(node, ast.Compare):
+            left = self._get_value(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self._get_value(comparator)
+                if left is _UNKNOWN or right is _UNKNOWN or type(op) not in _COMPARE_OPERATORS:
+                    return None
+                try:
+                    if not _COMPARE_OPERATORS[type(op)](left, right):
+                        return False
+                except TypeError:
+                    return None
+                left = right
+            return True
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in ("startswith", "endswith"):
+            value = self._get_value(node.func.value)
+            arguments = [self._get_value(argument) for argument in node.args]
+            if not isinstance(value, str) or len(arguments) != 1 or node.keywords or _UNKNOWN in arguments:
+                return None
+            try:
+                return getattr(value, node.func.attr)(arguments[0])
+            except TypeError:
+                return None
+        value = self._get_value(node)
+        if isinstance(node, ast.Constant) and value is not _UNKNOWN:
+            return bool(value)
+        return None
+
+    def _get_name(self, node: ast.expr) -> str:
+        """
+        Qualified name of a name or an attribute, "" if the name isn't bound to a resolved module
+        """
+        if isinstance(node, ast.Name):
+            return self._module_aliases.get(node.id, "")
+        if isinstance(node, ast.Attribute):
+            value_name = self._get_name(node.value)
+            return f"{value_name}.{node.attr}" if value_name else ""
+        return ""
+
+    def _get_value(self, node: ast.expr) -> _t.Any:
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Tuple):
+            values = tuple(self._get_value(element) for element in node.elts)
+            return _UNKNOWN if _UNKNOWN in values else values
+        if isinstance(node, ast.Subscript):
+            value = self._get_value(node.value)
+            index = self._get_index(node.slice)
+            if value is _UNKNOWN or index is _UNKNOWN:
+                return _UNKNOWN
+            try:
+                return value[index]
+            except (TypeError, IndexError):
+                return _UNKNOWN
+        if isinstance(node, ast.Name) and node.id == "__name__" and self._module_name is not None:
+            return self._module_name
+        name = self._get_name(node)
+        if name == "sys.platform":
+            return sys.platform
+        if name == "os.name":
+            return os.name
+        if name == "sys.version_info":
+            return tuple(sys.version_info)
+        if name.startswith("sys.version_info.") and hasattr(sys.version_info, name.rpartition(".")[-1]):
+            return getattr(sys.version_info, name.rpartition(".")[-1])
+        return _UNKNOWN
+
+    def _get_index(self, node: ast.expr) -> _t.Any:
+        if isinstance(node, ast.Slice):
+            bounds = [None if bound is None else self._get_value(bound) for bound in (node.lower, node.upper, node.step)]
+            return _UNKNOWN if _UNKNOWN in bounds else slice(*bounds)
+        return self._get_value(node)
+
+
+class _GuardPruner(ast.NodeTransformer):
+    """
+    Replace if statements whose conditions are known by the branch that runs
+    """
+
+    def __init__(self, module_name: str, evaluator: GuardEvaluator) -> None:
+        self._module_name = module_name
+        self._evaluator = evaluator
+        self.pruned_imports: list[PrunedImport] = []
+
+    def visit_If(self, node: ast.If) -> _t.Union[ast.stmt, list[ast.stmt]]:
+        value = self._evaluator.evaluate(node.test)
+        if value is None:
+            return self.generic_visit(node)
+        kept, pruned = (node.body, node.orelse) if value else (node.orelse, node.body)
+        imports = _get_imports(pruned)
+        if imports:
+            self.pruned_imports.append(PrunedImport(self._module_name, pruned[0].lineno, ast.unparse(node.test), value, imports))
+        statements: list[ast.stmt] = []
+        for statement in kept:
+            result = self.visit(statement)
+            if isinstance(result, list):
+                statements.extend(result)
+            elif result is not None:
+                statements.append(result)
+        # The branch may be the only statement of a block
+        return statements or ast.copy_location(ast.Pass(), node)
+
+
+def _get_imports(statements: list[ast.stmt]) -> list[str]:
+    imports = []
+    for statement in statements:
+        for node in ast.walk(statement):
+            if isinstance(node, ast.Import):
+                imports.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                imports.append(f"{'.' * node.level}{node.module}")
+            elif isinstance(node, ast.ImportFrom):
+                # from . import name
+                imports.extend(f"{'.' * node.level}{alias.name}" for alias in node.names)
+    return imports
+
+
+def _get_module_aliases(tree: ast.Module) -> dict[str, str]:
+    """
+    Resolve names bound by imports of _RESOLVED_MODULES, e.g. `import sys`, `import os as _os`, `from typing import TYPE_CHECKING`
+    A name that is bound by anything else anywhere in the module, e.g. `import platform as sys` or `TYPE_CHECKING = True`, is unknown
+    Star imports are ignored
+    Returns:
+        name -> qualified name
+    """
+    bindings: dict[str, set[str]] = {}
+
+    def bind(name: str, qualified_name: str = "") -> None:
+        bindings.setdefault(name, set()).add(qualified_name)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    name, qualified_name = alias.asname, alias.name
+                else:
+                    name = qualified_name = alias.name.partition(".")[0]
+                bind(name, qualified_name if alias.name.partition(".")[0] in _RESOLVED_MODULES else "")
+        elif isinstance(node, ast.ImportFrom):
+            resolved = node.level == 0 and node.module in _RESOLVED_MODULES
+            for alias in node.names:
+                if alias.name != "*":
+                    bind(alias.asname or alias.name, f"{node.module}.{alias.name}" if resolved else "")
+        elif isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            bind(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bind(node.name)
+        elif isinstance(node, ast.arg):
+            bind(node.arg)
+        elif isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)) and node.name:
+            bind(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            bind(node.rest)
+    return {
+        name: next(iter(qualified_names))
+        for name, qualified_names in bindings.items()
+        if len(qualified_names) == 1 and "" not in qualified_names
+    }
+
+
+def prune_guarded_imports(
+    module_name: str, source: bytes, filename: str, evaluate_name: bool = False
+) -> tuple[_t.Optional[types.CodeType], list[PrunedImport]]:
+    """
+    Compile a module without the branches that never run on the target
+    Args:
+        module_name: fullname of the module, __main__ for the entry module
+        source: source of the module
+        filename: file name of the code object
+        evaluate_name: whether __name__ is module_name, it isn't if the module is run by runpy.run_module(run_name=...)
+    Returns:
+        (code object, None if nothing is pruned or the source can't be parsed, pruned imports)
+    """
+    try:
+        tree = ast.parse(source, filename)
+    except (SyntaxError, ValueError):
+        return None, []
+    pruner = _GuardPruner(module_name, GuardEvaluator(_get_module_aliases(tree), module_name if evaluate_name else None))
+    tree = pruner.visit(tree)
+    if not pruner.pruned_imports:
+        return None, []
+    ast.fix_missing_locations(tree)
+    return compile(tree, filename, "exec", dont_inherit=True), pruner.pruned_imports
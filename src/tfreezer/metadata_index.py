@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Metadata of the distributions of frozen packages, embedded into the application as a frozen module,
+importlib.metadata is served from it at runtime, see bootstrap/tf_metadata.py
+"""
+
+import typing as _t
+import os
+import modulefinder
+from importlib import metadata
+
+from tfreezer import log, paths, utils
+
+INDEX_MODULE_NAME = "tf_metadata_index"
+# Fields of METADATA used by importlib.metadata, e.g. version() and requires(), descriptions and classifiers are dropped
+METADATA_FIELDS = ("Metadata-Version", "Name", "Version", "Summary", "Requires-Python", "Requires-Dist", "Provides-Extra")
+
+INDEX_MODULE_SRC = """\
+# Generated by: tfreezer.metadata_index
+# normalized distribution name -> file name in .dist-info -> text
+DISTRIBUTIONS = {{
+{distributions}
+}}
+"""
+
+
+def get_frozen_distributions(module_names: _t.Iterable[str]) -> dict[str, tuple[metadata.Distribution, list[str]]]:
+    """
+    Get distributions that provide the given modules
+    Returns:
+        normalized distribution name -> (distribution, top-level names of frozen modules it provides)
+    """
+    top_level_names = {module_name.partition(".")[0] for module_name in module_names}
+    distributions: dict[str, tuple[metadata.Distribution, list[str]]] = {}
+    for top_level_name, distribution_names in sorted(metadata.packages_distributions().items()):
+        if top_level_name not in top_level_names:
+            continue
+        for distribution_name in distribution_names:
+            normalized_name = metadata.Prepared.normalize(distribution_name)
+            if normalized_name not in distributions:
+                try:
+                    distributions[normalized_name] = (metadata.distribution(distribution_name), [])
+                except metadata.PackageNotFoundError:
+                    continue
+            distributions[normalized_name][1].append(top_level_name)
+    return distributions
+
+
+def get_compact_metadata(distribution: metadata.Distribution) -> str:
+    """
+    METADATA with only METADATA_FIELDS
+    """
+    lines = []
+    for field in METADATA_FIELDS:
+        lines.extend(f"{field}: {value}" for value in distribution.metadata.get_all(field, []))
+    lines.append("")
+    return "\n".join(lines)
+
+
+def dump_metadata_modules(module_names: _t.Iterable[str]) -> dict[str, modulefinder.Module]:
+    """
+    Generate the index of the distributions of frozen modules
+    Returns:
+        modules to freeze with the application, the index and the bootstrap module serving it
+    """
+    distributions = get_frozen_distributions(module_names)
+    contents = []
+    for normalized_name, (distribution, top_level_names) in sorted(distributions.items()):
+        files = {"METADATA": get_compact_metadata(distribution), "top_level.txt": "".join(f"{name}\n" for name in sorted(top_level_names))}
+        entry_points = distribution.read_text("entry_points.txt")
+        if entry_points:
+            files["entry_points.txt"] = entry_points
+        contents.append(f"    {normalized_name!r}: {{")
+        contents.extend(f"        {file_name!r}: {text!r}," for file_name, text in files.items())
+        contents.append("    },")
+    index_path = os.path.join(paths.GENERATED_HEADERS_DIR, f"{INDEX_MODULE_NAME}.py")
+    if not os.path.isdir(paths.GENERATED_HEADERS_DIR):
+        os.makedirs(paths.GENERATED_HEADERS_DIR)
+    # Kept unchanged if the distributions don't change, so that its shard isn't frozen again
+    utils.write_text_if_changed(index_path, INDEX_MODULE_SRC.format(distributions="\n".join(contents)))
+    log.logger.info("Embedded metadata of %d distributions: %s", len(distributions), ", ".join(sorted(distributions)))
+    bootstrap_path = os.path.join(os.path.dirname(__file__), "bootstrap", "tf_metadata.py")
+    return {
+        INDEX_MODULE_NAME: modulefinder.Module(INDEX_MODULE_NAME, index_path),
+        "tf_metadata": modulefinder.Module("tf_metadata", bootstrap_path),
+    }
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Profile-guided selection of mypyc modules
+
+Usage:
+    python -m tfreezer.mypyc_advisor freeze_config.py [--app-args "..."] [--profile app.prof] [--write]
+
+The application is run unfrozen under cProfile (or existing profiles are loaded), modules are ranked by self time,
+and the top modules are compiled with mypyc to check whether they can be accelerated.
+The proposed list is printed as a `mypyc_modules = [...]` snippet, or written into the config file with --write.
+"""
+
+import sys
+import os
+import ast
+import shlex
+import pstats
+import argparse
+import tempfile
+import sysconfig
+import dataclasses
+import types
+import typing as _t
+
+from tfreezer import log, utils
+
+# Conservative speedup of typed python code compiled by mypyc, mypyc reports 1.5x to 5x
+DEFAULT_SPEEDUP_FACTOR = 2.0
+# Rough ratio between the size of machine code and the size of C code generated by mypyc
+BINARY_SIZE_RATIO = 0.4
+
+
+@dataclasses.dataclass
+class ModuleProfile:
+    """
+    Data struct for the profile result of a module
+    """
+
+    name: str
+    path: str
+    self_time: float  # seconds spent in the functions of the module, callees excluded
+    errors: list[str] = dataclasses.field(default_factory=list)  # mypyc errors, empty if the module can be compiled
+    c_size: int = 0  # bytes of generated C code
+
+
+class _ArgumentNamespace(argparse.Namespace):
+    config_file: str
+    app_args: str
+    profile: _t.Optional[list[str]]
+    top: int
+    min_ratio: float
+    speedup_factor: float
+    write: bool
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m tfreezer.mypyc_advisor")
+    parser.add_argument("config_file", type=str, help="freeze config file")
+    parser.add_argument("--app-args", type=str, default="", help="arguments passed to the application, e.g. a workload")
+    parser.add_argument("--profile", type=str, action="append", help="use existing cProfile outputs instead of running the application")
+    parser.add_argument("--top", type=int, default=10, help="max count of modules to check")
+    parser.add_argument("--min-ratio", type=float, default=0.01, help="ignore modules whose self time ratio is less than this")
+    parser.add_argument("--speedup-factor", type=float, default=DEFAULT_SPEEDUP_FACTOR, help="assumed speedup of compiled modules")
+    parser.add_argument("--write", action="store_true", help="write the proposed mypyc_modules into the config file")
+    return parser
+
+
+def load_user_config(config_file: str) -> tuple[types.ModuleType, list[str]]:
+    """
+    Load the freeze config file, it may add paths to sys.path
+    Returns:
+        config module, paths added to sys.path
+    """
+    original_sys_path = sys.path[:]
+    module = utils.load_signle_module("tfreezer.user_config", config_file)
+    extra_paths = [os.path.abspath(path) for path in sys.path if path not in original_sys_path]
+    return module, extra_paths
+
+
+def run_profile(entry_module: str, app_args: list[str], extra_paths: list[str], cwd: str, output: str) -> None:
+    """
+    Run the unfrozen application under cProfile
+    """
+    args = [sys.executable, "-m", "cProfile", "-o", output]
+    if os.path.isfile(entry_module):
+        args.append(entry_module)
+    else:
+        args.extend(["-m", entry_module])
+    args.extend(app_args)
+    env = os.environ.copy()
+    env["PYTHONPATH"] = os.pathsep.join(extra_paths + [env["PYTHONPATH"]] if env.get("PYTHONPATH") else extra_paths)
+    returncode = utils.call_subprocess(args, cwd=cwd, env=env)
+    if returncode:
+        log.logger.warning("The application exited with code %d, the profile may be incomplete", returncode)
+    if not os.path.isfile(output):
+        raise RuntimeError("Failed to profile the application")
+
+
+def get_module_name(file_path: str, search_paths: list[str]) -> _t.Optional[str]:
+    """
+    Get module fullname of a python source file
+    Returns:
+        None if the file is not in the search paths or is not a python source file
+    """
+    if not file_path.endswith(".py"):
+        return None
+    file_path = os.path.normcase(os.path.abspath(file_path))
+    candidates = []
+    for search_path in search_paths:
+        search_path = os.path.normcase(os.path.abspath(search_path))
+        if file_path.startswith(search_path + os.sep):
+            candidates.append(search_path)
+    if not candidates:
+        return None
+    relpath = os.path.relpath(file_path, max(candidates, key=len))
+    module_name = os.path.splitext(relpath)[0].replace(os.sep, ".")
+    if module_name.endswith(".__init__"):
+        module_name = module_name[: -len(".__init__")]
+    return module_name
+
+
+def get_excluded_dirs() -> list[str]:
+    """
+    Directories of stdlib and installed distributions, modules in them are not suggested
+    """
+    install_paths = sysconfig.get_paths()
+    excluded_dirs = {install_paths[key] for key in ("stdlib", "platstdlib", "purelib", "platlib") if key in install_paths}
+    return [os.path.normcase(os.path.abspath(path)) + os.sep for path in excluded_dirs]
+
+
+def rank_modules(stats: pstats.Stats, search_paths: list[str], excludes: _t.Container[str]) -> tuple[list[ModuleProfile], float]:
+    """
+    Rank application modules by self time
+    Args:
+        stats: loaded profiles
+        search_paths: paths where application modules are found
+        excludes: module names that should not be suggested
+    Returns:
+        (modules sorted by self time, total time of the profile)
+    """
+    excluded_dirs = get_excluded_dirs()
+    modules: dict[str, ModuleProfile] = {}
+    total_time = 0.0
+    for (file_path, _, _), (_, _, self_time, _, _) in stats.stats.items():  # type: ignore[attr-defined]
+        total_time += self_time
+        if os.path.normcase(os.path.abspath(file_path)).startswith(tuple(excluded_dirs)):
+            continue
+        module_name = get_module_name(file_path, search_paths)
+        if module_name is None or module_name in excludes:
+            continue
+        module_profile = modules.get(module_name)
+        if module_profile is None:
+            module_profile = modules[module_name] = ModuleProfile(module_name, os.path.abspath(file_path), 0.0)
+        module_profile.self_time += self_time
+    return sorted(modules.values(), key=lambda item: item.self_time, reverse=True), total_time
+
+
+def filter_module_errors(messages: list[str], module_path: str) -> list[str]:
+    """
+    Keep the errors reported in a module, mypy also reports errors of the modules it follows imports to
+    Args:
+        messages: messages like <path>:<line>: error: <message>, errors without a path are kept
+        module_path: path of the module
+    Returns:
+        error messages of the module
+    """
+    module_path = os.path.normcase(os.path.abspath(module_path))
+    module_errors = []
+    for message in messages:
+        location, sep, _ = message.partition(": error:")
+        if not sep:
+            if message.startswith("error:"):
+                module_errors.append(message)
+            continue
+        # strip line (and column) numbers, the path itself may contain a drive letter
+        file_path = location
+        while True:
+            head, sep, tail = file_path.rpartition(":")
+            if not sep or not tail.isdigit():
+                break
+            file_path = head
+        if os.path.normcase(os.path.abspath(file_path)) == module_path:
+            module_errors.append(message)
+    return module_errors
+
+
+def check_module(module_path: str) -> tuple[list[str], int]:
+    """
+    Compile a module to C with mypyc, errors of the modules it imports are ignored
+    Returns:
+        (error messages, bytes of generated C code)
+    """
+    # pylint: disable=import-outside-toplevel
+    from mypy.build import build
+    from mypy.errors import CompileError
+    from mypy.fscache import FileSystemCache
+    from mypyc.errors import Errors
+    from mypyc.codegen import emitmodule
+    from mypyc.options import CompilerOptions
+    from mypyc.build import get_mypy_config, construct_groups
+
+    from tfreezer.mypyc_handler.codegen.emitmodule import compile_modules_to_c
+
+    fscache = FileSystemCache()
+    compiler_options = CompilerOptions(multi_file=True)
+    mypyc_sources, all_sources, options = get_mypy_config([module_path], None, compiler_options, fscache)
+    groups = construct_groups(mypyc_sources, False, True)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        options.cache_dir = cache_dir
+        try:
+            # The same as emitmodule.parse_and_typecheck, which raises on errors of any module
+            plugin = emitmodule.MypycPlugin(options, compiler_options, groups)
+            result = build(sources=all_sources, options=options, fscache=fscache, extra_plugins=[plugin])
+            module_errors = filter_module_errors(result.errors, module_path)
+            if module_errors:
+                return module_errors, 0
+            errors = Errors(options)
+            _, group_cfiles = compile_modules_to_c(result, compiler_options=compiler_options, errors=errors, groups=groups)
+        except CompileError as e:
+            return filter_module_errors(e.messages, module_path) or e.messages, 0
+        if errors.num_errors:
+            return errors.new_messages(), 0
+    return [], sum(len(text.encode("utf-8")) for cfiles in group_cfiles for name, text in cfiles if name.endswith(".c"))
+
+
+def format_mypyc_modules(mypyc_modules: list[str]) -> str:
+    lines = ["mypyc_modules = ["]
+    for module_name in mypyc_modules:
+        lines.append(f'    "{module_name}",')
+    lines.append("]")
+    return "\n".join(lines)
+
+
+def write_mypyc_modules(config_file: str, mypyc_modules: list[str]) -> None:
+    """
+    Replace the top level `mypyc_modules` assignment of the config file, or append one
+    """
+    with open(config_file, "r", encoding="utf-8") as fp:
+        content = fp.read()
+    lines = content.splitlines()
+    new_lines = format_mypyc_modules(mypyc_modules).splitlines()
+    for node in ast.parse(content).body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "mypyc_modules" for target in node.targets):
+            lines[node.lineno - 1 : node.end_lineno] = new_lines
+            break
+    else:
+        lines.extend([""] + new_lines)
+    with open(config_file, "w", encoding="utf-8") as fp:
+        fp.write("\n".join(lines) + "\n")
+
+
+def main() -> None:
+    """
+    Entry point
+    Returns:
+        None
+    """
+    args = get_argument_parser().parse_args(namespace=_ArgumentNamespace())
+    config_file = os.path.abspath(args.config_file)
+    config_dir = os.path.dirname(config_file)
+    user_config, extra_paths = load_user_config(config_file)
+    entry_module: str = user_config.entry_module
+    current_modules: list[str] = list(getattr(user_config, "mypyc_modules", []))
+
+    if args.profile:
+        stats = pstats.Stats(*args.profile)
+    else:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output = os.path.join(temp_dir, "app.prof")
+            run_profile(entry_module, shlex.split(args.app_args), extra_paths, config_dir, output)
+            stats = pstats.Stats(output)
+
+    search_paths = extra_paths + [config_dir]
+    if os.path.isfile(entry_module):
+        search_paths.append(os.path.dirname(os.path.abspath(entry_module)))
+    excludes = {"__main__", os.path.splitext(os.path.basename(entry_module))[0]}
+    ranked, total_time = rank_modules(stats, search_paths, excludes)
+    if total_time <= 0:
+        log.logger.error("The profile is empty")
+        sys.exit(1)
+
+    log.logger.info("Total time: %.3fs, application modules: %d", total_time, len(ranked))
+    candidates = [item for item in ranked if item.self_time / total_time >= args.min_ratio][: args.top]
+    for item in candidates:
+        if item.name in current_modules:
+            continue
+        log.logger.info("Checking '%s' with mypyc", item.name)
+        item.errors, item.c_size = check_module(item.path)
+
+    proposed = list(current_modules)
+    saved_time = 0.0
+    extra_size = 0
+    print(f"{'module':<40} {'self time':>10} {'ratio':>7}  status")
+    for item in candidates:
+        ratio = item.self_time / total_time
+        if item.name in current_modules:
+            status = "already compiled"
+        elif item.errors:
+            status = f"rejected, {len(item.errors)} mypyc errors, e.g. {item.errors[0]}"
+        else:
+            status = "proposed"
+            proposed.append(item.name)
+            saved_time += item.self_time * (1 - 1 / args.speedup_factor)
+            extra_size += item.c_size
+        print(f"{item.name:<40} {item.self_time:>9.3f}s {ratio:>6.1%}  {status}")
+    print()
+    print(
+        f"Estimated speedup: {total_time / (total_time - saved_time):.2f}x ({total_time:.3f}s -> {total_time - saved_time:.3f}s), "
+        f"assuming compiled modules run {args.speedup_factor}x faster"
+    )
+    print(f"Estimated extra binary size: {extra_size * BINARY_SIZE_RATIO / 1024:.0f} KB ({extra_size / 1024:.0f} KB of generated C)")
+    print()
+    print(format_mypyc_modules(proposed))
+    if args.write:
+        write_mypyc_modules(config_file, proposed)
+        log.logger.info("mypyc_modules written to '%s'", config_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,6 @@
 # author: Tac
 # contact: cookiezhx@163.com
 
-import sys
 import os
 import time
 
@@ -17,8 +16,11 @@ from mypyc.options import CompilerOptions
 from mypyc.ir.pprint import format_modules
 from mypyc.build import get_mypy_config, construct_groups, emit_messages, write_file, get_header_deps
 
+from tfreezer import utils, build_cache
 from tfreezer.mypyc_handler.codegen.emitmodule import compile_modules_to_c
 
+GROUP_MANIFEST_VERSION = 1
+
 
 def generate_c(
     sources: list[BuildSource],
@@ -26,7 +28,7 @@ def generate_c(
     groups: emitmodule.Groups,
     fscache: FileSystemCache,
     compiler_options: CompilerOptions,
-) -> tuple[list[list[tuple[str, str]]], str]:
+) -> tuple[list[list[tuple[str, str]]], str, list[str]]:
     """
     Our own implementation of `generate_c`.
     Drive the actual core compilation step.
@@ -35,7 +37,9 @@ def generate_c(
     extension modules. See the comments on the Groups type in
     mypyc.emitmodule for details.
 
-    Returns the C source code and (for debugging) the pretty printed IR.
+    Returns the C source code, (for debugging) the pretty printed IR and the source files of all analyzed modules.
+    Absolute paths of the sources are replaced by paths relative to sys.path, so that the C source is the same on every machine.
+    Raises CompileError if any module fails to type check or compile, messages are printed before raising.
     """
     t0 = time.time()
 
@@ -43,52 +47,90 @@ def generate_c(
         result = emitmodule.parse_and_typecheck(sources, options, compiler_options, groups, fscache)
     except CompileError as e:
         emit_messages(options, e.messages, time.time() - t0, serious=not e.use_stdout)
-        sys.exit(1)
+        raise
 
     t1 = time.time()
     if result.errors:
         emit_messages(options, result.errors, t1 - t0)
-        sys.exit(1)
+        raise CompileError(result.errors)
 
     if compiler_options.verbose:
         print(f"Parsed and typechecked in {t1 - t0:.3f}s")
 
     errors = Errors(options)
-    modules, ctext = compile_modules_to_c(result, compiler_options=compiler_options, errors=errors, groups=groups)
+    try:
+        modules, ctext = compile_modules_to_c(result, compiler_options=compiler_options, errors=errors, groups=groups)
+    except CompileError as e:
+        emit_messages(options, e.messages, time.time() - t1)
+        raise
     t2 = time.time()
-    emit_messages(options, errors.new_messages(), t2 - t1)
+    messages = errors.new_messages()
+    emit_messages(options, messages, t2 - t1)
     if errors.num_errors:
         # No need to stop the build if only warnings were emitted.
-        sys.exit(1)
+        raise CompileError(messages)
 
     if compiler_options.verbose:
         print(f"Compiled to C in {t2 - t1:.3f}s")
 
-    return ctext, "\n".join(format_modules(modules))
+    # Tracebacks only refer to the compiled modules
+    compiled_paths = [source.path for group_sources, _ in groups for source in group_sources if source.path]
+    ctext = [[(cfile, build_cache.replace_source_paths(text, compiled_paths)) for cfile, text in cfiles] for cfiles in ctext]
+    source_paths = [state.xpath for state in result.graph.values() if state.xpath and os.path.isfile(state.xpath)]
+    return ctext, "\n".join(format_modules(modules)), source_paths
 
 
 def mypyc_build(
     paths: list[str],
     compiler_options: CompilerOptions,
-) -> tuple[emitmodule.Groups, list[tuple[list[str], list[str]]]]:
+    *,
+    separate: bool | list[tuple[list[str], str | None]] = True,
+    cache_dir: str | None = None,
+) -> tuple[emitmodule.Groups, list[tuple[list[str], list[str]]], list[str]]:
     """
     Our own implementation of `mypyc_build`.
     Do the front and middle end of mypyc building, producing and writing out C source.
+
+    The separate argument has the same meaning as the one of `mypyc.build.mypycify`:
+    True to compile each module into its own group, False to compile all modules into one group,
+    or a list of (file paths, group name) to specify groups manually.
+
+    If cache_dir is set, mypy runs in incremental mode and keeps its cache (including the mypyc IR) there,
+    so that only the modules changed since the last build are type checked and compiled to IR again.
+    C files are only rewritten when their contents change, which keeps the mtimes of unchanged files stable.
+    Returns the groups, (C files, header files) of every group and the source files of all analyzed modules.
     """
     fscache = FileSystemCache()
     mypyc_sources, all_sources, options = get_mypy_config(paths, None, compiler_options, fscache)
-
-    groups = construct_groups(mypyc_sources, True, True)  # set both `separate` and `use_shared_lib` to `True`
-    group_cfiles, ops_text = generate_c(all_sources, options, groups, fscache, compiler_options=compiler_options)
+    # Only report errors of the compiled modules, the other modules are imported as normal python modules.
+    # Absolute paths make errors easy to map back to modules.
+    options.ignore_errors = True
+    for source in mypyc_sources:
+        options.per_module_options.setdefault(source.module, {})["ignore_errors"] = False
+    options.show_absolute_path = True
+    if cache_dir:
+        options.incremental = True
+        options.cache_dir = cache_dir
+
+    groups = construct_groups(mypyc_sources, separate, True)  # always set `use_shared_lib` to `True` so that every group is named
+    group_cfiles, ops_text, source_paths = generate_c(all_sources, options, groups, fscache, compiler_options=compiler_options)
     for _, lib_name in groups:
-        if not lib_name:
+        if not lib_name or not ops_text:
             continue
         write_file(os.path.join(compiler_options.target_dir, f"{exported_name(lib_name)}_ops.txt"), ops_text)
 
     # Write out the generated C and collect the files for each group
     # Should this be here??
+    # Modules of a group depend on each other, so a group is either regenerated or loaded from the cache as a whole.
+    # Nothing is generated for a cached group, its files are recorded in the manifest by the previous build.
+    manifest_path = os.path.join(compiler_options.target_dir, "mypyc_groups.json")
+    manifest = utils.load_json_cache(manifest_path, GROUP_MANIFEST_VERSION)
     group_cfilenames: list[tuple[list[str], list[str]]] = []
-    for cfiles in group_cfiles:
+    for (_, lib_name), cfiles in zip(groups, group_cfiles):
+        if not cfiles and lib_name in manifest:
+            cfilenames, deps = manifest[lib_name]
+            group_cfilenames.append((cfilenames, deps))
+            continue
         cfilenames = []
         for cfile, ctext in cfiles:
             cfile = os.path.join(compiler_options.target_dir, cfile)
@@ -98,5 +140,7 @@ def mypyc_build(
 
         deps = [os.path.join(compiler_options.target_dir, dep) for dep in get_header_deps(cfiles)]
         group_cfilenames.append((cfilenames, deps))
+        manifest[lib_name] = [cfilenames, deps]
+    utils.dump_json_cache(manifest_path, GROUP_MANIFEST_VERSION, manifest)
 
-    return groups, group_cfilenames
+    return groups, group_cfilenames, source_paths
@@ -13,7 +13,7 @@ from tfreezer.mypyc_handler.codegen.emitfunc import native_function_header
 
 def generate_class_type_decl(cl: ClassIR, c_emitter: Emitter, external_emitter: Emitter, emitter: Emitter) -> None:
     context = c_emitter.context
-    name = f"{TYPE_PREFIX}{cl.name}_{cl.module_name}"
+    name = f"{TYPE_PREFIX}{cl.name}_{exported_name(cl.module_name)}"
     context.declarations[name] = HeaderDeclaration(f"PyTypeObject *{name};", needs_export=True)
 
     # If this is a non-extension class, all we want is the type object decl.
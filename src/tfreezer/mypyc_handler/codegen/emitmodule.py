@@ -3,9 +3,11 @@
 # contact: cookiezhx@163.com
 
 import os
+import re
 from typing import Iterable
 
 from mypy.build import BuildResult
+from mypy.errors import CompileError
 from mypyc.errors import Errors
 from mypyc.options import CompilerOptions
 from mypyc.namegen import NameGenerator, exported_name
@@ -46,6 +48,9 @@ from tfreezer.mypyc_handler.codegen.emitfunc import native_function_header
 from tfreezer.mypyc_handler.codegen.emitclass import generate_class_type_decl
 from tfreezer.mypyc_handler.codegen.emitwrapper import wrapper_function_header, legacy_wrapper_function_header
 
+# All symbols renamed by tfreezer start with "CPy", e.g. CPyDef_, CPyPy_, CPyType_, CPyStatic_, CPyStatics
+SYMBOL_PATTERN = re.compile(r"\bCPy\w+", re.ASCII)
+
 
 def compile_ir_to_c(
     groups: Groups,
@@ -181,28 +186,37 @@ class GroupGenerator:
     def module_name_no_dot(self) -> str:
         return exported_name(self.group_name)
 
-    def type_name_map(self, module_name: str, module: ModuleIR, emitter: Emitter) -> dict[str, str]:
-        name_map: dict[str, str] = {}
-        for cl in module.classes:
-            original_type_name = f"{TYPE_PREFIX}{cl.name}"
-            type_name = f"{TYPE_PREFIX}{cl.name}_{module_name}"
-            name_map[original_type_name] = type_name
+    def symbol_name_map(self, emitter: Emitter) -> dict[str, str]:
+        """
+        Map the symbols emitted by mypyc to the symbols used by tfreezer.
+        Functions, types and module globals are suffixed with the module name so that
+        modules compiled in different groups never conflict with each other when they are linked into one executable.
+        The map covers all modules of the group, so that modules of the same group can refer to each other.
+        """
+        name_map: dict[str, str] = {"CPyStatics": f"CPyStatics{self.group_suffix}"}
+        for module_name, module in self.modules.items():
+            suffix = exported_name(module_name)
+            name_map[emitter.static_name("globals", module_name)] = f"{STATIC_PREFIX}{suffix}_globals"
+            for cl in module.classes:
+                name_map[emitter.type_struct_name(cl)] = f"{TYPE_PREFIX}{cl.name}_{suffix}"
+                name_map[emitter.native_function_name(cl.ctor)] = f"{NATIVE_PREFIX}{cl.ctor.cname(emitter.names)}_{suffix}"
+            for fn in module.functions:
+                name_map[f"{NATIVE_PREFIX}{fn.cname(emitter.names)}"] = f"{NATIVE_PREFIX}{fn.cname(emitter.names)}_{suffix}"
+                name_map[f"{PREFIX}{fn.cname(emitter.names)}"] = f"{PREFIX}{fn.cname(emitter.names)}_{suffix}"
         return name_map
 
-    def function_name_map(self, module_name: str, module: ModuleIR, emitter: Emitter) -> dict[str, str]:
-        name_map: dict[str, str] = {}
-        for cl in module.classes:
-            original_native_ctor_name = f"{NATIVE_PREFIX}{cl.ctor.cname(emitter.names)}("
-            native_ctor_name = f"{NATIVE_PREFIX}{cl.ctor.cname(emitter.names)}_{exported_name(module_name)}("
-            name_map[original_native_ctor_name] = native_ctor_name
-        for fn in module.functions:
-            original_native_fn_name = f"{NATIVE_PREFIX}{fn.cname(emitter.names)}"
-            native_fn_name = f"{NATIVE_PREFIX}{fn.cname(emitter.names)}_{exported_name(module_name)}"
-            name_map[original_native_fn_name] = native_fn_name
-            original_py_fn_name = f"{PREFIX}{fn.cname(emitter.names)}"
-            py_fn_name = f"{PREFIX}{fn.cname(emitter.names)}_{exported_name(module_name)}"
-            name_map[original_py_fn_name] = py_fn_name
-        return name_map
+    @staticmethod
+    def rename_symbols(fragments: list[str], start: int, name_map: dict[str, str]) -> None:
+        """
+        Rename symbols of fragments[start:] in place, every identifier is looked up in the map once
+        """
+
+        def replace(match: re.Match[str]) -> str:
+            name = match.group(0)
+            return name_map.get(name, name)
+
+        for i in range(start, len(fragments)):
+            fragments[i] = SYMBOL_PATTERN.sub(replace, fragments[i])
 
     def generate_c_for_modules(self) -> list[tuple[str, str]]:
         file_contents = []
@@ -219,7 +233,14 @@ class GroupGenerator:
 
         self.generate_literal_tables()
 
+        name_map = self.symbol_name_map(emitter)
+
         for module_name, module in self.modules.items():
+            if self.multi_file:
+                emitter = Emitter(self.context)
+                emitter.emit_line(f'#include "{self.module_name_no_dot}.h"')
+                emitter.emit_line(f'#include "{self.module_name_no_dot}_internal.h"')
+
             self.declare_module(module_name, emitter)
             self.declare_internal_globals(module_name, emitter)
             self.declare_imports(module.imports, emitter)
@@ -229,20 +250,7 @@ class GroupGenerator:
             for cl in module.classes:
                 if cl.is_ext_class:
                     generate_class(cl, module_name, emitter)
-            function_name_map = self.function_name_map(module_name, module, emitter)
-            type_name_map = self.type_name_map(module_name, module, emitter)
-            for i in range(current_line_index, len(emitter.fragments)):
-                line = emitter.fragments[i]
-                for original_name, new_name in function_name_map.items():
-                    if original_name in line:
-                        line = line.replace(original_name, new_name)
-                        emitter.fragments[i] = line
-                        break
-                for original_name, new_name in type_name_map.items():
-                    if original_name in line:
-                        line = line.replace(original_name, new_name)
-                        emitter.fragments[i] = line
-                        break
+            self.rename_symbols(emitter.fragments, current_line_index, name_map)
             # endregion
 
             # Generate Python extension module definitions and module initialization functions.
@@ -259,30 +267,20 @@ class GroupGenerator:
                         generate_wrapper_function(fn, emitter, self.source_paths[module_name], module_name)
                     else:
                         generate_legacy_wrapper_function(fn, emitter, self.source_paths[module_name], module_name)
-                for i in range(current_line_index, len(emitter.fragments)):
-                    line = emitter.fragments[i]
-                    global_var_name = f"{STATIC_PREFIX}globals"
-                    py_fn_name = f"{PREFIX}{fn.cname(emitter.names)}"
-                    native_fn_name = f"{NATIVE_PREFIX}{fn.cname(emitter.names)}"
-                    if global_var_name in line:
-                        line = line.replace(global_var_name, f"{STATIC_PREFIX}{exported_name(module_name)}_globals")
-                        emitter.fragments[i] = line
-                    elif "CPyStatics[" in line:
-                        line = line.replace("CPyStatics[", f"CPyStatics{self.group_suffix}[")
-                        emitter.fragments[i] = line
-                    elif py_fn_name in line:
-                        line = line.replace(py_fn_name, f"{PREFIX}{fn.cname(emitter.names)}_{exported_name(module_name)}")
-                        emitter.fragments[i] = line
-                    elif native_fn_name in line:
-                        line = line.replace(native_fn_name, f"{NATIVE_PREFIX}{fn.cname(emitter.names)}_{exported_name(module_name)}")
-                        emitter.fragments[i] = line
-                    for original_name, new_name in type_name_map.items():
-                        if original_name in line:
-                            line = line.replace(original_name, new_name)
-                            emitter.fragments[i] = line
-                            break
+                self.rename_symbols(emitter.fragments, current_line_index, name_map)
                 # endregion
 
+            if self.multi_file:
+                file_contents.append((f"{self.module_name_no_dot}__{exported_name(module_name)}.c", "".join(emitter.fragments)))
+
+        if self.context.group_deps:
+            raise CompileError(
+                [
+                    f"error: Modules of group '{self.group_name}' refer to the modules of these groups: {sorted(self.context.group_deps)}. "
+                    "Put modules that import each other into the same group."
+                ]
+            )
+
         # The external header file contains type declarations while
         # the internal contains declarations of functions and objects
         # (which are shared between shared libraries via dynamic
@@ -295,7 +293,8 @@ class GroupGenerator:
         ext_declarations.emit_line("#ifdef __cplusplus")
         ext_declarations.emit_line('extern "C" {')
         ext_declarations.emit_line("#endif")
-        ext_declarations.emit_line(f"PyMODINIT_FUNC PyInit_{self.module_name_no_dot}(void);")
+        for module_name in self.modules:
+            ext_declarations.emit_line(f"PyMODINIT_FUNC PyInit_{exported_name(module_name)}(void);")
 
         declarations = Emitter(self.context)
         declarations.emit_line(f"#ifndef MYPYC_NATIVE_INTERNAL{self.group_suffix}_H")
@@ -485,7 +484,7 @@ class GroupGenerator:
         # HACK: Manually instantiate generated classes here
         type_structs: list[str] = []
         for cl in module.classes:
-            type_struct = f"{TYPE_PREFIX}{cl.name}_{cl.module_name}"
+            type_struct = f"{TYPE_PREFIX}{cl.name}_{exported_name(cl.module_name)}"
             type_structs.append(type_struct)
             if cl.is_generated:
                 emitter.emit_lines(
@@ -493,7 +492,7 @@ class GroupGenerator:
                 )
                 emitter.emit_lines(f"if (unlikely(!{type_struct}))", "    goto fail;")
 
-        emitter.emit_lines(f"if (CPyGlobalsInit_{exported_name(module_name)}() < 0)", "    goto fail;")
+        emitter.emit_lines(f"if (CPyGlobalsInit{self.group_suffix}() < 0)", "    goto fail;")
 
         self.generate_top_level_call(module_name, module, emitter)
 
@@ -2,23 +2,47 @@
 # author: Tac
 # contact: cookiezhx@163.com
 
+import sys
 import os
+import shutil
 import pathlib
-import typing as _t
+import hashlib
+import sysconfig
 
+from mypy import version as mypy_version
+from mypy.build import BuildSource
+from mypy.errors import CompileError
 from mypyc.codegen import emitmodule
 from mypyc import options, common, namegen
-from mypyc.build import include_dir
+from mypyc.build import include_dir, write_file
 
-from tfreezer import paths
+from tfreezer import paths, log, utils, build_cache
 from tfreezer.mypyc_handler import build
 
 
-class MyPycModuleInfo(_t.NamedTuple):
-    name: str
-    py_path: str
-    groups: emitmodule.Groups
-    group_cfilenames: list[tuple[list[str], list[str]]]
+# Name of the group when all modules are compiled into one group
+SINGLE_GROUP_NAME = "tfreezer_mypyc"
+# Config files of mypy in the working directory, they change the generated sources
+MYPY_CONFIG_FILES = ("mypy.ini", ".mypy.ini", "pyproject.toml", "setup.cfg")
+
+
+def get_runtime_cache_key() -> str:
+    """
+    Key of the mypyc runtime library in the shared cache directory, the library is compiled against the headers and ABI of
+    this interpreter, e.g. debug builds and free-threaded builds of the same version differ.
+    The compiler and the Python headers used by cmake are added to the key by cmake/mypyc_libraries.cmake
+    """
+    interpreter = "|".join(
+        (
+            sys.version,
+            sysconfig.get_paths()["include"],
+            getattr(sys, "abiflags", ""),
+            sysconfig.get_config_var("EXT_SUFFIX") or "",
+            str(hasattr(sys, "gettotalrefcount")),  # Py_DEBUG
+        )
+    )
+    digest = hashlib.sha256(interpreter.encode("utf-8")).hexdigest()[:16]
+    return f"{mypy_version.__version__}-py{sys.version_info.major}.{sys.version_info.minor}-{digest}"
 
 
 class MyPycSourceGenerator:
@@ -26,52 +50,194 @@ class MyPycSourceGenerator:
     _public_header_name = "__native.h"
     _private_header_name = "__native_internal.h"
 
-    def __init__(self):
-        self._modules: dict[str, MyPycModuleInfo] = {}
+    def __init__(self, grouping: str = "single"):
+        self._grouping = grouping
+        self._modules: dict[str, str] = {}  # module name -> module path
+        self._groups: emitmodule.Groups = []
+        self._group_cfilenames: list[tuple[list[str], list[str]]] = []
         self._target_dir = os.path.join(paths.BUILD_DIR, "generated", "mypyc_modules")
+        self._cache_dir = os.path.join(paths.BUILD_DIR, "mypy_cache")
+
+    def add_module(self, module_name: str, module_path: str) -> None:
+        self._modules[module_name] = module_path
+
+    def get_separate_arg(self) -> bool | list[tuple[list[str], str | None]]:
+        """
+        Get the `separate` argument of `build.mypyc_build` according to the grouping strategy
+        """
+        if self._grouping == "module":
+            return True
+        if self._grouping == "package":
+            packages: dict[str, list[str]] = {}
+            for module_name, module_path in self._modules.items():
+                package_name = module_name.partition(".")[0]
+                packages.setdefault(package_name, []).append(module_path)
+            return [(module_paths, f"{SINGLE_GROUP_NAME}_{package_name}") for package_name, module_paths in packages.items()]
+        return [(list(self._modules.values()), SINGLE_GROUP_NAME)]
+
+    def generate(self) -> dict[str, list[str]]:
+        """
+        Compile all added modules to c in one mypyc build, so that they are parsed and type checked only once
+        Modules that fail to type check or compile are removed and the others are built again,
+        so that they can fall back to normal freezing.
+        Errors that can't be attributed to a module fall back to one group, and then to freezing all modules
+        Returns:
+            dict: key is the name of a rejected module, value is its error messages
+        """
+        cache = build_cache.get_build_cache()
+        cache_key = self._get_cache_key()
+        if cache is not None and self._load_cached_groups(cache, cache_key):
+            return {}
+        rejected: dict[str, list[str]] = {}
+        source_paths: list[str] = []
+        while self._modules:
+            log.logger.info("Compiling %d modules with mypyc, grouping: %s", len(self._modules), self._grouping)
+            compiler_options = options.CompilerOptions(multi_file=True, target_dir=self._target_dir)
+            module_paths = list(self._modules.values())
+            try:
+                self._groups, self._group_cfilenames, source_paths = build.mypyc_build(
+                    module_paths, compiler_options, separate=self.get_separate_arg(), cache_dir=self._cache_dir
+                )
+            except CompileError as e:
+                failed = self._get_failed_modules(e.messages)
+                if not failed and self._grouping != "single":
+                    # e.g. modules that import modules of another group, they are compiled in one group instead
+                    log.logger.warning("mypyc failed with grouping '%s', compile all modules in one group: %s", self._grouping, e.messages)
+                    self._grouping = "single"
+                    continue
+                if not failed:
+                    log.logger.warning("mypyc failed and the errors can't be attributed to any module: %s", e.messages)
+                    failed = {module_name: e.messages or ["error: mypyc failed"] for module_name in self._modules}
+                for module_name, messages in failed.items():
+                    rejected[module_name] = messages
+                    del self._modules[module_name]
+                continue
+            break
+        for module_name, messages in rejected.items():
+            log.logger.warning(
+                "'%s' is not compiled with mypyc and is frozen instead, %d errors, e.g. %s", module_name, len(messages), messages[0]
+            )
+        if rejected:
+            log.logger.warning("%d of %d modules fall back to normal freezing", len(rejected), len(rejected) + len(self._modules))
+        elif cache is not None and self._modules:
+            # Builds with rejected modules aren't cached, errors must be reported by every build
+            self._store_groups(cache, cache_key, source_paths)
+        return rejected
+
+    def _get_cache_key(self) -> str:
+        modules = sorted((module_name, build_cache.normalize_path(module_path)) for module_name, module_path in self._modules.items())
+        return build_cache.compute_key(
+            "mypyc", sys.version, mypy_version.__version__, build_cache.get_tool_digest(), self._grouping, repr(modules)
+        )
 
-    def generate(self, module_name: str, module_path: str) -> None:
-        target_dir = self._target_dir
-        compiler_options = options.CompilerOptions(multi_file=True, target_dir=target_dir)
-        groups, group_cfilenames = build.mypyc_build([module_path], compiler_options)
-        mypyc_module_info = MyPycModuleInfo(module_name, module_path, groups, group_cfilenames)
-        self._modules[module_name] = mypyc_module_info
+    def _store_groups(self, cache: build_cache.BuildCache, key: str, source_paths: list[str]) -> None:
+        """
+        Store sources of all groups, the entry is valid while all modules analyzed by mypy are unchanged
+        """
+        groups = []
+        files = {}
+        for (group_sources, lib_name), (cfilenames, deps) in zip(self._groups, self._group_cfilenames):
+            module_paths = [[source.module, build_cache.normalize_path(source.path)] for source in group_sources]
+            group_files = [os.path.relpath(the_path, self._target_dir) for the_path in cfilenames + deps]
+            groups.append([lib_name, module_paths, group_files[: len(cfilenames)], group_files[len(cfilenames) :]])
+            for group_file in group_files:
+                with open(os.path.join(self._target_dir, group_file), "r", encoding="utf-8") as fp:
+                    files[group_file] = build_cache.normalize_text(fp.read())
+        config_paths = [os.path.abspath(config_file) for config_file in MYPY_CONFIG_FILES]
+        cache.put_validated("mypyc", key, source_paths + config_paths, {"groups": groups, "files": files})
+
+    def _load_cached_groups(self, cache: build_cache.BuildCache, key: str) -> bool:
+        """
+        Write sources of all groups from the build cache
+        Returns:
+            False if missed
+        """
+        payload = cache.get_validated("mypyc", key)
+        if payload is None:
+            return False
+        os.makedirs(self._target_dir, exist_ok=True)
+        for group_file, text in payload["files"].items():
+            write_file(os.path.join(self._target_dir, group_file), build_cache.denormalize_text(text))  # keep mtime if not changed
+        self._groups = []
+        self._group_cfilenames = []
+        for lib_name, module_paths, cfilenames, deps in payload["groups"]:
+            group_sources = [
+                BuildSource(build_cache.denormalize_path(module_path), module_name) for module_name, module_path in module_paths
+            ]
+            self._groups.append((group_sources, lib_name))
+            self._group_cfilenames.append(
+                ([os.path.join(self._target_dir, cfile) for cfile in cfilenames], [os.path.join(self._target_dir, dep) for dep in deps])
+            )
+        # The incremental cache of mypy doesn't know these sources, it would take outdated groups as fresh
+        shutil.rmtree(self._cache_dir, ignore_errors=True)
+        log.logger.info("mypyc sources of %d modules are loaded from the build cache", len(self._modules))
+        return True
+
+    def _get_failed_modules(self, messages: list[str]) -> dict[str, list[str]]:
+        """
+        Map error messages to modules, messages are like: <absolute path>:<line>: error: <message>
+        """
+        path_to_module = {os.path.normcase(os.path.abspath(module_path)): module_name for module_name, module_path in self._modules.items()}
+        failed: dict[str, list[str]] = {}
+        for message in messages:
+            if ": error:" not in message:
+                continue
+            location = message.partition(": error:")[0]
+            # strip line (and column) numbers, the path itself may contain a drive letter
+            file_path = location
+            while True:
+                head, sep, tail = file_path.rpartition(":")
+                if not sep or not tail.isdigit():
+                    break
+                file_path = head
+            module_name = path_to_module.get(os.path.normcase(os.path.abspath(file_path)))
+            if module_name is not None:
+                failed.setdefault(module_name, []).append(message)
+        return failed
 
     def dump_mypyc_info(self) -> None:
         """
-        Dump mypyc extra sources and include directories
+        Dump mypyc include directories, the mypyc runtime and mypyc groups for cmake
         """
+        mypyc_include_dirs_path = os.path.join(paths.BUILD_DIR, "mypyc_include_dirs")
+        mypyc_groups_path = os.path.join(paths.BUILD_DIR, "mypyc_groups.cmake")
         if not self._modules:
+            # Clear outputs of previous builds, cmake configures again if they change
+            for stale_path in (mypyc_include_dirs_path, mypyc_groups_path):
+                utils.write_text_if_changed(stale_path, "")
             return
         mypyc_modules_lines: list[str] = []
         initialize_macro_lines = ["#define INITIALIZE_MYPYC_MODULES"]
-        mypyc_lib_rt_dir = include_dir()
-        include_dirs = [mypyc_lib_rt_dir]
-        sources = [os.path.join(mypyc_lib_rt_dir, runtime_c).replace("\\", "/") for runtime_c in common.RUNTIME_C_FILES]
-        for module_name, module_info in self._modules.items():
-            exported_name = namegen.exported_name(module_name)
-            mypyc_modules_lines.append(f'#include "{exported_name}.h"')
-            initialize_macro_lines[-1] += " \\"
-            initialize_macro_lines.append(f'    PyImport_AppendInittab("{module_name}", &PyInit_{exported_name});')
-            groups = module_info.groups
-            group_cfilenames = module_info.group_cfilenames
-            for (group_sources, lib_name), (cfilenames, deps) in zip(groups, group_cfilenames):  # pylint:disable=unused-variable
-                # print(group_sources, lib_name, cfilenames, deps)
-                sources.extend(cfilenames)
-                sources.extend(deps)
-        include_dirs = [the_path.replace("\\", "/") for the_path in include_dirs]
-        sources = [the_path.replace("\\", "/") for the_path in sources]
-        mypyc_include_dirs_path = os.path.join(paths.BUILD_DIR, "mypyc_include_dirs")
-        with open(mypyc_include_dirs_path, "w", encoding="utf-8") as fp:
-            fp.write(";".join(include_dirs))
-        mypyc_sources_path = os.path.join(paths.BUILD_DIR, "mypyc_sources")
-        with open(mypyc_sources_path, "w", encoding="utf-8") as fp:
-            fp.write(";".join(sources))
+        mypyc_lib_rt_dir = include_dir().replace("\\", "/")
+        runtime_sources = [f"{mypyc_lib_rt_dir}/{runtime_c}" for runtime_c in common.RUNTIME_C_FILES]
+        runtime_cache_dir = os.path.join(paths.CACHE_DIR, "mypyc_runtime", get_runtime_cache_key()).replace("\\", "/")
+        group_names: list[str] = []
+        cmake_lines = [
+            f'set(TF_MYPYC_VERSION "{mypy_version.__version__}")',
+            f'set(TF_MYPYC_RUNTIME_DIR "{mypyc_lib_rt_dir}")',
+            f'set(TF_MYPYC_RUNTIME_SOURCES "{";".join(runtime_sources)}")',
+            f'set(TF_MYPYC_RUNTIME_CACHE_DIR "{runtime_cache_dir}")',
+        ]
+        for (group_sources, lib_name), (cfilenames, deps) in zip(self._groups, self._group_cfilenames):
+            assert lib_name is not None
+            group_name = namegen.exported_name(lib_name)
+            group_names.append(group_name)
+            mypyc_modules_lines.append(f'#include "{group_name}.h"')
+            for source in group_sources:
+                initialize_macro_lines[-1] += " \\"
+                init_function = f"PyInit_{namegen.exported_name(source.module)}"
+                initialize_macro_lines.append(f'    PyImport_AppendInittab("{source.module}", &{init_function});')
+            group_files = [the_path.replace("\\", "/") for the_path in cfilenames + deps]
+            cmake_lines.append(f'set(TF_MYPYC_GROUP_SOURCES_{group_name} "{";".join(group_files)}")')
+        cmake_lines.append(f'set(TF_MYPYC_GROUPS "{";".join(group_names)}")')
+        cmake_lines.append("")  # Extra empty line to make it prettier
+        # Kept unchanged if possible, cmake configures again if they change
+        utils.write_text_if_changed(mypyc_include_dirs_path, mypyc_lib_rt_dir)
+        utils.write_text_if_changed(mypyc_groups_path, "\n".join(cmake_lines))
         mypyc_modules_lines.append("")
         mypyc_modules_lines.extend(initialize_macro_lines)
         mypyc_modules_path = os.path.join(self._target_dir, "tfreezer_mypyc_modules.h")
-        with open(mypyc_modules_path, "w", encoding="utf-8") as fp:
-            fp.write("\n".join(mypyc_modules_lines))
+        write_file(mypyc_modules_path, "\n".join(mypyc_modules_lines))  # keep mtime if not changed
 
     @classmethod
     def _process_module_headers(cls, module_name: str, public_header: str, private_header: str) -> tuple[str, str]:
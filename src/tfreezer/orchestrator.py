@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Run build stages as a task graph, a stage starts as soon as the stages it depends on finish,
+so independent stages overlap, e.g. freezing modules while mypyc type checks
+"""
+
+import typing as _t
+import os
+import time
+import asyncio
+import dataclasses
+
+from tfreezer import log, utils
+
+
+@dataclasses.dataclass
+class Stage:
+    """
+    Data struct for a build stage
+    """
+
+    name: str
+    run: _t.Callable[[], _t.Awaitable[int]]  # returns 0 if the stage succeeds
+    dependencies: tuple[str, ...] = ()  # names of the stages that must finish first
+    start_time: float = 0.0
+    end_time: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return self.end_time - self.start_time
+
+
+class StageGraph:
+
+    def __init__(self) -> None:
+        self._stages: dict[str, Stage] = {}
+
+    def add_stage(self, name: str, run: _t.Callable[[], _t.Awaitable[int]], dependencies: _t.Iterable[str] = ()) -> None:
+        """
+        Add a stage, stages it depends on must be added before
+        """
+        dependencies = tuple(dependencies)
+        assert name not in self._stages, f"Stage '{name}' is added twice"
+        assert all(dependency in self._stages for dependency in dependencies), f"Dependencies of stage '{name}' are not added"
+        self._stages[name] = Stage(name, run, dependencies)
+
+    def run(self) -> int:
+        """
+        Run all stages, the others are cancelled once a stage fails
+        Returns:
+            0 if all stages succeed, otherwise return code of the stage that fails first
+        """
+        start_time = time.perf_counter()
+        try:
+            return asyncio.run(self._run())
+        finally:
+            self._report(time.perf_counter() - start_time)
+
+    async def _run(self) -> int:
+        tasks: dict[str, asyncio.Task[int]] = {}
+        for stage in self._stages.values():
+            dependency_tasks = [tasks[dependency] for dependency in stage.dependencies]
+            tasks[stage.name] = asyncio.create_task(self._run_stage(stage, dependency_tasks), name=stage.name)
+        pending: set[asyncio.Task[int]] = set(tasks.values())
+        returncode = 0
+        try:
+            while pending and not returncode:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        log.logger.error("Stage '%s' failed with return code %d", task.get_name(), task.result())
+                        returncode = task.result()
+                        break
+        finally:
+            # Also reached if a stage raises, running subprocesses are killed by the cancellation
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return returncode
+
+    @staticmethod
+    async def _run_stage(stage: Stage, dependency_tasks: list[asyncio.Task[int]]) -> int:
+        for dependency_task in dependency_tasks:
+            # Shielded, cancelling a stage must not cancel the stages it depends on
+            if await asyncio.shield(dependency_task):
+                # The dependency failed, the graph is being cancelled
+                return 0
+        log.logger.info("Stage '%s' started", stage.name)
+        stage.start_time = time.perf_counter()
+        try:
+            returncode = await stage.run()
+        except asyncio.CancelledError:
+            # Counted in the report, the stage was running until the graph was cancelled
+            stage.end_time = time.perf_counter()
+            log.logger.info("Stage '%s' cancelled after %.2fs", stage.name, stage.duration)
+            raise
+        stage.end_time = time.perf_counter()
+        log.logger.info("Stage '%s' finished in %.2fs", stage.name, stage.duration)
+        return returncode
+
+    def get_critical_path(self) -> list[Stage]:
+        """
+        Get the chain of stages that decides the wall time: starting from the stage that finishes last,
+        repeatedly go to the dependency that finishes last
+        """
+        finished = [stage for stage in self._stages.values() if stage.end_time]
+        if not finished:
+            return []
+        critical_path = [max(finished, key=lambda stage: stage.end_time)]
+        while True:
+            dependencies = [self._stages[name] for name in critical_path[-1].dependencies if self._stages[name].end_time]
+            if not dependencies:
+                break
+            critical_path.append(max(dependencies, key=lambda stage: stage.end_time))
+        critical_path.reverse()
+        return critical_path
+
+    def _report(self, wall_time: float) -> None:
+        critical_path = self.get_critical_path()
+        if not critical_path:
+            return
+        busy_time = sum(stage.duration for stage in self._stages.values() if stage.end_time)
+        log.logger.info("Build stages took %.2fs, %.2fs if they ran one by one", wall_time, busy_time)
+        log.logger.info("Critical path: %s", " -> ".join(f"{stage.name} ({stage.duration:.2f}s)" for stage in critical_path))
+
+
+async def run_commands(
+    commands: _t.Sequence[tuple[str, list[str]]], *, cwd: str, max_jobs: int = 0, env: _t.Optional[dict[str, str]] = None
+) -> int:
+    """
+    Run commands concurrently, at most max_jobs at the same time
+    Args:
+        commands: list of (name, args), name prefixes the logged output
+        max_jobs: 0 means the number of CPUs
+    Returns:
+        0 if all commands succeed, otherwise the first nonzero return code
+    """
+    semaphore = asyncio.Semaphore(max_jobs or os.cpu_count() or 1)
+
+    async def run_command(name: str, args: list[str]) -> int:
+        async with semaphore:
+            return await utils.call_subprocess_async(args, cwd=cwd, env=env, log_prefix=f"[{name}] ")
+
+    # Exceptions are returned, otherwise a cancelled command ends the gathering while the others are still killing their processes
+    results = await asyncio.gather(*(run_command(name, args) for name, args in commands), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return next((result for result in results if result), 0)
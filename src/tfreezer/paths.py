@@ -23,6 +23,17 @@ PYTHON_EXE = sys.executable
 CMAKE_EXE = shutil.which("cmake")
 
 
+def _get_default_cache_dir() -> str:
+    if os.environ.get("TFREEZER_CACHE_DIR"):
+        return os.path.abspath(os.environ["TFREEZER_CACHE_DIR"])
+    if sys.platform.startswith("win") and os.environ.get("LOCALAPPDATA"):
+        return os.path.join(os.environ["LOCALAPPDATA"], "tfreezer", "cache")
+    return os.path.join(os.path.expanduser("~"), ".cache", "tfreezer")
+
+
+CACHE_DIR = _get_default_cache_dir()  # Shared between builds, can be set through env: TFREEZER_CACHE_DIR
+
+
 def dump_paths() -> None:
     if not BUILD_DIR:
         log.logger.error("Failed to dump paths. BUILD_DIR needs to be set.")
@@ -37,16 +48,16 @@ FROZEN_MODULE_DIR = r"{FROZEN_MODULE_DIR}"
 FROZEN_MODULES_HEADER = r"{FROZEN_MODULES_HEADER}"
 PYTHON_EXE = r"{PYTHON_EXE}"
 CMAKE_EXE = r"{CMAKE_EXE}"
+CACHE_DIR = r"{CACHE_DIR}"
 """
     paths_file = os.path.join(BUILD_DIR, "paths")
     if not os.path.isdir(BUILD_DIR):
         os.makedirs(BUILD_DIR)
-    with open(paths_file, "w", encoding="utf-8") as fp:
-        fp.write(content)
+    utils.write_text_if_changed(paths_file, content)
 
 
 def load_paths(build_dir: str) -> None:
-    global APP_ROOT, BUILD_DIR, DEPLOY_DIR, GENERATED_HEADERS_DIR, FROZEN_MODULE_DIR, FROZEN_MODULES_HEADER
+    global APP_ROOT, BUILD_DIR, DEPLOY_DIR, GENERATED_HEADERS_DIR, FROZEN_MODULE_DIR, FROZEN_MODULES_HEADER, CACHE_DIR
     build_dir = os.path.abspath(build_dir)
     if not os.path.isdir(build_dir):
         log.logger.error("Failed to load paths. '%s' is not a directory.", build_dir)
@@ -63,3 +74,4 @@ def load_paths(build_dir: str) -> None:
     GENERATED_HEADERS_DIR = module.GENERATED_HEADERS_DIR
     FROZEN_MODULE_DIR = module.FROZEN_MODULE_DIR
     FROZEN_MODULES_HEADER = module.FROZEN_MODULES_HEADER
+    CACHE_DIR = getattr(module, "CACHE_DIR", CACHE_DIR)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Cached index of QtQml modules and qml imports
+"""
+
+import os
+import re
+import hashlib
+import typing as _t
+import multiprocessing
+from multiprocessing import pool
+
+from PyInstaller.utils import misc
+
+from tfreezer import log, utils, paths
+
+QML_INDEX_CACHE_VERSION = 1
+
+# match: module <ModuleIdentifier>
+QMLDIR_MODULE_PATTERN = re.compile(r"^module\s+(\S+)", re.M)
+# match: import <ModuleIdentifier> [<Version.Number>] [as <Qualifier>]
+# match: import <ModuleIdentifier> [auto] (in qmldir)
+QML_IMPORT_PATTERN = re.compile(r"^import\s+([a-zA-Z][a-zA-Z0-9_\.]*)\s*", re.M)
+
+
+class QmlModuleEntry(_t.NamedTuple):
+    module_path: str  # path of the plugin dll
+    qmldir_path: str
+    import_modules: list[str]
+
+
+def _get_cache_file(kind: str, dir_path: str) -> str:
+    digest = hashlib.sha1(os.path.normcase(dir_path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(paths.CACHE_DIR, "qml", f"{kind}-{digest}.json")
+
+
+def _get_dir_mtimes(dir_path: str) -> dict[str, int]:
+    dir_mtimes = {}
+    for root, _, _ in os.walk(dir_path):
+        dir_mtimes[root] = os.stat(root).st_mtime_ns
+    return dir_mtimes
+
+
+def _is_dir_mtimes_valid(dir_mtimes: dict[str, int]) -> bool:
+    if not dir_mtimes:
+        return False
+    for dir_path, mtime in dir_mtimes.items():
+        try:
+            if os.stat(dir_path).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def _scan_qml_modules(qml_src_dir: str) -> dict[str, QmlModuleEntry]:
+    qml_modules = {}
+    for qml_plugin_file in misc.dlls_in_subdirs(qml_src_dir):
+        dirpath = os.path.dirname(qml_plugin_file)
+        qmldir_path = os.path.normpath(os.path.join(dirpath, "qmldir"))
+        with open(qmldir_path, "r", encoding="utf-8") as f:
+            content = f.read()
+        result = QMLDIR_MODULE_PATTERN.findall(content)
+        assert len(result) == 1, content
+        module_name = result[0]
+        import_modules = QML_IMPORT_PATTERN.findall(content)
+        qml_modules[module_name] = QmlModuleEntry(os.path.normpath(qml_plugin_file), qmldir_path, import_modules)
+    return qml_modules
+
+
+def load_qml_module_index(qml_src_dir: str) -> dict[str, QmlModuleEntry]:
+    """
+    Get all QtQml modules of a Qt installation
+    The index is cached per QmlImportsPath and rebuilt only when a directory under it is modified
+    Args:
+        qml_src_dir: QmlImportsPath of the Qt installation
+    Returns:
+        dict: key is module fullname, value is QmlModuleEntry
+    """
+    qml_src_dir = os.path.normpath(qml_src_dir)
+    cache_file = _get_cache_file("modules", qml_src_dir)
+    cache = utils.load_json_cache(cache_file, QML_INDEX_CACHE_VERSION)
+    if cache.get("qml_src_dir") == qml_src_dir and _is_dir_mtimes_valid(cache.get("dir_mtimes", {})):
+        log.logger.debug("Using cached QtQml module index: %s", cache_file)
+        return {name: QmlModuleEntry(*entry) for name, entry in cache["modules"].items()}
+    log.logger.info("Indexing QtQml modules in '%s'", qml_src_dir)
+    dir_mtimes = _get_dir_mtimes(qml_src_dir)
+    qml_modules = _scan_qml_modules(qml_src_dir)
+    utils.dump_json_cache(
+        cache_file,
+        QML_INDEX_CACHE_VERSION,
+        {
+            "qml_src_dir": qml_src_dir,
+            "dir_mtimes": dir_mtimes,
+            "modules": {name: list(entry) for name, entry in qml_modules.items()},
+        },
+    )
+    return qml_modules
+
+
+def read_qml_imports(file_path: str) -> list[str]:
+    """
+    Get module names imported by a qml file
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        content = f.read()
+    return QML_IMPORT_PATTERN.findall(content)
+
+
+def scan_qml_imports(dir_path: str) -> list[str]:
+    """
+    Get qml module names that are used in a directory
+    Only files that are added or modified since the last scan are read, and they are read in parallel
+    Args:
+        dir_path (str): path of the directory
+    Returns:
+        list: module names, in the order they are first imported
+    """
+    dir_path = os.path.normpath(os.path.abspath(dir_path))
+    cache_file = _get_cache_file("imports", dir_path)
+    cached_files: dict[str, dict[str, _t.Any]] = utils.load_json_cache(cache_file, QML_INDEX_CACHE_VERSION)
+    file_stats: dict[str, list[int]] = {}
+    for root, _, file_names in os.walk(dir_path):
+        for file_name in file_names:
+            if file_name.endswith(".qml"):
+                file_path = os.path.join(root, file_name)
+                stat = os.stat(file_path)
+                file_stats[file_path] = [stat.st_mtime_ns, stat.st_size]
+    changed = [file_path for file_path, stat in file_stats.items() if cached_files.get(file_path, {}).get("stat") != stat]
+    if changed:
+        log.logger.debug("Scanning %d qml files in '%s'", len(changed), dir_path)
+        with pool.ThreadPool(processes=min(len(changed), multiprocessing.cpu_count())) as thread_pool:
+            for file_path, file_imports in zip(changed, thread_pool.map(read_qml_imports, changed)):
+                cached_files[file_path] = {"stat": file_stats[file_path], "imports": file_imports}
+    if changed or len(cached_files) != len(file_stats):
+        cached_files = {file_path: cached_files[file_path] for file_path in file_stats}
+        utils.dump_json_cache(cache_file, QML_INDEX_CACHE_VERSION, cached_files)
+    imports = []
+    seen = set()
+    for file_path in file_stats:
+        for module_name in cached_files[file_path]["imports"]:
+            if module_name not in seen:
+                seen.add(module_name)
+                imports.append(module_name)
+    return imports
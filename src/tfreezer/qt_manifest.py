@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+Script for generating the manifest of a Qt installation: modules, binaries, datas and plugin directories
+The manifest is generated in a subprocess so that Qt is never imported into the assemble process
+"""
+
+import sys
+import os
+import types
+import typing as _t
+import hashlib
+import functools
+import dataclasses
+from importlib import machinery, util
+
+from tfreezer import log, utils, paths, config
+
+QT_MANIFEST_VERSION = 1
+
+
+@dataclasses.dataclass
+class QtModuleManifest:
+    """
+    Data struct for a Qt python module in the manifest
+    """
+
+    file: str  # path of the extension module
+    hiddenimports: list[str]
+    binaries: list[tuple[str, str]]  # (src, dest_dir), outputs of the PyInstaller hook
+    datas: list[tuple[str, str]]  # (src, dest_dir), outputs of the PyInstaller hook
+
+
+@dataclasses.dataclass
+class QtManifest:
+    """
+    Data struct for the manifest of a Qt installation
+    """
+
+    qt_library_name: str  # PyQt5 or PySide6
+    qt_rel_dir: str
+    location: dict[str, str]  # QLibraryInfo locations, e.g. PrefixPath, PluginsPath, QmlImportsPath
+    plugin_dirs: dict[str, str]  # plugin type -> plugin directory, e.g. platforms, imageformats
+    modules: dict[str, QtModuleManifest]  # key is module fullname
+
+    @classmethod
+    def from_json(cls, data: dict[str, _t.Any]) -> "QtManifest":
+        modules = {}
+        for module_name, module_data in data["modules"].items():
+            modules[module_name] = QtModuleManifest(
+                module_data["file"],
+                module_data["hiddenimports"],
+                [tuple(item) for item in module_data["binaries"]],
+                [tuple(item) for item in module_data["datas"]],
+            )
+        return cls(data["qt_library_name"], data["qt_rel_dir"], data["location"], data["plugin_dirs"], modules)
+
+
+def get_qt_package_dir(qt_library_name: str) -> str:
+    """
+    Get directory of a Qt python package without importing it
+    """
+    spec = util.find_spec(qt_library_name)
+    if spec is None or not spec.submodule_search_locations:
+        raise ModuleNotFoundError(f"No module named {qt_library_name}", name=qt_library_name)
+    return os.path.normpath(spec.submodule_search_locations[0])
+
+
+def iterate_qt_extension_modules(qt_library_name: str) -> _t.Generator[tuple[str, str], None, None]:
+    """
+    Iterate extension modules of a Qt python package
+    Returns:
+        Generator of (module fullname, file path)
+    """
+    package_dir = get_qt_package_dir(qt_library_name)
+    extension_suffixes = sorted(machinery.EXTENSION_SUFFIXES, key=len, reverse=True)
+    for file_name in sorted(os.listdir(package_dir)):
+        for suffix in extension_suffixes:
+            if file_name.endswith(suffix):
+                module_name = file_name[: -len(suffix)]
+                yield f"{qt_library_name}.{module_name}", os.path.join(package_dir, file_name)
+                break
+
+
+def import_pyi_qt_hooks(fullname: str) -> types.ModuleType:
+    """
+    import PyInstaller Qt hook modules
+    Args:
+        name: fullname of Qt module
+    Returns:
+        hook module
+    """
+    from PyInstaller import hooks  # pylint: disable=import-outside-toplevel
+
+    hooks_dir = os.path.dirname(hooks.__file__)
+    module_path = os.path.join(hooks_dir, f"hook-{fullname}.py")
+    real_fullname = f"PyInstaller.hooks.{fullname}"
+    return utils.load_signle_module(real_fullname, module_path)
+
+
+def get_qt_manifest_cache_key(qt_library_name: str) -> str:
+    """
+    Get cache key of a Qt installation manifest
+    """
+    package_dir = get_qt_package_dir(qt_library_name)
+    python_version = f"{sys.version_info.major}.{sys.version_info.minor}"
+    return f"{qt_library_name}|{utils.get_distribution_version(qt_library_name)}|{package_dir}|{python_version}"
+
+
+def generate_qt_manifest(qt_library_name: str) -> dict[str, _t.Any]:
+    """
+    Generate manifest data of a Qt installation
+    This imports PyInstaller's Qt hooks, so it is supposed to run in a subprocess
+    Returns:
+        manifest data, "failed_hooks" lists modules whose hooks raised, such a manifest is incomplete
+    """
+    from PyInstaller.utils.hooks import qt  # pylint: disable=import-outside-toplevel
+
+    library_info = qt.get_qt_library_info(qt_library_name)
+    location = {key: os.path.normpath(value) for key, value in library_info.location.items() if value}
+    plugin_dirs = {}
+    plugins_path = location.get("PluginsPath", "")
+    if os.path.isdir(plugins_path):
+        for entry in sorted(os.scandir(plugins_path), key=lambda item: item.name):
+            if entry.is_dir():
+                plugin_dirs[entry.name] = entry.path
+    modules = {}
+    failed_hooks = []
+    for module_name, module_file in iterate_qt_extension_modules(qt_library_name):
+        module_data = {"file": module_file, "hiddenimports": [], "binaries": [], "datas": []}
+        try:
+            hook = import_pyi_qt_hooks(module_name)
+        except FileNotFoundError:
+            # No such hook
+            pass
+        except Exception:  # pylint: disable=broad-exception-caught
+            log.logger.exception("Failed to process PyInstaller hook of '%s'", module_name)
+            failed_hooks.append(module_name)
+        else:
+            module_data["hiddenimports"] = list(getattr(hook, "hiddenimports", []))
+            module_data["binaries"] = [list(item) for item in getattr(hook, "binaries", [])]
+            module_data["datas"] = [list(item) for item in getattr(hook, "datas", [])]
+        modules[module_name] = module_data
+    return {
+        "qt_library_name": qt_library_name,
+        "qt_rel_dir": library_info.qt_rel_dir,
+        "location": location,
+        "plugin_dirs": plugin_dirs,
+        "modules": modules,
+        "failed_hooks": failed_hooks,
+    }
+
+
+def get_qt_manifest_path(qt_library_name: str) -> str:
+    digest = hashlib.sha1(get_qt_manifest_cache_key(qt_library_name).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(paths.CACHE_DIR, "qt", f"{qt_library_name}-{digest}.json")
+
+
+@functools.cache
+def load_qt_manifest(qt_library_name: str) -> QtManifest:
+    """
+    Load manifest of a Qt installation, the manifest is generated in a subprocess if it's not cached
+    Args:
+        qt_library_name(str): PyQt5, PySide6
+    Returns:
+        QtManifest
+    """
+    cache_key = get_qt_manifest_cache_key(qt_library_name)
+    manifest_path = get_qt_manifest_path(qt_library_name)
+    data = utils.load_json_cache(manifest_path, QT_MANIFEST_VERSION)
+    if data.get("key") != cache_key:
+        log.logger.info("Generating manifest of %s: %s", qt_library_name, manifest_path)
+        args = [sys.executable, "-m", "tfreezer.qt_manifest", paths.BUILD_DIR, qt_library_name, manifest_path]
+        returncode = utils.call_subprocess(args, cwd=paths.APP_ROOT or os.getcwd())
+        if returncode:
+            raise RuntimeError(f"Failed to generate manifest of {qt_library_name}")
+        data = utils.load_json_cache(manifest_path, QT_MANIFEST_VERSION)
+    failed_hooks = data["manifest"].get("failed_hooks", [])
+    if failed_hooks:
+        # The incomplete manifest is only used by this build, it's generated again by the next one
+        log.logger.warning("Manifest of %s is not cached, PyInstaller hooks failed: %s", qt_library_name, ", ".join(failed_hooks))
+        os.remove(manifest_path)
+    return QtManifest.from_json(data["manifest"])
+
+
+def main() -> None:
+    """
+    Entry point
+    Returns:
+        None
+    """
+    if len(sys.argv) != 4:
+        sys.exit("need to specify the build directory, Qt library name and output path\n")
+    build_dir = sys.argv[1]
+    qt_library_name = sys.argv[2]
+    manifest_path = sys.argv[3]
+    paths.load_paths(build_dir)
+    config.load_sys_path()
+    data = {"key": get_qt_manifest_cache_key(qt_library_name), "manifest": generate_qt_manifest(qt_library_name)}
+    utils.dump_json_cache(manifest_path, QT_MANIFEST_VERSION, data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# author: Tac
+# contact: cookiezhx@163.com
+
+"""
+C extension modules that are compiled from sources, linked into the executable and registered by PyImport_AppendInittab
+"""
+
+import sys
+import os
+import re
+import dataclasses
+import typing as _t
+
+from mypyc.namegen import exported_name
+from mypyc.build import write_file
+
+from tfreezer import paths, log, utils
+
+# CPython's build info of the modules, searched in order, see: Modules/makesetup
+CPYTHON_SETUP_FILES = ("Setup.local", "Setup", "Setup.stdlib.in", "Setup.bootstrap.in")
+# match: @MODULE__SOCKET_TRUE@
+SETUP_MARKER_PATTERN = re.compile(r"^@\w+@")
+# Windows libraries of stdlib extensions, which are not recorded in the Setup files, see: PCbuild/<module>.vcxproj
+WINDOWS_LIBRARIES = {
+    "_socket": ["ws2_32", "iphlpapi"],
+    "select": ["ws2_32"],
+    "_overlapped": ["ws2_32"],
+    "_multiprocessing": ["ws2_32"],
+    "_ssl": ["ws2_32", "crypt32"],
+}
+
+
+@dataclasses.dataclass
+class StaticExtension:
+    """
+    Data struct for the build info of a statically linked extension module
+    """
+
+    name: str  # module fullname
+    sources: list[str]
+    include_dirs: list[str] = dataclasses.field(default_factory=list)
+    define_macros: list[str] = dataclasses.field(default_factory=list)  # NAME or NAME=VALUE
+    libraries: list[str] = dataclasses.field(default_factory=list)
+    library_dirs: list[str] = dataclasses.field(default_factory=list)
+    is_cpython_module: bool = False  # whether the module is a CPython stdlib module, which is compiled with Py_BUILD_CORE_MODULE
+
+    def merge(self, other: dict[str, _t.Any]) -> None:
+        """
+        Extend the build info with the user config
+        """
+        for field in ("sources", "include_dirs", "define_macros", "libraries", "library_dirs"):
+            for value in other.get(field, []):
+                if value not in getattr(self, field):
+                    getattr(self, field).append(value)
+
+
+def parse_setup_line(line: str, modules_dir: str) -> _t.Optional[StaticExtension]:
+    """
+    Parse a module line of CPython's Setup files: <module> <sources> [-I<dir>] [-D<macro>] [-L<dir>] [-l<lib>]
+    Args:
+        line: the line
+        modules_dir: the Modules directory, sources are relative to it
+    Returns:
+        StaticExtension or None if the line doesn't define a module
+    """
+    line = SETUP_MARKER_PATTERN.sub("", line.partition("#")[0]).strip()
+    if not line or "=" in line.split()[0] or line.startswith("*"):
+        # Empty lines, variable definitions and *shared*, *static*, *disabled* markers
+        return None
+    name, *words = line.split()
+    extension = StaticExtension(name, [], is_cpython_module=True)
+    for word in words:
+        if word.startswith("$("):
+            log.logger.warning("Makefile variable '%s' of module '%s' is ignored, specify it in the config", word, name)
+        elif word.startswith("-I"):
+            extension.include_dirs.append(os.path.normpath(os.path.join(modules_dir, word[2:])))
+        elif word.startswith("-D"):
+            extension.define_macros.append(word[2:])
+        elif word.startswith("-L"):
+            extension.library_dirs.append(word[2:])
+        elif word.startswith("-l"):
+            extension.libraries.append(word[2:])
+        elif word.endswith((".c", ".cpp")):
+            extension.sources.append(os.path.normpath(os.path.join(modules_dir, word)))
+    return extension
+
+
+def find_cpython_extension(name: str, cpython_source_dir: str) -> _t.Optional[StaticExtension]:
+    """
+    Find build info of a CPython module in the Setup files of CPython's source tree
+    """
+    modules_dir = os.path.join(cpython_source_dir, "Modules")
+    for setup_file in CPYTHON_SETUP_FILES:
+        setup_path = os.path.join(modules_dir, setup_file)
+        if not os.path.isfile(setup_path):
+            continue
+        with open(setup_path, "r", encoding="utf-8") as fp:
+            for line in fp:
+                extension = parse_setup_line(line, modules_dir)
+                if extension is not None and extension.name == name:
+                    extension.include_dirs.append(modules_dir)
+                    if sys.platform == "win32":
+                        extension.libraries.extend(WINDOWS_LIBRARIES.get(name, []))
+                    return extension
+    return None
+
+
+def check_cpython_source_dir(cpython_source_dir: str) -> None:
+    """
+    The CPython sources must match the running interpreter
+    """
+    patchlevel = os.path.join(cpython_source_dir, "Include", "patchlevel.h")
+    if not os.path.isfile(patchlevel):
+        log.logger.error("'%s' is not a CPython source tree", cpython_source_dir)
+        sys.exit(1)
+    with open(patchlevel, "r", encoding="utf-8") as fp:
+        match = re.search(r'#define\s+PY_VERSION\s+"(\d+)\.(\d+)', fp.read())
+    if match is None or (int(match.group(1)), int(match.group(2))) != sys.version_info[:2]:
+        log.logger.error("CPython sources in '%s' don't match python %d.%d", cpython_source_dir, *sys.version_info[:2])
+        sys.exit(1)
+
+
+class StaticExtensionGenerator:
+
+    def __init__(self):
+        self._extensions: dict[str, StaticExtension] = {}
+        self._target_dir = os.path.join(paths.BUILD_DIR, "generated", "static_extensions")
+
+    def add_extensions(self, entries: list[_t.Union[str, dict[str, _t.Any]]], cpython_source_dir: str) -> None:
+        """
+        Add extensions from config entries
+        Args:
+            entries: module names of CPython modules, or dicts of build info:
+                {"name": ..., "sources": [...], "include_dirs": [...], "define_macros": [...], "libraries": [...], "library_dirs": [...]}
+                A dict named after a CPython module extends the build info found in the Setup files.
+            cpython_source_dir: root of CPython's source tree, needed by CPython modules
+        """
+        if cpython_source_dir:
+            check_cpython_source_dir(cpython_source_dir)
+        for entry in entries:
+            if isinstance(entry, str):
+                entry = {"name": entry}
+            name = entry["name"]
+            extension = find_cpython_extension(name, cpython_source_dir) if cpython_source_dir else None
+            if extension is None:
+                if not entry.get("sources"):
+                    log.logger.error("Can't find build info of static extension '%s', specify its sources or cpython_source_dir", name)
+                    sys.exit(1)
+                extension = StaticExtension(name, [])
+            extension.merge(entry)
+            self._extensions[name] = extension
+
+    def dump_static_extension_info(self) -> None:
+        """
+        Dump build info for cmake and the header registering the modules
+        """
+        static_extensions_path = os.path.join(paths.BUILD_DIR, "static_extensions.cmake")
+        if not self._extensions:
+            # Clear outputs of previous builds, cmake configures again if they change
+            utils.write_text_if_changed(static_extensions_path, "")
+            return
+        target_names = []
+        cmake_lines = []
+        header_lines = ["#pragma once", "#include <Python.h>", "", "#ifdef __cplusplus", 'extern "C" {', "#endif"]
+        initialize_macro_lines = ["#define INITIALIZE_STATIC_EXTENSIONS"]
+        for name, extension in self._extensions.items():
+            target_name = exported_name(name)
+            target_names.append(target_name)
+            init_function = f"PyInit_{target_name}"
+            define_macros = list(extension.define_macros)
+            if "." in name:
+                # Rename the init function after the fullname so that modules with the same name in different packages don't conflict
+                define_macros.append(f"PyInit_{name.rpartition('.')[-1]}={init_function}")
+            if extension.is_cpython_module:
+                define_macros.append("Py_BUILD_CORE_MODULE")
+            for field, values in (
+                ("SOURCES", extension.sources),
+                ("INCLUDE_DIRS", extension.include_dirs),
+                ("DEFINITIONS", define_macros),
+                ("LIBRARIES", extension.libraries),
+                ("LIBRARY_DIRS", extension.library_dirs),
+            ):
+                values = [value.replace("\\", "/") for value in values]
+                cmake_lines.append(f'set(TF_STATIC_EXTENSION_{field}_{target_name} "{";".join(values)}")')
+            header_lines.append(f"PyMODINIT_FUNC {init_function}(void);")
+            initialize_macro_lines[-1] += " \\"
+            initialize_macro_lines.append(f'    PyImport_AppendInittab("{name}", &{init_function});')
+        cmake_lines.insert(0, f'set(TF_STATIC_EXTENSIONS "{";".join(target_names)}")')
+        cmake_lines.append("")  # Extra empty line to make it prettier
+        utils.write_text_if_changed(static_extensions_path, "\n".join(cmake_lines))
+        header_lines.extend(["#ifdef __cplusplus", "}", "#endif", ""])
+        header_lines.extend(initialize_macro_lines)
+        header_lines.append("")
+        write_file(os.path.join(self._target_dir, "tfreezer_static_extensions.h"), "\n".join(header_lines))
+        log.logger.info("Statically linked extensions: %s", ", ".join(self._extensions))
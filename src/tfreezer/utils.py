@@ -5,9 +5,12 @@
 import typing as _t
 import types
 import os
-import threading
-import subprocess
-from importlib import machinery, util
+import json
+import functools
+import itertools
+import asyncio
+import contextlib
+from importlib import machinery, util, metadata
 
 from tfreezer import log
 
@@ -25,64 +28,71 @@ def iterate_all_modules(source_dir: str) -> _t.Generator[str, None, None]:
             yield module_name
 
 
-class LogPipe(threading.Thread):
-    def __init__(self, log_function: _t.Callable[[str], None]) -> None:
-        super().__init__()
-        self.daemon = False
-        self.fd_read, self.fd_write = os.pipe()
-        self.pipe_reader = os.fdopen(self.fd_read)
-        self._log_function = log_function
-        self.start()
-
-    def fileno(self) -> int:
-        """
-        Return the write file descriptor of the pipe
-        """
-        return self.fd_write
-
-    def run(self) -> None:
-        """
-        Run the thread, logging everything.
-        """
-        for line in iter(self.pipe_reader.readline, ""):
-            self._log_function(line.strip("\n"))
-        self.pipe_reader.close()
-
-    def close(self) -> None:
-        """
-        Close the write end of the pipe.
-        """
-        os.close(self.fd_write)
-
-
-_log_pipes: list[LogPipe] = []
-
-
-def close_all_log_pipe() -> None:
-    for log_pipe in _log_pipes:
-        log_pipe.close()
-
-
-def call_subprocess(args: list[str], *, cwd: str) -> int:
-    log.logger.info("Pending to run: %s\ncwd: %s", " ".join(args), cwd)
-    stdout = LogPipe(log.logger.info)
-    _log_pipes.append(stdout)
-    stderr = LogPipe(log.logger.error)
-    _log_pipes.append(stderr)
-    with subprocess.Popen(
-        args,
-        stdout=stdout,
-        stderr=stderr,
-        cwd=cwd,
-    ) as p:
-        p.wait()
-    stdout.close()
-    if stdout in _log_pipes:
-        _log_pipes.remove(stdout)
-    stderr.close()
-    if stderr in _log_pipes:
-        _log_pipes.remove(stderr)
-    return p.returncode
+# Limit of a line of subprocess output, compilers may print very long lines
+SUBPROCESS_LINE_LIMIT = 1024 * 1024
+
+
+async def _pump_stream(stream: asyncio.StreamReader, log_function: _t.Callable[[str], None], log_prefix: str) -> None:
+    """
+    Log every line of a stream until it's closed
+    """
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        log_function(f"{log_prefix}{line.decode('utf-8', errors='replace').rstrip()}")
+
+
+async def _stop_process(process: asyncio.subprocess.Process) -> None:
+    """
+    Kill the process if it's still running and close its transport,
+    so that nothing is left to the event loop when asyncio.run closes it
+    """
+    if process.returncode is None:
+        with contextlib.suppress(ProcessLookupError):
+            process.kill()
+    await process.wait()
+    process._transport.close()  # pylint: disable=protected-access
+
+
+async def call_subprocess_async(args: list[str], *, cwd: str, env: _t.Optional[dict[str, str]] = None, log_prefix: str = "") -> int:
+    """
+    Run a subprocess and log its output, both pipes are read by the event loop, no thread is needed
+    The subprocess is killed if the calling task is cancelled
+    Args:
+        log_prefix: prefix of the logged lines, to tell apart subprocesses that run at the same time
+    Returns:
+        return code of the subprocess
+    """
+    log.logger.info("%sPending to run: %s\ncwd: %s", log_prefix, " ".join(args), cwd)
+    creation = asyncio.ensure_future(
+        asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            limit=SUBPROCESS_LINE_LIMIT,
+        )
+    )
+    try:
+        # Shielded, a process created after the calling task is cancelled would be left running
+        process = await asyncio.shield(creation)
+    except asyncio.CancelledError:
+        await _stop_process(await creation)
+        raise
+    try:
+        await asyncio.gather(
+            _pump_stream(process.stdout, log.logger.info, log_prefix),
+            _pump_stream(process.stderr, log.logger.error, log_prefix),
+        )
+        return await process.wait()
+    finally:
+        await _stop_process(process)
+
+
+def call_subprocess(args: list[str], *, cwd: str, env: _t.Optional[dict[str, str]] = None) -> int:
+    return asyncio.run(call_subprocess_async(args, cwd=cwd, env=env))
 
 
 def load_signle_module(name: str, path: str) -> types.MethodType:
@@ -91,3 +101,130 @@ def load_signle_module(name: str, path: str) -> types.MethodType:
     module = util.module_from_spec(spec)
     spec.loader.exec_module(module)
     return module
+
+
+def write_text_if_changed(path: str, content: str) -> bool:
+    """
+    Write a text file only if its content changes, so that its modification time is kept for incremental builds
+    Returns:
+        whether the file is written
+    """
+    if os.path.isfile(path):
+        with open(path, "r", encoding="utf-8") as fp:
+            if fp.read() == content:
+                return False
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write(content)
+    return True
+
+
+def _escape_depfile_path(path: str) -> str:
+    return path.replace("\\", "/").replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+
+def _unescape_depfile_path(path: str) -> str:
+    return path.replace("\\ ", " ").replace("\\#", "#").replace("$$", "$")
+
+
+def write_depfile(path: str, target: str, dependencies: _t.Iterable[str]) -> None:
+    """
+    Write a Makefile style depfile, so that the build system reruns the command generating target if any dependency changes
+    Args:
+        path: path of the depfile
+        target: absolute path of the first output of the command
+        dependencies: absolute paths of the files read by the command
+    """
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    lines = [f"{_escape_depfile_path(target)}:"]
+    for dependency in sorted(set(dependencies)):
+        lines[-1] += " \\"
+        lines.append(f"  {_escape_depfile_path(dependency)}")
+    lines.append("")
+    write_text_if_changed(path, "\n".join(lines))
+
+
+def read_depfile(path: str) -> list[str]:
+    """
+    Read dependencies of a depfile written by write_depfile
+    """
+    with open(path, "r", encoding="utf-8") as fp:
+        lines = fp.read().splitlines()
+    dependencies = []
+    for line in lines[1:]:
+        line = line.strip().removesuffix(" \\")
+        if line:
+            dependencies.append(_unescape_depfile_path(line))
+    return dependencies
+
+
+def is_output_up_to_date(output: str, depfile: str, dependencies: _t.Iterable[str] = ()) -> bool:
+    """
+    Whether a build command can be skipped, the same way as the build system decides with the depfile of the command
+    Args:
+        output: the first output of the command
+        depfile: depfile written by the command
+        dependencies: dependencies that are not in the depfile
+    """
+    if not os.path.isfile(output) or not os.path.isfile(depfile):
+        return False
+    output_mtime = os.stat(output).st_mtime
+    for dependency in itertools.chain(read_depfile(depfile), dependencies):
+        if not os.path.exists(dependency) or os.stat(dependency).st_mtime > output_mtime:
+            return False
+    return True
+
+
+def load_json_cache(path: str, version: int) -> dict[str, _t.Any]:
+    """
+    Load a json cache file, return an empty dict if the file doesn't exist, is broken or is outdated
+    """
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as fp:
+            data = json.load(fp)
+    except (OSError, ValueError):
+        log.logger.warning("Cache file '%s' is broken, ignore it.", path)
+        return {}
+    if not isinstance(data, dict) or data.get("version") != version:
+        return {}
+    return data.get("data", {})
+
+
+def dump_json_cache(path: str, version: int, data: dict[str, _t.Any]) -> None:
+    """
+    Write a json cache file atomically, so that concurrent builds never see a half written file
+    """
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as fp:
+        json.dump({"version": version, "data": data}, fp, indent=1)
+    os.replace(temp_path, path)
+
+
+@functools.cache
+def _get_packages_distributions() -> _t.Mapping[str, list[str]]:
+    return metadata.packages_distributions()
+
+
+def get_distribution_version(module_name: str) -> str:
+    """
+    Get "<name>==<version>" of the distribution that provides the module without importing it
+    Args:
+        module_name: fullname of the module
+    Returns:
+        str, empty if the module doesn't belong to any installed distribution
+    """
+    top_level_name = module_name.partition(".")[0]
+    distribution_names = _get_packages_distributions().get(top_level_name, [])
+    versions = []
+    for distribution_name in sorted(set(distribution_names)):
+        try:
+            versions.append(f"{distribution_name}=={metadata.version(distribution_name)}")
+        except metadata.PackageNotFoundError:
+            continue
+    return ",".join(versions)